@@ -1,6 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
+import os
+import time
+import asyncio
+import threading
 import logging
 from datetime import datetime
 
@@ -9,8 +13,18 @@ from app.core.auth import (
     generate_api_key,
     APIKeyCreate,
     APIKeyResponse,
-    API_KEYS
+    list_api_keys as list_stored_api_keys,
+    revoke_api_key as revoke_stored_api_key
 )
+from app.services.registry import registry
+from app.core.config import settings
+from app.core.profiling import route_profiler, sampling_profiler, ProfileRunningError
+from app.services.usage_log import usage_log
+from app.services.analytics import usage_rollups, AnalyticsUnavailableError
+from app.services.cache_warmer import cache_warmer, WarmJobRunningError
+from app.services.file_store import file_store, StoredFileNotFoundError
+from app.services import extraction
+from app.cache.redis import cache
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +35,7 @@ router = APIRouter()
 async def create_api_key(request: APIKeyCreate):
     """Create a new API key (admin only)"""
     try:
-        api_key = generate_api_key(name=request.name, role=request.role)
+        api_key = generate_api_key(name=request.name, role=request.role, daily_token_quota=request.daily_token_quota)
         logger.info(f"New API key created for {request.name} with role {request.role}")
         return api_key
     except Exception as e:
@@ -34,12 +48,13 @@ async def list_api_keys():
     """List all API keys (admin only)"""
     try:
         keys = []
-        for key, data in API_KEYS.items():
+        for data in list_stored_api_keys():
             keys.append({
-                "key": key[:8] + "...",  # Only show first 8 chars for security
+                "key": data.get("key_prefix", "")[:8] + "...",  # Only show first 8 chars for security
                 "name": data.get("name", ""),
                 "role": data.get("role", "user"),
-                "created_at": data.get("created_at", 0)
+                "created_at": data.get("created_at", 0),
+                "daily_token_quota": data.get("daily_token_quota")
             })
         return {"keys": keys}
     except Exception as e:
@@ -51,18 +66,11 @@ async def list_api_keys():
 async def revoke_api_key(key_prefix: str):
     """Revoke an API key by its prefix (admin only)"""
     try:
-        # Find the key that starts with the given prefix
-        key_to_revoke = None
-        for key in API_KEYS.keys():
-            if key.startswith(key_prefix):
-                key_to_revoke = key
-                break
-        
-        if not key_to_revoke:
+        # Remove the key that starts with the given prefix
+        user_data = revoke_stored_api_key(key_prefix)
+        if user_data is None:
             raise HTTPException(status_code=404, detail=f"API key with prefix {key_prefix} not found")
         
-        # Remove the key
-        user_data = API_KEYS.pop(key_to_revoke)
         logger.info(f"API key for {user_data.get('name', 'unknown')} has been revoked")
         
         return {"message": f"API key for {user_data.get('name', 'unknown')} has been revoked"}
@@ -70,4 +78,219 @@ async def revoke_api_key(key_prefix: str):
         raise
     except Exception as e:
         logger.error(f"Error revoking API key: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Show the upstream key pools of every provider (admin only)
+@router.get("/providers", dependencies=[Depends(validate_admin)])
+async def list_providers():
+    """List providers with the usage and health of their upstream keys (admin only)"""
+    return {
+        "providers": {
+            name: {
+                "endpoint": client.endpoint,
+                "models": client.models,
+                "keys": client.key_pool.status()
+            }
+            for name, client in registry.clients.items()
+        }
+    }
+
+# Put a disabled upstream key back into rotation (admin only)
+@router.post("/providers/{provider}/keys/{key_id}/enable", dependencies=[Depends(validate_admin)])
+async def enable_provider_key(provider: str, key_id: str):
+    """Re-enable an upstream key that was taken out of rotation (admin only)"""
+    client = registry.get(provider)
+    if not client or not client.key_pool.enable(key_id):
+        raise HTTPException(status_code=404, detail=f"Key {key_id} of provider {provider} not found")
+    logger.info(f"{provider} key {key_id} re-enabled")
+    return {"message": f"Key {key_id} of provider {provider} re-enabled"}
+
+# Show the state of the usage log pipeline (admin only)
+@router.get("/usage-log", dependencies=[Depends(validate_admin)])
+async def usage_log_status():
+    """Get the records buffered, written and dropped by this worker's usage log (admin only)"""
+    return usage_log.status()
+
+def _analytics_range(start: Optional[datetime], end: Optional[datetime]):
+    """Unix times of a query range, the last 24 hours by default"""
+    end_time = end.timestamp() if end else time.time()
+    start_time = start.timestamp() if start else end_time - 86400
+    return start_time, end_time
+
+async def _analytics(query, *args):
+    try:
+        return await asyncio.to_thread(query, *args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except AnalyticsUnavailableError as e:
+        logger.error(f"Analytics unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Analytics are unavailable")
+
+# Usage statistics over a time range from the rollups (admin only)
+@router.get("/analytics", dependencies=[Depends(validate_admin)])
+async def usage_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    group_by: str = Query("all", description="all, provider, key or model"),
+    granularity: Optional[str] = Query(None, description="minute, hour or day; picked from the range when not set")
+):
+    """Get latency percentiles, error rates, tokens and cache savings per provider, key or model (admin only)"""
+    start_time, end_time = _analytics_range(start, end)
+    return await _analytics(usage_rollups.summary, start_time, end_time, group_by, granularity)
+
+# Usage statistics per time bucket from the rollups (admin only)
+@router.get("/analytics/timeseries", dependencies=[Depends(validate_admin)])
+async def usage_analytics_timeseries(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    group_by: str = Query("all", description="all, provider, key or model"),
+    value: str = Query("", description="provider name, key id or model; empty with group_by=all"),
+    granularity: Optional[str] = Query(None, description="minute, hour or day; picked from the range when not set")
+):
+    """Get the usage statistics of one provider, key or model per minute, hour or day (admin only)"""
+    start_time, end_time = _analytics_range(start, end)
+    return await _analytics(usage_rollups.timeseries, start_time, end_time, group_by, value, granularity)
+
+class WarmRequest(BaseModel):
+    """Prompts of a cache warming job: the most requested ones, a list, or an uploaded file"""
+    top: Optional[int] = None  # the N most requested prompts of the last CACHE_WARM_HISTORY_DAYS days
+    prompts: Optional[List[str]] = None
+    file_id: Optional[str] = None  # a file from /api/general/files, one prompt per line (or a JSON string per line)
+
+def _read_prompt_file(file_id: str) -> List[str]:
+    """Prompts of an uploaded file, one per line; lines that are JSON strings are decoded"""
+    file_data = file_store.get(file_id)
+    prompts = []
+    with open(file_store.blob_path(file_data["sha256"]), encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('"'):
+                try:
+                    line = extraction.loads(line)
+                except ValueError:
+                    pass
+            prompts.append(line)
+            if len(prompts) >= settings.CACHE_WARM_MAX_PROMPTS:
+                break
+    return prompts
+
+# Start a cache warming job (admin only)
+@router.post("/cache/warm", dependencies=[Depends(validate_admin)])
+async def start_cache_warming(request: WarmRequest):
+    """Refill the response cache in the background with popular or given prompts (admin only)"""
+    if request.prompts is not None:
+        prompts, source = request.prompts, "list"
+    elif request.file_id:
+        try:
+            prompts = await asyncio.to_thread(_read_prompt_file, request.file_id)
+        except (StoredFileNotFoundError, FileNotFoundError):
+            raise HTTPException(status_code=404, detail=f"File with ID {request.file_id} not found")
+        except (ValueError, UnicodeDecodeError):
+            raise HTTPException(status_code=400, detail="The prompt file must be UTF-8 text")
+        source = f"file:{request.file_id}"
+    else:
+        if settings.CACHE_WARM_HISTORY_DAYS <= 0:
+            raise HTTPException(status_code=400, detail="Prompt popularity is not tracked (CACHE_WARM_HISTORY_DAYS is 0)")
+        top = min(request.top or 100, settings.CACHE_WARM_MAX_PROMPTS)
+        prompts = [entry["prompt"] for entry in cache.get_popular_prompts(top)]
+        source = f"top:{top}"
+    prompts = prompts[:settings.CACHE_WARM_MAX_PROMPTS]
+    if not prompts:
+        raise HTTPException(status_code=400, detail="No prompts to warm")
+    try:
+        return cache_warmer.start(prompts, source)
+    except WarmJobRunningError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+# Progress of the current or last cache warming job (admin only)
+@router.get("/cache/warm", dependencies=[Depends(validate_admin)])
+async def cache_warming_status():
+    """Get the progress of the current or last cache warming job (admin only)"""
+    job = cache_warmer.status()
+    if job is None:
+        raise HTTPException(status_code=404, detail="No cache warming job has run")
+    return job
+
+# Cancel the running cache warming job (admin only)
+@router.delete("/cache/warm", dependencies=[Depends(validate_admin)])
+async def cancel_cache_warming():
+    """Stop the running cache warming job after its current prompt (admin only)"""
+    if not cache_warmer.cancel():
+        raise HTTPException(status_code=404, detail="No cache warming job is running")
+    return {"message": "Cache warming job cancelled"}
+
+# Most requested prompts, the default input of cache warming (admin only)
+@router.get("/cache/popular-prompts", dependencies=[Depends(validate_admin)])
+async def popular_prompts(limit: int = Query(20, ge=1, le=1000)):
+    """List the most requested prompts of the last CACHE_WARM_HISTORY_DAYS days (admin only)"""
+    return {"prompts": cache.get_popular_prompts(limit)}
+
+# Size, memory use, hit rates and most hit keys of the response cache (admin only)
+@router.get("/cache", dependencies=[Depends(validate_admin)])
+async def cache_stats(top: int = Query(20, ge=1, le=1000)):
+    """Get the size, memory use, hit rates per route, tags and most hit keys of the cache (admin only)"""
+    try:
+        return await asyncio.to_thread(cache.get_cache_stats, top)
+    except Exception as e:
+        logger.error(f"Error getting cache stats: {str(e)}")
+        raise HTTPException(status_code=503, detail="Cache is unavailable")
+
+# Look at one cached response (admin only)
+@router.get("/cache/entries/{key}", dependencies=[Depends(validate_admin)])
+async def inspect_cache_entry(key: str):
+    """Get a cached response with its expiration, size and hits (admin only)"""
+    try:
+        entry = cache.inspect(key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Cache entry {key} not found")
+    return entry
+
+# Delete cached responses by provider, model and/or route (admin only)
+@router.delete("/cache", dependencies=[Depends(validate_admin)])
+async def invalidate_cache(
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    route: Optional[str] = Query(None, description="generate, chat or proxy")
+):
+    """Delete the cached responses matching all the given tags (admin only)"""
+    try:
+        deleted = await asyncio.to_thread(cache.invalidate, {"provider": provider, "model": model, "route": route})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"deleted": deleted}
+
+# Sample the stacks of the worker answering the request (admin only)
+@router.post("/profile", dependencies=[Depends(validate_admin)])
+async def take_profile(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    loop_only: bool = Query(False, description="sample only the event loop thread")
+):
+    """Run the sampling profiler and return collapsed stacks, for flamegraph.pl or speedscope (admin only)"""
+    if seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {settings.PROFILE_MAX_SECONDS:g}")
+    # This handler runs on the event loop thread
+    thread_id = threading.get_ident() if loop_only else None
+    try:
+        profile, samples = await asyncio.to_thread(sampling_profiler.sample, seconds, interval_ms / 1000, thread_id)
+    except ProfileRunningError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(content=profile, media_type="text/plain",
+                    headers={"X-Profile-Samples": str(samples), "X-Worker-Pid": str(os.getpid())})
+
+# Wall, event loop and CPU time per route (admin only)
+@router.get("/profile/routes", dependencies=[Depends(validate_admin)])
+async def route_profile():
+    """Get the time requests of each route spend, hold the event loop and use CPU in this worker (admin only)"""
+    return route_profiler.status()
+
+# Start the route counters over (admin only)
+@router.delete("/profile/routes", dependencies=[Depends(validate_admin)])
+async def reset_route_profile():
+    """Reset the per-route counters of this worker (admin only)"""
+    route_profiler.reset()
+    return {"message": "Route counters reset"}
@@ -1,13 +1,21 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, Body, Query, Path
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, Body, Query, Path, Header
 from pydantic import BaseModel, Field
 from typing import Dict, Any, List, Optional, Union
+import os
+import asyncio
 import logging
 import time
 import json
 from datetime import datetime
+from urllib.parse import quote
 
 from app.cache.redis import cache
 from app.core.config import settings
+from app.services.registry import registry
+from app.services.data_store import data_store, error_status, FILTER_OPS
+from app.services.file_store import (
+    file_store, error_status as file_error_status, parse_range, InvalidRangeError, COPY_BUFFER_SIZE, MAX_PARTS
+)
 
 logger = logging.getLogger(__name__)
 
@@ -34,126 +42,195 @@ class ErrorResponse(BaseModel):
     error_code: str = Field(..., description="Error code")
     timestamp: str = Field(default_factory=lambda: datetime.now().isoformat(), description="Response timestamp")
 
-# Generic CRUD endpoints
+def _expected_version(if_match: Optional[str]) -> Optional[int]:
+    """Parse the record version from an If-Match header ("3", "\"3\"" or "W/\"3\"")"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a record version")
+
+def _store_error(e: Exception) -> HTTPException:
+    """Map data store errors to HTTP errors"""
+    status_code = error_status(e)
+    if status_code == 500:
+        logger.error(f"Data store error: {str(e)}")
+    return HTTPException(status_code=status_code, detail=str(e))
+
+def _parse_filter(expression: str):
+    """Parse a `field:op:value` filter; the value is read as JSON when possible (5, true, "5")"""
+    try:
+        field, op, raw = expression.split(":", 2)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid filter {expression}, expected field:op:value")
+    if op not in FILTER_OPS:
+        raise HTTPException(status_code=400, detail=f"Invalid filter operator {op}, expected one of {', '.join(FILTER_OPS)}")
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        value = raw
+    return field, op, value
+
+class BulkUpdate(BaseModel):
+    """One update of a bulk request"""
+    id: str = Field(..., description="The ID of the data to update")
+    data: Dict[str, Any] = Field(..., description="Fields to set")
+    version: Optional[int] = Field(default=None, description="Only update if the record is still at this version")
+    remove_nulls: bool = Field(default=False, description="Remove the fields set to null (merge patch)")
+
+class BulkDelete(BaseModel):
+    """One delete of a bulk request"""
+    id: str = Field(..., description="The ID of the data to delete")
+    version: Optional[int] = Field(default=None, description="Only delete if the record is still at this version")
+
+class BulkRequest(BaseModel):
+    """Many creates, updates and deletes applied in one round trip to Redis"""
+    create: List[Dict[str, Any]] = Field(default_factory=list, description="Data of the entries to create")
+    update: List[BulkUpdate] = Field(default_factory=list, description="Entries to update")
+    delete: List[BulkDelete] = Field(default_factory=list, description="Entries to delete")
+
+# Generic CRUD endpoints. Responses carry the record version in an ETag header;
+# send it back in If-Match to only update or delete the version you have read.
 @router.post("/data", response_model=GenericResponse, description="Create a new data entry")
-async def create_data(request: GenericRequest):
+async def create_data(request: GenericRequest, response: Response):
     """Create a new data entry"""
     try:
-        # Generate a unique ID for the data
-        import uuid
-        data_id = str(uuid.uuid4())
-        
-        # Add timestamp
-        timestamp = datetime.now().isoformat()
-        
-        # Prepare data to store
-        data_to_store = {
-            "id": data_id,
-            "created_at": timestamp,
-            "updated_at": timestamp,
-            **request.data
+        record = data_store.create(request.data)
+    except Exception as e:
+        raise _store_error(e)
+    
+    response.headers["ETag"] = f'"{record["version"]}"'
+    return GenericResponse(
+        data={"id": record["id"], "version": record["version"], **request.data},
+        metadata={
+            "created_at": record["created_at"],
+            **(request.metadata or {})
         }
-        
-        # Store in cache (in a real app, you might want to use a database)
-        cache_key = f"data:{data_id}"
-        cache.set(cache_key, data_to_store)
-        
-        return GenericResponse(
-            data={"id": data_id, **request.data},
-            metadata={
-                "created_at": timestamp,
-                **(request.metadata or {})
-            }
+    )
+
+@router.get("/data", response_model=GenericResponse, description="List data, optionally filtered")
+async def list_data(
+    filter: List[str] = Query(default=[], description="field:op:value with op one of eq, gt, gte, lt, lte; repeat to AND filters"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(50, ge=1, le=settings.DATA_PAGE_MAX, description="Maximum number of entries")
+):
+    """List data in ID order with cursor pagination. Filters are served by the
+    indexes kept on every top-level number, string and boolean field; strings
+    compare by code point and booleans only with eq."""
+    filters = [_parse_filter(expression) for expression in filter]
+    try:
+        records, next_cursor = data_store.query(filters, cursor=cursor, limit=limit)
+    except Exception as e:
+        raise _store_error(e)
+    
+    return GenericResponse(
+        data={"items": records, "next_cursor": next_cursor},
+        metadata={
+            "count": len(records),
+            "retrieved_at": datetime.now().isoformat()
+        }
+    )
+
+@router.post("/data/bulk", response_model=GenericResponse, description="Create, update and delete data in bulk")
+async def bulk_data(request: BulkRequest):
+    """Apply many operations in one pipelined round trip. Every operation is
+    atomic on its own and gets its own result; the batch as a whole is not."""
+    size = len(request.create) + len(request.update) + len(request.delete)
+    if size > settings.DATA_BULK_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {settings.DATA_BULK_MAX} operations per bulk request")
+    try:
+        results = data_store.bulk(
+            create=request.create,
+            update=[item.model_dump() for item in request.update],
+            delete=[item.model_dump() for item in request.delete]
         )
     except Exception as e:
-        logger.error(f"Error creating data: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _store_error(e)
+    
+    failed = sum(1 for items in results.values() for item in items if "error" in item)
+    return GenericResponse(
+        data=results,
+        metadata={
+            "operations": size,
+            "failed": failed,
+            "processed_at": datetime.now().isoformat()
+        }
+    )
 
 @router.get("/data/{data_id}", response_model=GenericResponse, description="Get data by ID")
-async def get_data(data_id: str = Path(..., description="The ID of the data to retrieve")):
+async def get_data(response: Response, data_id: str = Path(..., description="The ID of the data to retrieve")):
     """Get data by ID"""
     try:
-        # Retrieve from cache
-        cache_key = f"data:{data_id}"
-        data = cache.get(cache_key)
-        
-        if not data:
-            raise HTTPException(status_code=404, detail=f"Data with ID {data_id} not found")
-        
-        return GenericResponse(
-            data=data,
-            metadata={
-                "retrieved_at": datetime.now().isoformat()
-            }
-        )
-    except HTTPException:
-        raise
+        record = data_store.get(data_id)
     except Exception as e:
-        logger.error(f"Error retrieving data: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _store_error(e)
+    
+    response.headers["ETag"] = f'"{record["version"]}"'
+    return GenericResponse(
+        data=record,
+        metadata={
+            "retrieved_at": datetime.now().isoformat()
+        }
+    )
 
 @router.put("/data/{data_id}", response_model=GenericResponse, description="Update data by ID")
 async def update_data(
     request: GenericRequest,
-    data_id: str = Path(..., description="The ID of the data to update")
+    response: Response,
+    data_id: str = Path(..., description="The ID of the data to update"),
+    if_match: Optional[str] = Header(None, description="Only update if the record is still at this version")
+):
+    """Update data by ID (the given fields are merged into the record)"""
+    return _update(data_id, request, response, if_match, remove_nulls=False)
+
+@router.patch("/data/{data_id}", response_model=GenericResponse, description="Partially update data by ID")
+async def patch_data(
+    request: GenericRequest,
+    response: Response,
+    data_id: str = Path(..., description="The ID of the data to update"),
+    if_match: Optional[str] = Header(None, description="Only update if the record is still at this version")
 ):
-    """Update data by ID"""
+    """Partially update data by ID (JSON merge patch: fields set to null are removed)"""
+    return _update(data_id, request, response, if_match, remove_nulls=True)
+
+def _update(data_id: str, request: GenericRequest, response: Response, if_match: Optional[str],
+            remove_nulls: bool) -> GenericResponse:
     try:
-        # Retrieve existing data
-        cache_key = f"data:{data_id}"
-        existing_data = cache.get(cache_key)
-        
-        if not existing_data:
-            raise HTTPException(status_code=404, detail=f"Data with ID {data_id} not found")
-        
-        # Update data
-        updated_data = {
-            **existing_data,
-            **request.data,
-            "updated_at": datetime.now().isoformat()
-        }
-        
-        # Store updated data
-        cache.set(cache_key, updated_data)
-        
-        return GenericResponse(
-            data=updated_data,
-            metadata={
-                "updated_at": updated_data["updated_at"],
-                **(request.metadata or {})
-            }
-        )
+        record = data_store.update(data_id, request.data, _expected_version(if_match), remove_nulls=remove_nulls)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error updating data: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _store_error(e)
+    
+    response.headers["ETag"] = f'"{record["version"]}"'
+    return GenericResponse(
+        data=record,
+        metadata={
+            "updated_at": record["updated_at"],
+            **(request.metadata or {})
+        }
+    )
 
 @router.delete("/data/{data_id}", response_model=GenericResponse, description="Delete data by ID")
-async def delete_data(data_id: str = Path(..., description="The ID of the data to delete")):
+async def delete_data(
+    data_id: str = Path(..., description="The ID of the data to delete"),
+    if_match: Optional[str] = Header(None, description="Only delete if the record is still at this version")
+):
     """Delete data by ID"""
     try:
-        # Retrieve existing data to confirm it exists
-        cache_key = f"data:{data_id}"
-        existing_data = cache.get(cache_key)
-        
-        if not existing_data:
-            raise HTTPException(status_code=404, detail=f"Data with ID {data_id} not found")
-        
-        # Delete data
-        cache.delete(cache_key)
-        
-        return GenericResponse(
-            data={"id": data_id, "deleted": True},
-            metadata={
-                "deleted_at": datetime.now().isoformat()
-            }
-        )
+        data_store.delete(data_id, _expected_version(if_match))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error deleting data: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _store_error(e)
+    
+    return GenericResponse(
+        data={"id": data_id, "deleted": True},
+        metadata={
+            "deleted_at": datetime.now().isoformat()
+        }
+    )
 
 @router.get("/health", description="Health check endpoint")
 async def health_check():
@@ -162,12 +239,17 @@ async def health_check():
         # Check Redis connection
         redis_ok = cache.redis_client.ping()
         
+        # Circuit breaker state of every provider
+        providers = {name: client.breaker.status() for name, client in registry.clients.items()}
+        providers_ok = any(provider["state"] != "open" for provider in providers.values())
+        
         return GenericResponse(
             data={
-                "status": "healthy" if redis_ok else "degraded",
+                "status": "healthy" if redis_ok and providers_ok else "degraded",
                 "services": {
                     "redis": "up" if redis_ok else "down"
-                }
+                },
+                "providers": providers
             },
             metadata={
                 "checked_at": datetime.now().isoformat()
@@ -189,63 +271,216 @@ async def health_check():
             error=str(e)
         )
 
-# File upload/download endpoints (mock implementation)
-class FileMetadata(BaseModel):
-    """File metadata model"""
+# File upload/download endpoints. Bodies are raw bytes streamed to the file
+# store chunk by chunk; large files can be sent as a resumable upload in parts.
+class UploadSession(BaseModel):
+    """Start of a resumable upload"""
     filename: str = Field(..., description="Original filename")
-    content_type: str = Field(..., description="File content type")
-    size: int = Field(..., description="File size in bytes")
+    content_type: str = Field("application/octet-stream", description="File content type")
+
+class BlobResponse(Response):
+    """Response with a byte range of a stored file.
+
+    The bytes are handed to the server as a zero-copy send (sendfile) when it
+    offers the ASGI `http.response.zerocopy` extension, and otherwise read with
+    pread() in chunks, so a download never holds more than one chunk in memory.
+    """
+    chunk_size = COPY_BUFFER_SIZE
+
+    def __init__(self, path: str, offset: int, length: int, status_code: int = 200,
+                 headers: Optional[Dict[str, str]] = None, media_type: Optional[str] = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.headers["content-length"] = str(length)
 
-@router.post("/files", response_model=GenericResponse, description="Upload a file (mock)")
-async def upload_file(file_metadata: FileMetadata):
-    """Mock file upload endpoint"""
+    async def __call__(self, scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopy", "file": f, "offset": self.offset,
+                            "count": self.length, "more_body": False})
+                return
+            offset, remaining = self.offset, self.length
+            while remaining:
+                chunk = os.pread(f.fileno(), min(self.chunk_size, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": bool(remaining)})
+            if remaining:
+                # The file shrank under us; end the body rather than leave the client waiting
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def _file_error(e: Exception) -> HTTPException:
+    """Map file store errors to HTTP errors"""
+    status_code = file_error_status(e)
+    if status_code == 500:
+        logger.error(f"File store error: {str(e)}")
+    headers = {"Content-Range": f"bytes */{e.size}"} if isinstance(e, InvalidRangeError) else None
+    return HTTPException(status_code=status_code, detail=str(e), headers=headers)
+
+@router.post("/files", response_model=GenericResponse, description="Upload a file")
+async def upload_file(
+    request: Request,
+    filename: str = Query(..., description="Original filename"),
+    content_type: Optional[str] = Header(None, description="File content type")
+):
+    """Upload a file sent as the raw request body. Identical content is stored once."""
     try:
-        # Generate a file ID
-        import uuid
-        file_id = str(uuid.uuid4())
-        
-        # In a real implementation, you would save the file to disk or cloud storage
-        # Here we just store the metadata in cache
-        file_data = {
-            "id": file_id,
-            **file_metadata.dict(),
+        file_data = await file_store.save(request.stream(), filename, content_type or "application/octet-stream")
+    except Exception as e:
+        raise _file_error(e)
+    
+    return GenericResponse(
+        data={
+            "file_id": file_data["id"],
+            "filename": file_data["filename"],
+            "content_type": file_data["content_type"],
+            "size": file_data["size"],
+            "sha256": file_data["sha256"]
+        },
+        metadata={
+            "uploaded_at": file_data["uploaded_at"]
+        }
+    )
+
+@router.post("/files/uploads", response_model=GenericResponse, description="Start a resumable upload")
+async def create_upload(session: UploadSession):
+    """Start a resumable upload. Send the parts with PUT, then complete it."""
+    try:
+        upload = file_store.create_upload(session.filename, session.content_type)
+    except Exception as e:
+        raise _file_error(e)
+    
+    return GenericResponse(
+        data=upload,
+        metadata={
+            "expires_in": settings.FILE_UPLOAD_TTL
+        }
+    )
+
+@router.get("/files/uploads/{upload_id}", response_model=GenericResponse, description="Get a resumable upload")
+async def get_upload(upload_id: str = Path(..., description="The ID of the upload")):
+    """Get an upload with the parts received so far, to resume it after an interruption"""
+    try:
+        upload = file_store.get_upload(upload_id)
+    except Exception as e:
+        raise _file_error(e)
+    
+    return GenericResponse(
+        data=upload,
+        metadata={
+            "retrieved_at": datetime.now().isoformat()
+        }
+    )
+
+@router.put("/files/uploads/{upload_id}/parts/{part_number}", response_model=GenericResponse,
+            description="Upload one part of a resumable upload")
+async def upload_part(
+    request: Request,
+    upload_id: str = Path(..., description="The ID of the upload"),
+    part_number: int = Path(..., ge=1, le=MAX_PARTS, description="Position of the part in the file")
+):
+    """Upload one part as the raw request body. Sending a part again replaces it;
+    an interrupted part is not recorded and has to be sent again."""
+    try:
+        part = await file_store.write_part(upload_id, part_number, request.stream())
+    except Exception as e:
+        raise _file_error(e)
+    
+    return GenericResponse(
+        data={"upload_id": upload_id, **part},
+        metadata={
             "uploaded_at": datetime.now().isoformat()
         }
-        
-        cache_key = f"file:{file_id}"
-        cache.set(cache_key, file_data)
-        
-        return GenericResponse(
-            data={
-                "file_id": file_id,
-                **file_metadata.dict()
-            },
-            metadata={
-                "uploaded_at": file_data["uploaded_at"]
-            }
-        )
+    )
+
+@router.post("/files/uploads/{upload_id}/complete", response_model=GenericResponse,
+             description="Complete a resumable upload")
+async def complete_upload(upload_id: str = Path(..., description="The ID of the upload")):
+    """Join the parts in part order into a file"""
+    try:
+        file_data = await asyncio.to_thread(file_store.complete_upload, upload_id)
     except Exception as e:
-        logger.error(f"Error uploading file: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _file_error(e)
+    
+    return GenericResponse(
+        data={
+            "file_id": file_data["id"],
+            "filename": file_data["filename"],
+            "content_type": file_data["content_type"],
+            "size": file_data["size"],
+            "sha256": file_data["sha256"]
+        },
+        metadata={
+            "uploaded_at": file_data["uploaded_at"]
+        }
+    )
+
+@router.delete("/files/uploads/{upload_id}", response_model=GenericResponse, description="Abort a resumable upload")
+async def abort_upload(upload_id: str = Path(..., description="The ID of the upload")):
+    """Abort an upload and drop its parts"""
+    try:
+        file_store.abort_upload(upload_id)
+    except Exception as e:
+        raise _file_error(e)
+    
+    return GenericResponse(
+        data={"upload_id": upload_id, "aborted": True},
+        metadata={
+            "aborted_at": datetime.now().isoformat()
+        }
+    )
 
 @router.get("/files/{file_id}", response_model=GenericResponse, description="Get file metadata")
 async def get_file_metadata(file_id: str = Path(..., description="The ID of the file")):
     """Get file metadata"""
     try:
-        cache_key = f"file:{file_id}"
-        file_data = cache.get(cache_key)
-        
-        if not file_data:
-            raise HTTPException(status_code=404, detail=f"File with ID {file_id} not found")
-        
-        return GenericResponse(
-            data=file_data,
-            metadata={
-                "retrieved_at": datetime.now().isoformat()
-            }
-        )
-    except HTTPException:
-        raise
+        file_data = file_store.get(file_id)
+    except Exception as e:
+        raise _file_error(e)
+    
+    return GenericResponse(
+        data=file_data,
+        metadata={
+            "retrieved_at": datetime.now().isoformat()
+        }
+    )
+
+@router.get("/files/{file_id}/content", description="Download a file")
+async def download_file(
+    file_id: str = Path(..., description="The ID of the file"),
+    range: Optional[str] = Header(None, description="bytes=start-end to download part of the file"),
+    if_range: Optional[str] = Header(None, description="Only honour Range if the file still has this ETag"),
+    if_none_match: Optional[str] = Header(None, description="ETag of a copy the client already has")
+):
+    """Download a file, or one byte range of it. The ETag is the SHA-256 of the content."""
+    try:
+        file_data = file_store.get(file_id)
+    except Exception as e:
+        raise _file_error(e)
+    
+    etag = f'"{file_data["sha256"]}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file_data['filename'])}"
+    }
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    
+    size = file_data["size"]
+    try:
+        byte_range = parse_range(range, size) if not if_range or if_range.strip() == etag else None
     except Exception as e:
-        logger.error(f"Error retrieving file metadata: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise _file_error(e)
+    
+    path = file_store.blob_path(file_data["sha256"])
+    if byte_range is None:
+        return BlobResponse(path, 0, size, headers=headers, media_type=file_data["content_type"])
+    offset, length = byte_range
+    headers["Content-Range"] = f"bytes {offset}-{offset + length - 1}/{size}"
+    return BlobResponse(path, offset, length, status_code=206, headers=headers, media_type=file_data["content_type"])
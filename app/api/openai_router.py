@@ -0,0 +1,180 @@
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Dict, Any, List, Optional, Iterator
+import asyncio
+import hashlib
+import logging
+import requests
+from app.services.api_client import APIClient, UpstreamError
+from app.services.adapters import OpenAIAdapter
+from app.services.registry import registry
+from app.services.tokens import estimate_messages_tokens, make_usage, ASCII_CHARS_PER_TOKEN
+from app.services import extraction
+from app.services import usage_log
+from app.cache.redis import cache
+from app.core.auth import validate_api_key, check_token_quota, record_token_usage
+from app.core.config import settings
+from app.core.tracing import tracer
+from app.core.deadline import run_until_disconnect
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# OpenAI-compatible proxy. Request bodies are forwarded to providers speaking the
+# OpenAI wire format as is (only re-serialized when the model has to be swapped)
+# and responses, streamed or not, are relayed byte for byte. The body is parsed
+# once for routing; the gateway's caching, rate limiting, quotas and failover
+# apply as for every other endpoint.
+
+def _openai_clients(model: Optional[str]) -> List[APIClient]:
+    """Providers speaking the OpenAI wire format, in routing order"""
+    served = model and any(client.supports_model(model) for client in registry.clients.values())
+    return [
+        client for client in registry.candidates(model=model if served else None, strategy=settings.ROUTING_STRATEGY)
+        if isinstance(client.adapter, OpenAIAdapter)
+    ]
+
+def _relay_headers(provider: str, cached: bool) -> Dict[str, str]:
+    return {"X-Provider": provider, "X-Cache": "HIT" if cached else "MISS"}
+
+@router.get("/models")
+async def list_models():
+    """List the models served by OpenAI-compatible providers"""
+    models = {}
+    for client in registry.clients.values():
+        if isinstance(client.adapter, OpenAIAdapter):
+            for model in client.models:
+                models.setdefault(model, client.api_name)
+    return {
+        "object": "list",
+        "data": [{"id": model, "object": "model", "owned_by": provider} for model, provider in models.items()],
+    }
+
+@router.post("/chat/completions")
+async def chat_completions(request: Request, user: Dict[str, Any] = Depends(validate_api_key)):
+    """Proxy an OpenAI chat completions request to the best available provider"""
+    # Read the body before watching for the client to disconnect
+    body = await request.body()
+    return await run_until_disconnect(request, _proxy_chat_completions(body, user))
+
+async def _proxy_chat_completions(body: bytes, user: Dict[str, Any]):
+    """Forward a chat completions body to the first provider that accepts it"""
+    try:
+        data = extraction.loads(body)
+        messages = data["messages"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object with messages")
+    if not isinstance(messages, list) or not messages or not all(isinstance(message, dict) for message in messages):
+        raise HTTPException(status_code=400, detail="messages must be a non-empty list of message objects")
+    if not all(isinstance(message.get("content"), (str, list, type(None))) for message in messages):
+        raise HTTPException(status_code=400, detail="message content must be a string or a list of content parts")
+    # max_completion_tokens is the newer name of max_tokens
+    max_tokens = next((data[name] for name in ("max_completion_tokens", "max_tokens")
+                       if data.get(name) is not None), 1024)
+    if not isinstance(max_tokens, int) or isinstance(max_tokens, bool) or max_tokens <= 0:
+        raise HTTPException(status_code=400, detail="max_tokens must be a positive integer")
+    model = data.get("model")
+    stream = bool(data.get("stream"))
+
+    # Byte-identical requests get byte-identical responses
+    cache_key = f"proxy:{hashlib.sha256(body).hexdigest()}"
+    cached_response = cache.get(cache_key, route="proxy")
+    if cached_response:
+        logger.info(f"Using cached proxy response from {cached_response['api_name']}")
+        usage_log.annotate(provider=cached_response["api_name"], model=model, cache_tier="proxy")
+        return Response(
+            content=cached_response["body"].encode(),
+            media_type="text/event-stream" if stream else "application/json",
+            headers=_relay_headers(cached_response["api_name"], True)
+        )
+
+    # Enforce the daily token quota of the caller's API key
+    check_token_quota(user)
+
+    prompt_tokens = estimate_messages_tokens(messages)
+    estimated_tokens = prompt_tokens + max_tokens
+
+    for client in _openai_clients(model):
+        if not client.check_availability(estimated_tokens):
+            continue
+
+        # Forward the original bytes unless the provider needs its own model name
+        upstream_body = body
+        if not model or not client.supports_model(model):
+            upstream_body = extraction.dumps(dict(data, model=client.default_model))
+
+        try:
+            with tracer.span("generate", desc=client.api_name):
+                response, upstream_key = await asyncio.to_thread(
+                    client.forward, upstream_body, estimated_tokens, stream
+                )
+        except UpstreamError as e:
+            if e.status_code and 400 <= e.status_code < 500 and not e.retryable:
+                # The request itself is invalid, another provider would reject it too
+                raise HTTPException(status_code=e.status_code, detail=str(e))
+            logger.error(f"Error proxying to {client.api_name}: {str(e)}")
+            continue
+        except Exception as e:
+            logger.error(f"Error proxying to {client.api_name}: {str(e)}")
+            continue
+
+        served_model = model if upstream_body is body else client.default_model
+        usage_log.annotate(model=served_model)
+        cache_tags = {"provider": client.api_name, "model": served_model, "route": "proxy"}
+        if stream:
+            return StreamingResponse(
+                _relay_stream(client, response, upstream_key, user, cache_key, cache_tags, prompt_tokens,
+                              estimated_tokens),
+                media_type=response.headers.get("content-type", "text/event-stream"),
+                headers=_relay_headers(client.api_name, False)
+            )
+
+        content = response.content
+        try:
+            usage = extraction.openai_usage(extraction.loads(content))
+        except ValueError:
+            usage = None  # the reservation is kept as the usage
+        client.settle_tokens(upstream_key, usage, estimated_tokens)
+        record_token_usage(user, usage)
+        cache.set(cache_key, {"api_name": client.api_name, "body": content.decode()}, tags=cache_tags)
+        return Response(
+            content=content,
+            media_type=response.headers.get("content-type", "application/json"),
+            headers=_relay_headers(client.api_name, False)
+        )
+
+    raise HTTPException(status_code=503, detail="All AI providers are currently unavailable")
+
+def _relay_stream(client: APIClient, response: requests.Response, upstream_key, user: Dict[str, Any],
+                  cache_key: str, cache_tags: Dict[str, Any], prompt_tokens: int,
+                  estimated_tokens: int) -> Iterator[bytes]:
+    """Relay the upstream stream unchanged, then account its tokens and cache it"""
+    chunks = []
+    complete = False
+    try:
+        for chunk in response.iter_content(chunk_size=None):
+            chunks.append(chunk)
+            yield chunk
+        complete = True
+    except Exception as e:
+        # Too late to fail over, the client already received part of the answer
+        logger.error(f"Proxied stream from {client.api_name} failed: {str(e)}")
+    finally:
+        response.close()
+        # Usage is only read back once the stream is over, off the relay path
+        body = b"".join(chunks)
+        usage = None
+        completion_chars = 0
+        try:
+            for event in client.adapter.parse_stream(body.split(b"\n")):
+                completion_chars += len(event.text)
+                usage = event.usage or usage
+        except ValueError:
+            complete = False  # not a well-formed event stream, do not cache it
+        if usage is None:
+            usage = make_usage(prompt_tokens, -(-completion_chars // ASCII_CHARS_PER_TOKEN))
+        client.settle_tokens(upstream_key, usage, estimated_tokens)
+        record_token_usage(user, usage)
+        if complete:
+            cache.set(cache_key, {"api_name": client.api_name, "body": body.decode()}, tags=cache_tags)
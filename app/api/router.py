@@ -1,21 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Request, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, field_validator
+from typing import Dict, Any, List, Optional, Iterator
+import asyncio
 import logging
 import time
-from app.services.api_client import GeminiClient, DeepseekClient, OlamaClient
+import uuid
+from app.services.api_client import APIClient
+from app.services.adapters import StreamChunk
+from app.services.registry import registry
+from app.services.tokens import estimate_tokens, estimate_messages_tokens, make_usage
+from app.services.prefix_cache import prefix_cache, conversation_hashes
+from app.services import extraction
+from app.services.capture import traffic_recorder
+from app.services import usage_log
 from app.cache.redis import cache
+from app.core.auth import validate_api_key, check_token_quota, record_token_usage
 from app.core.config import settings
+from app.core.tracing import tracer
+from app.core.deadline import run_until_disconnect
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Initialize API clients
-gemini_client = GeminiClient()
-deepseek_client = DeepseekClient()
-olama_client = OlamaClient()
-
 # Define request models
 class GenerateRequest(BaseModel):
     prompt: str
@@ -24,6 +33,10 @@ class GenerateRequest(BaseModel):
     top_p: Optional[float] = 0.95
     top_k: Optional[int] = 40
     force_provider: Optional[str] = None  # Optional: force a specific provider
+    model: Optional[str] = None  # Optional: only use providers serving this model
+    routing: Optional[str] = None  # Optional: "priority" or "cost" (defaults to ROUTING_STRATEGY)
+    max_latency_ms: Optional[float] = None  # Optional: latency SLO for cost-based routing
+    stream: Optional[bool] = False  # Optional: stream the response as server-sent events
 
 # Define response models
 class GenerateResponse(BaseModel):
@@ -31,27 +44,107 @@ class GenerateResponse(BaseModel):
     provider: str
     cached: bool = False
     latency_ms: float
+    usage: Optional[Dict[str, int]] = None
+
+class BatchRequest(BaseModel):
+    requests: List[GenerateRequest] = Field(..., min_length=1)
+
+def _json_response(response: BaseModel) -> Response:
+    """Serialize a response model with orjson, skipping FastAPI's response_model re-validation"""
+    return Response(content=extraction.dumps(response.model_dump()), media_type="application/json")
+
+def _count_prompts(response: Response, prompts: List[str]) -> Response:
+    """Count the prompts for cache warming once the response has been sent"""
+    if settings.CACHE_WARM_HISTORY_DAYS > 0:
+        response.background = BackgroundTask(cache.record_prompts, prompts)
+    return response
+
+def _sse_event(data: Dict[str, Any]) -> bytes:
+    """Encode one server-sent event"""
+    return b"data: " + extraction.dumps(data) + b"\n\n"
 
 @router.post("/generate", response_model=GenerateResponse)
-async def generate_content(request: GenerateRequest):
-    """Generate content using the best available AI API"""
+async def generate_content(request: GenerateRequest, http_request: Request,
+                           user: Dict[str, Any] = Depends(validate_api_key)):
+    """Generate content using the best available AI API.
+    
+    With `stream` set the response is a server-sent event stream of `{"content": ...}`
+    deltas, ended by an event with `done`, the provider and the token usage.
+    """
+    if request.stream:
+        response = await run_until_disconnect(http_request, _stream_content(request, user))
+    else:
+        response = _json_response(await run_until_disconnect(http_request, _generate(request, user)))
+    return _count_prompts(response, [request.prompt])
+
+@router.post("/batch")
+async def generate_batch(batch: BatchRequest, http_request: Request, user: Dict[str, Any] = Depends(validate_api_key)):
+    """Generate content for several prompts in parallel.
+    
+    Every prompt goes through the same caching, quotas and failover as /generate
+    (streaming is ignored). Results are returned in request order, failed prompts
+    with their status code and error instead of a response.
+    """
+    if len(batch.requests) > settings.BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_SIZE} prompts per batch")
+    
+    semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+    
+    async def run(request: GenerateRequest) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                response = await _generate(request, user)
+                return {"status_code": 200, "response": response.model_dump()}
+            except HTTPException as e:
+                return {"status_code": e.status_code, "error": e.detail}
+    
+    results = await run_until_disconnect(http_request, asyncio.gather(*(run(request) for request in batch.requests)))
+    return _count_prompts(Response(content=extraction.dumps({"results": results}), media_type="application/json"),
+                          [request.prompt for request in batch.requests])
+
+async def _generate(request: GenerateRequest, user: Dict[str, Any]) -> GenerateResponse:
+    """Generate a complete response, recording it with its upstream attempts in capture mode"""
+    with traffic_recorder.capture(request.model_dump()) as record:
+        if record is None:
+            return await _generate_response(request, user)
+        try:
+            response = await _generate_response(request, user)
+        except HTTPException as e:
+            record["response"] = {"status": e.status_code}
+            raise
+        record["response"] = {
+            "status": 200,
+            "provider": response.provider,
+            "cached": response.cached,
+            "latency_ms": round(response.latency_ms, 2)
+        }
+        return response
+
+async def _generate_response(request: GenerateRequest, user: Dict[str, Any]) -> GenerateResponse:
+    """Generate a complete response, from the cache or the first provider that succeeds"""
     start_time = time.time()
     
     # Check if we have a cached response
-    cached_response = cache.get_cached_response(request.prompt)
+    cached_response = cache.get_cached_response(request.prompt, _generation_params(request))
     if cached_response and not request.force_provider:
         logger.info(f"Using cached response from {cached_response['api_name']}")
-        return GenerateResponse(
+        usage_log.annotate(provider=cached_response["api_name"], cache_tier="response")
+        return GenerateResponse.model_construct(
             content=cached_response["response"].get("content", ""),
             provider=cached_response["api_name"],
             cached=True,
-            latency_ms=(time.time() - start_time) * 1000
+            latency_ms=(time.time() - start_time) * 1000,
+            usage=None
         )
     
+    # Enforce the daily token quota of the caller's API key
+    check_token_quota(user)
+    
     # If force_provider is specified, try to use that provider
     if request.force_provider:
         response = await _try_specific_provider(request)
         if response:
+            record_token_usage(user, response.usage)
             return response
         else:
             raise HTTPException(status_code=503, detail=f"Forced provider {request.force_provider} is not available")
@@ -59,152 +152,349 @@ async def generate_content(request: GenerateRequest):
     # Try each provider in order of preference
     response = await _try_all_providers(request)
     if response:
+        record_token_usage(user, response.usage)
         return response
     
     # If we get here, all providers failed
     raise HTTPException(status_code=503, detail="All AI providers are currently unavailable")
 
+def _estimated_tokens(request: GenerateRequest) -> int:
+    """Tokens to reserve for a request before it is sent"""
+    return estimate_tokens(request.prompt) + (request.max_tokens or 0)
+
+def _generation_params(request: GenerateRequest) -> Dict[str, Any]:
+    """Generation settings passed to the provider adapter"""
+    return {
+        "temperature": request.temperature,
+        "max_tokens": request.max_tokens,
+        "top_p": request.top_p,
+        "top_k": request.top_k,
+        "model": request.model,
+    }
+
+def _candidates(request: BaseModel, prompt_tokens: int) -> List[APIClient]:
+    """Providers to try for a generate or chat request, in order"""
+    if request.force_provider:
+        client = registry.get(request.force_provider)
+        return [client] if client else []
+    return registry.candidates(
+        model=request.model,
+        strategy=request.routing or settings.ROUTING_STRATEGY,
+        prompt_tokens=prompt_tokens,
+        max_tokens=request.max_tokens or 0,
+        max_latency_ms=request.max_latency_ms or settings.LATENCY_SLO_MS or None
+    )
+
 async def _try_specific_provider(request: GenerateRequest):
     """Try to use a specific provider"""
-    if request.force_provider == "gemini" and gemini_client.check_availability():
-        return await _generate_with_gemini(request)
-    elif request.force_provider == "deepseek" and deepseek_client.check_availability():
-        return await _generate_with_deepseek(request)
-    elif request.force_provider == "olama" and olama_client.check_availability():
-        return await _generate_with_olama(request)
+    client = registry.get(request.force_provider)
+    if client and client.check_availability(_estimated_tokens(request)):
+        return await _generate_with_provider(client, request)
     return None
 
 async def _try_all_providers(request: GenerateRequest):
-    """Try all providers in order of preference"""
-    # Try Gemini first
-    if gemini_client.check_availability():
-        return await _generate_with_gemini(request)
-    
-    # Try Deepseek second
-    if deepseek_client.check_availability():
-        return await _generate_with_deepseek(request)
-    
-    # Try Olama last
-    if olama_client.check_availability():
-        return await _generate_with_olama(request)
+    """Try all providers in order of preference, failing over on errors"""
+    estimated_tokens = _estimated_tokens(request)
+    for client in _candidates(request, estimate_tokens(request.prompt)):
+        if client.check_availability(estimated_tokens):
+            response = await _generate_with_provider(client, request)
+            if response:
+                return response
     
     return None
 
-async def _generate_with_gemini(request: GenerateRequest):
-    """Generate content using Gemini API"""
+async def _generate_with_provider(client: APIClient, request: GenerateRequest):
+    """Generate content using the given provider"""
     start_time = time.time()
-    try:
-        response = gemini_client.generate_content(
-            prompt=request.prompt,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens,
-            top_p=request.top_p,
-            top_k=request.top_k
-        )
-        
-        # Extract content from Gemini response format
-        content = ""
-        if "candidates" in response and len(response["candidates"]) > 0:
-            if "content" in response["candidates"][0]:
-                if "parts" in response["candidates"][0]["content"]:
-                    for part in response["candidates"][0]["content"]["parts"]:
-                        if "text" in part:
-                            content += part["text"]
-        
-        # Cache the response
-        cache.cache_response(request.prompt, "gemini", {"content": content})
-        
-        return GenerateResponse(
-            content=content,
-            provider="gemini",
-            cached=False,
-            latency_ms=(time.time() - start_time) * 1000
-        )
-    except Exception as e:
-        logger.error(f"Error generating content with Gemini: {str(e)}")
-        return None
+    with tracer.span("generate", desc=client.api_name):
+        try:
+            # The upstream call blocks, keep it off the event loop
+            response = await asyncio.to_thread(
+                client.generate_content, request.prompt, **_generation_params(request)
+            )
+            
+            # Extract content and token usage from the provider response format
+            with tracer.span("extract", desc=client.api_name):
+                content = client.extract_content(response)
+                usage = client.extract_usage(response)
+            if usage is None:
+                usage = make_usage(estimate_tokens(request.prompt), estimate_tokens(content))
+            
+            # Cache the response
+            cache.cache_response(request.prompt, _generation_params(request), client.api_name,
+                                 {"content": content}, model=request.model or client.default_model)
+            usage_log.annotate(model=request.model or client.default_model)
+            
+            # Values come from our own extraction, so skip Pydantic validation
+            return GenerateResponse.model_construct(
+                content=content,
+                provider=client.api_name,
+                cached=False,
+                latency_ms=(time.time() - start_time) * 1000,
+                usage=usage
+            )
+        except Exception as e:
+            logger.error(f"Error generating content with {client.api_name}: {str(e)}")
+            return None
 
-async def _generate_with_deepseek(request: GenerateRequest):
-    """Generate content using Deepseek API"""
+async def _stream_content(request: GenerateRequest, user: Dict[str, Any]) -> StreamingResponse:
+    """Stream from the first provider that accepts the request, failing over until a stream is open"""
     start_time = time.time()
-    try:
-        response = deepseek_client.generate_content(
-            prompt=request.prompt,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens,
-            top_p=request.top_p
-        )
-        
-        # Extract content from Deepseek response format
-        content = ""
-        if "choices" in response and len(response["choices"]) > 0:
-            if "message" in response["choices"][0]:
-                content = response["choices"][0]["message"].get("content", "")
-        
-        # Cache the response
-        cache.cache_response(request.prompt, "deepseek", {"content": content})
-        
-        return GenerateResponse(
-            content=content,
-            provider="deepseek",
-            cached=False,
-            latency_ms=(time.time() - start_time) * 1000
+    
+    # A cached response is replayed as a single delta
+    cached_response = cache.get_cached_response(request.prompt, _generation_params(request))
+    if cached_response and not request.force_provider:
+        logger.info(f"Using cached response from {cached_response['api_name']}")
+        usage_log.annotate(provider=cached_response["api_name"], cache_tier="response")
+        events = iter((
+            _sse_event({"content": cached_response["response"].get("content", "")}),
+            _sse_event({"done": True, "provider": cached_response["api_name"], "cached": True,
+                        "latency_ms": (time.time() - start_time) * 1000, "usage": None}),
+        ))
+        return StreamingResponse(events, media_type="text/event-stream")
+    
+    check_token_quota(user)
+    
+    estimated_tokens = _estimated_tokens(request)
+    for client in _candidates(request, estimate_tokens(request.prompt)):
+        if not client.check_availability(estimated_tokens):
+            continue
+        try:
+            with tracer.span("generate", desc=client.api_name):
+                chunks = await asyncio.to_thread(client.start_stream, request.prompt, **_generation_params(request))
+        except Exception as e:
+            logger.error(f"Error opening stream with {client.api_name}: {str(e)}")
+            continue
+        usage_log.annotate(model=request.model or client.default_model)
+        return StreamingResponse(
+            _stream_events(client, request, user, chunks, start_time),
+            media_type="text/event-stream"
         )
-    except Exception as e:
-        logger.error(f"Error generating content with Deepseek: {str(e)}")
-        return None
+    
+    raise HTTPException(status_code=503, detail="All AI providers are currently unavailable")
 
-async def _generate_with_olama(request: GenerateRequest):
-    """Generate content using Olama API"""
-    start_time = time.time()
+def _stream_events(client: APIClient, request: GenerateRequest, user: Dict[str, Any],
+                   chunks: Iterator[StreamChunk], start_time: float) -> Iterator[bytes]:
+    """Relay stream chunks as server-sent events, then cache the full text and count its tokens"""
+    parts = []
+    usage = None
     try:
-        response = olama_client.generate_content(
-            prompt=request.prompt,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens,
-            top_p=request.top_p
-        )
-        
-        # Extract content from Olama response format
-        content = ""
-        if "choices" in response and len(response["choices"]) > 0:
-            if "message" in response["choices"][0]:
-                content = response["choices"][0]["message"].get("content", "")
+        for chunk in chunks:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield _sse_event({"content": chunk.text})
+            if chunk.usage:
+                usage = chunk.usage
+    except Exception as e:
+        # Too late to fail over, the client already received part of the answer
+        logger.error(f"Stream from {client.api_name} failed: {str(e)}")
+        yield _sse_event({"error": f"Stream from {client.api_name} was interrupted"})
+        return
+    
+    cache.cache_response(request.prompt, _generation_params(request), client.api_name,
+                         {"content": "".join(parts)}, model=request.model or client.default_model)
+    record_token_usage(user, usage)
+    yield _sse_event({"done": True, "provider": client.api_name, "cached": False,
+                      "latency_ms": (time.time() - start_time) * 1000, "usage": usage})
+
+class ChatMessage(BaseModel):
+    role: str  # "system", "user" or "assistant"
+    content: str
+    name: Optional[str] = None
+    
+    @field_validator("content", mode="before")
+    @classmethod
+    def join_text_parts(cls, value: Any) -> Any:
+        """Accept OpenAI content parts, keeping their text"""
+        if isinstance(value, list):
+            return "".join(part.get("text", "") for part in value if isinstance(part, dict))
+        return "" if value is None else value
+
+class ChatRequest(BaseModel):
+    messages: List[ChatMessage] = Field(..., min_length=1)
+    model: Optional[str] = None  # ignored when no provider serves it
+    temperature: Optional[float] = 0.7
+    max_tokens: Optional[int] = 1024
+    max_completion_tokens: Optional[int] = None  # newer name of max_tokens
+    top_p: Optional[float] = 0.95
+    stream: Optional[bool] = False
+    force_provider: Optional[str] = None  # Optional: force a specific provider
+    routing: Optional[str] = None  # Optional: "priority" or "cost" (defaults to ROUTING_STRATEGY)
+    max_latency_ms: Optional[float] = None  # Optional: latency SLO for cost-based routing
+
+@router.post("/chat/completions")
+async def chat_completions(request: ChatRequest, http_request: Request, user: Dict[str, Any] = Depends(validate_api_key)):
+    """OpenAI-compatible chat completions over every provider.
+    
+    OpenAI SDKs can use the gateway with `base_url` set to `<gateway>/api/ai` and a
+    gateway API key. Responses (and stream chunks) have the OpenAI shape plus
+    `provider` and `cached` fields.
+    
+    Conversations are identified by chained prefix hashes: repeated conversations
+    are answered from the cache, continued ones go back to the provider that
+    served their prefix so its prompt cache is reused, and long prefixes sent to
+    Gemini are put in a context cache.
+    """
+    return await run_until_disconnect(http_request, _chat_completions(request, user))
+
+async def _chat_completions(request: ChatRequest, user: Dict[str, Any]):
+    """Answer a chat completions request from the cache or the first provider that succeeds"""
+    messages = [message.model_dump(exclude_none=True) for message in request.messages]
+    if request.max_completion_tokens:
+        request.max_tokens = request.max_completion_tokens
+    if request.model and not any(client.supports_model(request.model) for client in registry.clients.values()):
+        # SDKs always send a model; when no provider serves it the gateway chooses
+        request.model = None
+    params = {
+        "temperature": request.temperature,
+        "max_tokens": request.max_tokens,
+        "top_p": request.top_p,
+        "model": request.model,
+    }
+    hashes = conversation_hashes(messages)
+    cache_key = prefix_cache.response_key(hashes[-1], params)
+    
+    # Check if we have a cached response
+    cached_response = prefix_cache.get_response(cache_key) if not request.force_provider else None
+    if cached_response:
+        logger.info(f"Using cached chat response from {cached_response['api_name']}")
+        completion = _ChatCompletion(cached_response["api_name"], cached_response["model"], cached=True)
+        usage_log.annotate(provider=completion.provider, model=completion.model, cache_tier="prefix")
+        if request.stream:
+            return StreamingResponse(completion.replay(cached_response["content"]), media_type="text/event-stream")
+        return Response(content=extraction.dumps(completion.message(cached_response["content"], None)),
+                        media_type="application/json")
+    
+    # Enforce the daily token quota of the caller's API key
+    check_token_quota(user)
+    
+    prompt_tokens = estimate_messages_tokens(messages)
+    estimated_tokens = prompt_tokens + (request.max_tokens or 0)
+    clients = _candidates(request, prompt_tokens)
+    preferred = prefix_cache.affinity(hashes)
+    if preferred:
+        clients.sort(key=lambda client: client.api_name != preferred)
+    
+    for client in clients:
+        if not client.check_availability(estimated_tokens):
+            continue
+        completion = _ChatCompletion(client.api_name, request.model or client.default_model)
         
-        # Cache the response
-        cache.cache_response(request.prompt, "olama", {"content": content})
+        if request.stream:
+            try:
+                with tracer.span("generate", desc=client.api_name):
+                    chunks = await asyncio.to_thread(client.start_stream, "", messages=messages, **params)
+            except Exception as e:
+                logger.error(f"Error opening chat stream with {client.api_name}: {str(e)}")
+                continue
+            usage_log.annotate(model=completion.model)
+            return StreamingResponse(
+                _chat_stream_events(completion, chunks, user, hashes, cache_key),
+                media_type="text/event-stream"
+            )
         
-        return GenerateResponse(
-            content=content,
-            provider="olama",
-            cached=False,
-            latency_ms=(time.time() - start_time) * 1000
-        )
+        result = await _chat_with_provider(client, messages, params)
+        if result:
+            content, usage = result
+            usage_log.annotate(model=completion.model)
+            record_token_usage(user, usage)
+            prefix_cache.set_response(cache_key, client.api_name, completion.model, content)
+            prefix_cache.remember(hashes, {"role": "assistant", "content": content}, client.api_name)
+            return Response(content=extraction.dumps(completion.message(content, usage)),
+                            media_type="application/json")
+    
+    raise HTTPException(status_code=503, detail="All AI providers are currently unavailable")
+
+async def _chat_with_provider(client: APIClient, messages: List[Dict[str, Any]], params: Dict[str, Any]):
+    """Run a chat completion with the given provider, returning the content and usage"""
+    with tracer.span("generate", desc=client.api_name):
+        try:
+            response = await asyncio.to_thread(client.generate_content, "", messages=messages, **params)
+            with tracer.span("extract", desc=client.api_name):
+                content = client.extract_content(response)
+                usage = client.extract_usage(response)
+            if usage is None:
+                usage = make_usage(estimate_messages_tokens(messages), estimate_tokens(content))
+            return content, usage
+        except Exception as e:
+            logger.error(f"Error generating chat completion with {client.api_name}: {str(e)}")
+            return None
+
+class _ChatCompletion:
+    """Builds the OpenAI-style objects of one chat completion"""
+    def __init__(self, provider: str, model: Optional[str], cached: bool = False):
+        self.id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.created = int(time.time())
+        self.provider = provider
+        self.model = model or provider
+        self.cached = cached
+    
+    def message(self, content: str, usage: Optional[Dict[str, int]]) -> Dict[str, Any]:
+        """A complete chat.completion object"""
+        return {
+            "id": self.id,
+            "object": "chat.completion",
+            "created": self.created,
+            "model": self.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+            "provider": self.provider,
+            "cached": self.cached,
+        }
+    
+    def chunk(self, delta: Dict[str, Any], finish_reason: Optional[str] = None,
+              usage: Optional[Dict[str, int]] = None) -> bytes:
+        """A chat.completion.chunk server-sent event"""
+        return _sse_event({
+            "id": self.id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": self.model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            "usage": usage,
+            "provider": self.provider,
+            "cached": self.cached,
+        })
+    
+    def replay(self, content: str) -> Iterator[bytes]:
+        """Stream a cached response as a single delta"""
+        yield self.chunk({"role": "assistant", "content": content})
+        yield self.chunk({}, finish_reason="stop")
+        yield b"data: [DONE]\n\n"
+
+def _chat_stream_events(completion: _ChatCompletion, chunks: Iterator[StreamChunk], user: Dict[str, Any],
+                        hashes: List[str], cache_key: str) -> Iterator[bytes]:
+    """Relay stream chunks as chat.completion.chunk events, then cache the full text and count its tokens"""
+    parts = []
+    usage = None
+    yield completion.chunk({"role": "assistant", "content": ""})
+    try:
+        for chunk in chunks:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield completion.chunk({"content": chunk.text})
+            if chunk.usage:
+                usage = chunk.usage
     except Exception as e:
-        logger.error(f"Error generating content with Olama: {str(e)}")
-        return None
+        # Too late to fail over, the client already received part of the answer
+        logger.error(f"Chat stream from {completion.provider} failed: {str(e)}")
+        yield _sse_event({"error": {"message": f"Stream from {completion.provider} was interrupted", "type": "upstream_error"}})
+        return
+    
+    content = "".join(parts)
+    record_token_usage(user, usage)
+    prefix_cache.set_response(cache_key, completion.provider, completion.model, content)
+    prefix_cache.remember(hashes, {"role": "assistant", "content": content}, completion.provider)
+    yield completion.chunk({}, finish_reason="stop", usage=usage)
+    yield b"data: [DONE]\n\n"
 
 # Add a stats endpoint to monitor API usage
 @router.get("/stats")
-async def get_api_stats():
+async def get_api_stats(
+    history_minutes: int = Query(0, ge=0, le=1440, description="Number of per-minute history buckets to include")
+):
     """Get API usage statistics"""
-    return {
-        "gemini": {
-            "minute": cache.get_api_counter("gemini", "minute"),
-            "hour": cache.get_api_counter("gemini", "hour"),
-            "day": cache.get_api_counter("gemini", "day"),
-            "limit_per_minute": settings.GEMINI_RATE_LIMIT
-        },
-        "deepseek": {
-            "minute": cache.get_api_counter("deepseek", "minute"),
-            "hour": cache.get_api_counter("deepseek", "hour"),
-            "day": cache.get_api_counter("deepseek", "day"),
-            "limit_per_minute": settings.DEEPSEEK_RATE_LIMIT
-        },
-        "olama": {
-            "minute": cache.get_api_counter("olama", "minute"),
-            "hour": cache.get_api_counter("olama", "hour"),
-            "day": cache.get_api_counter("olama", "day"),
-            "limit_per_minute": settings.OLAMA_RATE_LIMIT
-        }
-    }
\ No newline at end of file
+    stats = cache.get_api_stats(registry.names(), history_minutes=history_minutes)
+    for api_name, client in registry.clients.items():
+        stats[api_name]["limit_per_minute"] = client.rate_limit
+    return stats
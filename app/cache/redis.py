@@ -1,42 +1,158 @@
 import redis
 import time
-import json
+import orjson
 import logging
 from typing import Dict, Any, Optional, List, Union
 from app.core.config import settings
+from app.core.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+# Number of per-minute buckets kept for usage history (24 hours)
+HISTORY_MINUTES = 1440
+
+# Expiration of the usage counter keys per time window; minute buckets are kept
+# for the whole history period so they double as the per-minute series
+WINDOW_EXPIRATION = {
+    "minute": HISTORY_MINUTES * 60 + 60,
+    "hour": 3600,
+    "day": 86400,
+}
+
+# Longest prompt counted in the prompt popularity used for cache warming
+PROMPT_HISTORY_MAX_CHARS = 8192
+
+# Cached responses are tagged with their provider, model and route, e.g.
+# "provider:gemini". Every tag has a sorted set of the keys carrying it, scored
+# by their expiration time, so a tag (or a combination of tags) is invalidated
+# by deleting the members of its set, without scanning the keyspace. Expired
+# members are trimmed on every write and before every read, and a tag set
+# expires with the last entry it indexes, so the sets only hold live entries.
+# Lookups count hits and misses per route and hits per key in the same round
+# trip as the GET. The hits per key are kept for the TOP_KEYS_TRACKED most hit
+# keys with the Space-Saving algorithm: a new key replaces the least hit one
+# and starts from its count, so popular keys get in and counts are upper bounds.
+TAG_KEY_PREFIX = "cachetag:"
+TAGS_KEY = "cachetags"  # sorted set of the tags in use, scored by their last expiration
+CACHE_STATS_KEY = "cache:stats"  # hash of "<route>:hits" / "<route>:misses"
+CACHE_HITS_KEY = "cache:hits"  # sorted set of hits per key
+TOP_KEYS_TRACKED = 10000  # keys kept in CACHE_HITS_KEY
+
+# Prefixes of the keys holding cached responses
+CACHE_KEY_PREFIXES = ("response:", "chat:", "proxy:")
+
+# Keys deleted per round trip when invalidating
+INVALIDATE_CHUNK = 1000
+
+# GET counting the hit or miss of a route (ARGV[1]) and the hits of the key
+_LOOKUP_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value then
+    redis.call('HINCRBY', KEYS[2], ARGV[1] .. ':hits', 1)
+    if redis.call('ZSCORE', KEYS[3], KEYS[1]) or redis.call('ZCARD', KEYS[3]) < tonumber(ARGV[2]) then
+        redis.call('ZINCRBY', KEYS[3], 1, KEYS[1])
+    else
+        local lowest = redis.call('ZRANGE', KEYS[3], 0, 0, 'WITHSCORES')
+        redis.call('ZREM', KEYS[3], lowest[1])
+        redis.call('ZADD', KEYS[3], tonumber(lowest[2]) + 1, KEYS[1])
+    end
+else
+    redis.call('HINCRBY', KEYS[2], ARGV[1] .. ':misses', 1)
+end
+return value
+"""
+
+# SETEX of an entry (KEYS[1]) indexed under its tags: KEYS[2] is TAGS_KEY and
+# KEYS[3...] the tag sets; ARGV[1] value, ARGV[2] expiration, ARGV[3] now,
+# ARGV[4...] the tags
+_SET_TAGGED_SCRIPT = """
+local now = tonumber(ARGV[3])
+local expires = now + tonumber(ARGV[2])
+local function expire_with_last(key)
+    local last = redis.call('ZRANGE', key, -1, -1, 'WITHSCORES')
+    redis.call('EXPIREAT', key, math.ceil(tonumber(last[2])))
+end
+redis.call('SETEX', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+for i = 3, #KEYS do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now)
+    redis.call('ZADD', KEYS[i], expires, KEYS[1])
+    expire_with_last(KEYS[i])
+    local tag = ARGV[i + 1]
+    local score = redis.call('ZSCORE', KEYS[2], tag)
+    if not score or tonumber(score) < expires then
+        redis.call('ZADD', KEYS[2], expires, tag)
+    end
+end
+expire_with_last(KEYS[2])
+return 1
+"""
+
 class RedisCache:
-    """Redis cache for storing API responses and tracking API usage"""
+    """Redis cache for storing API responses and tracking API usage.
+
+    The client and its connection pool are created on first use, so importing
+    this module does no work; the application closes the pool on shutdown.
+    """
     def __init__(self):
-        self.redis_client = redis.Redis.from_url(
-            settings.REDIS_URL,
-            decode_responses=True
-        )
+        self._redis_client: Optional[redis.Redis] = None
+        self._lookup_script = None
+        self._set_tagged_script = None
         self.cache_expiration = settings.CACHE_EXPIRATION
-        logger.info(f"Redis cache initialized with expiration: {self.cache_expiration}s")
+
+    @property
+    def redis_client(self) -> redis.Redis:
+        if self._redis_client is None:
+            self._redis_client = redis.Redis.from_url(
+                settings.REDIS_URL,
+                decode_responses=True
+            )
+            logger.info(f"Redis cache initialized with expiration: {self.cache_expiration}s")
+        return self._redis_client
+
+    def close(self) -> None:
+        """Close the connection pool; the next use opens a new one"""
+        if self._redis_client is not None:
+            self._redis_client.close()
+            self._redis_client.connection_pool.disconnect()
+            self._redis_client = None
+            self._lookup_script = None
+            self._set_tagged_script = None
         
-    def get(self, key: str) -> Optional[Dict[str, Any]]:
-        """Get a value from the cache"""
+    def get(self, key: str, route: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Get a value from the cache, counting the hit or miss against `route` when given"""
         try:
-            data = self.redis_client.get(key)
+            if route is None:
+                data = self.redis_client.get(key)
+            else:
+                if self._lookup_script is None:
+                    self._lookup_script = self.redis_client.register_script(_LOOKUP_SCRIPT)
+                data = self._lookup_script(keys=[key, CACHE_STATS_KEY, CACHE_HITS_KEY], args=[route, TOP_KEYS_TRACKED])
             if data:
-                return json.loads(data)
+                return orjson.loads(data)
             return None
         except Exception as e:
             logger.error(f"Error getting key {key} from Redis: {str(e)}")
             return None
     
-    def set(self, key: str, value: Dict[str, Any], expiration: Optional[int] = None) -> bool:
-        """Set a value in the cache"""
+    def set(self, key: str, value: Dict[str, Any], expiration: Optional[int] = None,
+            tags: Optional[Dict[str, Optional[str]]] = None) -> bool:
+        """Set a value in the cache, indexed under `tags` (e.g. {"provider": "gemini"}) when given"""
         try:
             exp = expiration if expiration is not None else self.cache_expiration
-            return self.redis_client.setex(
-                key,
-                exp,
-                json.dumps(value)
-            )
+            if not tags:
+                return self.redis_client.setex(
+                    key,
+                    exp,
+                    orjson.dumps(value)
+                )
+            if self._set_tagged_script is None:
+                self._set_tagged_script = self.redis_client.register_script(_SET_TAGGED_SCRIPT)
+            tag_names = self._tags(tags)
+            return bool(self._set_tagged_script(
+                keys=[key, TAGS_KEY] + [TAG_KEY_PREFIX + tag for tag in tag_names],
+                args=[orjson.dumps(value), exp, time.time()] + tag_names
+            ))
         except Exception as e:
             logger.error(f"Error setting key {key} in Redis: {str(e)}")
             return False
@@ -66,16 +182,7 @@ class RedisCache:
         try:
             timestamp = self._get_timestamp_for_window(time_window)
             key = f"api:{api_name}:count:{time_window}:{timestamp}"
-            
-            # Set expiration based on time window
-            if time_window == "minute":
-                expiration = 60
-            elif time_window == "hour":
-                expiration = 3600
-            elif time_window == "day":
-                expiration = 86400
-            else:
-                expiration = 60  # Default to minute
+            expiration = WINDOW_EXPIRATION.get(time_window, WINDOW_EXPIRATION["minute"])
             
             # Increment counter and set expiration if it's a new key
             pipe = self.redis_client.pipeline()
@@ -87,6 +194,106 @@ class RedisCache:
             logger.error(f"Error incrementing API counter for {api_name}: {str(e)}")
             return 0
     
+    def increment_api_usage(self, api_name: str, amount: int = 1) -> int:
+        """Increment the API usage counters for every time window in one round trip.
+        
+        Returns the new count for the current minute.
+        """
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for time_window, expiration in WINDOW_EXPIRATION.items():
+                timestamp = self._get_timestamp_for_window(time_window)
+                key = f"api:{api_name}:count:{time_window}:{timestamp}"
+                pipe.incrby(key, amount)
+                pipe.expire(key, expiration)
+            result = pipe.execute()
+            return result[0]
+        except Exception as e:
+            logger.error(f"Error incrementing API usage for {api_name}: {str(e)}")
+            return 0
+    
+    def increment_token_usage(self, api_name: str, tokens: int) -> None:
+        """Add to the token counters of every time window in one round trip"""
+        if tokens <= 0:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for time_window, expiration in WINDOW_EXPIRATION.items():
+                timestamp = self._get_timestamp_for_window(time_window)
+                key = f"api:{api_name}:tokens:{time_window}:{timestamp}"
+                pipe.incrby(key, tokens)
+                pipe.expire(key, expiration)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error incrementing token usage for {api_name}: {str(e)}")
+    
+    def get_api_stats(self, api_names: List[str], history_minutes: int = 0) -> Dict[str, Dict[str, Any]]:
+        """Get minute/hour/day request and token counters (and optionally per-minute history) for several APIs with one MGET"""
+        history_minutes = min(history_minutes, HISTORY_MINUTES)
+        current_minute = self._get_timestamp_for_window("minute")
+        first_minute = current_minute - history_minutes + 1
+        
+        keys = []
+        for api_name in api_names:
+            for time_window in WINDOW_EXPIRATION:
+                timestamp = self._get_timestamp_for_window(time_window)
+                keys.append(f"api:{api_name}:count:{time_window}:{timestamp}")
+            for time_window in WINDOW_EXPIRATION:
+                timestamp = self._get_timestamp_for_window(time_window)
+                keys.append(f"api:{api_name}:tokens:{time_window}:{timestamp}")
+            for minute in range(first_minute, current_minute + 1):
+                keys.append(f"api:{api_name}:count:minute:{minute}")
+        
+        try:
+            values = self.redis_client.mget(keys) if keys else []
+        except Exception as e:
+            logger.error(f"Error getting API stats: {str(e)}")
+            values = [None] * len(keys)
+        
+        stats = {}
+        position = 0
+        for api_name in api_names:
+            api_stats: Dict[str, Any] = {}
+            for time_window in WINDOW_EXPIRATION:
+                api_stats[time_window] = int(values[position] or 0)
+                position += 1
+            api_stats["tokens"] = {}
+            for time_window in WINDOW_EXPIRATION:
+                api_stats["tokens"][time_window] = int(values[position] or 0)
+                position += 1
+            if history_minutes > 0:
+                api_stats["history"] = {
+                    "start": first_minute * 60,
+                    "interval": 60,
+                    "counts": [int(value or 0) for value in values[position:position + history_minutes]],
+                }
+                position += history_minutes
+            stats[api_name] = api_stats
+        return stats
+    
+    def get_key_token_usage(self, key_id: str) -> int:
+        """Get the tokens used today by a gateway API key"""
+        try:
+            timestamp = self._get_timestamp_for_window("day")
+            count = self.redis_client.get(f"quota:{key_id}:tokens:day:{timestamp}")
+            return int(count) if count else 0
+        except Exception as e:
+            logger.error(f"Error getting token usage for key {key_id}: {str(e)}")
+            return 0
+    
+    def increment_key_token_usage(self, key_id: str, tokens: int) -> int:
+        """Add to the tokens used today by a gateway API key"""
+        try:
+            timestamp = self._get_timestamp_for_window("day")
+            key = f"quota:{key_id}:tokens:day:{timestamp}"
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.incrby(key, tokens)
+            pipe.expire(key, WINDOW_EXPIRATION["day"])
+            return pipe.execute()[0]
+        except Exception as e:
+            logger.error(f"Error incrementing token usage for key {key_id}: {str(e)}")
+            return 0
+    
     def _get_timestamp_for_window(self, time_window: str) -> int:
         """Get the timestamp for the current time window"""
         current_time = int(time.time())
@@ -99,30 +306,176 @@ class RedisCache:
         else:
             return current_time // 60  # Default to minute
     
-    def cache_response(self, prompt: str, api_name: str, response: Dict[str, Any]) -> bool:
+    def response_key(self, prompt: str, params: Dict[str, Any]) -> str:
+        """Cache key of a response: the prompt and the generation settings (model included) it was made with"""
+        params_hash = self._hash_prompt(orjson.dumps(params, option=orjson.OPT_SORT_KEYS).decode())[:12]
+        return f"response:{self._hash_prompt(prompt)}:{params_hash}"
+    
+    def cache_response(self, prompt: str, params: Dict[str, Any], api_name: str, response: Dict[str, Any],
+                       model: Optional[str] = None) -> bool:
         """Cache an API response"""
         try:
-            # Create a hash of the prompt to use as the key
-            key = f"response:{self._hash_prompt(prompt)}"
+            key = self.response_key(prompt, params)
             value = {
                 "api_name": api_name,
                 "response": response,
                 "timestamp": int(time.time())
             }
-            return self.set(key, value)
+            return self.set(key, value, tags={"provider": api_name, "model": model, "route": "generate"})
         except Exception as e:
             logger.error(f"Error caching response: {str(e)}")
             return False
     
-    def get_cached_response(self, prompt: str) -> Optional[Dict[str, Any]]:
+    @tracer.traced("cache")
+    def get_cached_response(self, prompt: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Get a cached API response"""
         try:
-            key = f"response:{self._hash_prompt(prompt)}"
-            return self.get(key)
+            key = self.response_key(prompt, params)
+            return self.get(key, route="generate")
         except Exception as e:
             logger.error(f"Error getting cached response: {str(e)}")
             return None
     
+    def record_prompts(self, prompts: List[str]) -> None:
+        """Count requests for prompts in today's prompt popularity (for cache warming).
+
+        Nothing is counted, and no prompt text stored, unless CACHE_WARM_HISTORY_DAYS is set.
+        """
+        days = settings.CACHE_WARM_HISTORY_DAYS
+        prompts = [prompt for prompt in prompts if len(prompt) <= PROMPT_HISTORY_MAX_CHARS]
+        if days <= 0 or not prompts:
+            return
+        try:
+            day = int(time.time()) // 86400
+            expiration = (days + 1) * 86400
+            pipe = self.redis_client.pipeline(transaction=False)
+            for prompt in prompts:
+                prompt_hash = self._hash_prompt(prompt)
+                pipe.zincrby(f"prompts:{day}", 1, prompt_hash)
+                pipe.hsetnx(f"prompts:text:{day}", prompt_hash, prompt)
+            pipe.expire(f"prompts:{day}", expiration)
+            pipe.expire(f"prompts:text:{day}", expiration)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error recording prompts: {str(e)}")
+    
+    def get_popular_prompts(self, count: int) -> List[Dict[str, Any]]:
+        """Get the most requested prompts of the last CACHE_WARM_HISTORY_DAYS days, most requested first"""
+        today = int(time.time()) // 86400
+        days = [today - offset for offset in range(max(settings.CACHE_WARM_HISTORY_DAYS, 1))]
+        # Sum the daily counts into a short-lived key and read its top entries
+        top_key = f"prompts:top:{today}:{time.time_ns()}"
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zunionstore(top_key, [f"prompts:{day}" for day in days])
+        pipe.zrevrange(top_key, 0, count - 1, withscores=True)
+        pipe.delete(top_key)
+        top = pipe.execute()[1]
+        if not top:
+            return []
+        pipe = self.redis_client.pipeline(transaction=False)
+        for day in days:
+            pipe.hmget(f"prompts:text:{day}", [prompt_hash for prompt_hash, _ in top])
+        texts = pipe.execute()
+        prompts = []
+        for i, (prompt_hash, requests) in enumerate(top):
+            prompt = next((day_texts[i] for day_texts in texts if day_texts[i] is not None), None)
+            if prompt is not None:
+                prompts.append({"prompt": prompt, "requests": int(requests)})
+        return prompts
+    
+    @staticmethod
+    def _tags(tags: Dict[str, Optional[str]]) -> List[str]:
+        return [f"{name}:{value}" for name, value in tags.items() if value]
+    
+    def invalidate(self, tags: Dict[str, Optional[str]]) -> int:
+        """Delete the cached responses carrying all the given tags; returns the number deleted"""
+        tag_keys = [TAG_KEY_PREFIX + tag for tag in self._tags(tags)]
+        if not tag_keys:
+            raise ValueError("At least one tag is needed to invalidate cache entries")
+        pipe = self.redis_client.pipeline(transaction=False)
+        for tag_key in tag_keys:
+            pipe.zremrangebyscore(tag_key, "-inf", time.time())
+        pipe.zinter(tag_keys)
+        keys = pipe.execute()[-1]
+        deleted = 0
+        for start in range(0, len(keys), INVALIDATE_CHUNK):
+            chunk = keys[start:start + INVALIDATE_CHUNK]
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.unlink(*chunk)
+            for tag_key in tag_keys:
+                pipe.zrem(tag_key, *chunk)
+            pipe.zrem(CACHE_HITS_KEY, *chunk)
+            deleted += pipe.execute()[0]
+        logger.info(f"Invalidated {deleted} cache entries tagged {', '.join(self._tags(tags))}")
+        return deleted
+    
+    def get_cache_stats(self, top: int = 20) -> Dict[str, Any]:
+        """Get the size, memory use, hit rates, tags and most hit keys of the response cache"""
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.info("memory")
+        pipe.info("stats")
+        pipe.hgetall(CACHE_STATS_KEY)
+        pipe.zrangebyscore(TAGS_KEY, now, "+inf")
+        pipe.zrevrange(CACHE_HITS_KEY, 0, top - 1, withscores=True)
+        memory, server_stats, counters, tags, top_keys = pipe.execute()
+        
+        tags = sorted(tags)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for tag in tags:
+            # Live entries only, without waiting for the next write to trim the set
+            pipe.zcount(TAG_KEY_PREFIX + tag, now, "+inf")
+        for key, _ in top_keys:
+            pipe.ttl(key)
+            pipe.memory_usage(key)
+        values = pipe.execute()
+        tag_sizes = dict(zip(tags, values[:len(tags)]))
+        
+        routes = {}
+        for field, count in counters.items():
+            route, outcome = field.rsplit(":", 1)
+            routes.setdefault(route, {"hits": 0, "misses": 0})[outcome] = int(count)
+        for route_stats in routes.values():
+            lookups = route_stats["hits"] + route_stats["misses"]
+            route_stats["hit_rate"] = route_stats["hits"] / lookups if lookups else 0.0
+        
+        entries = []
+        for i, (key, hits) in enumerate(top_keys):
+            ttl, size = values[len(tags) + 2 * i], values[len(tags) + 2 * i + 1]
+            if ttl < 0:
+                continue  # expired or deleted
+            entries.append({"key": key, "hits": int(hits), "ttl": ttl, "memory_bytes": size})
+        
+        return {
+            # Every cached response carries exactly one route tag
+            "entries": sum(size for tag, size in tag_sizes.items() if tag.startswith("route:")),
+            "memory": {
+                "used_bytes": memory.get("used_memory"),
+                "peak_bytes": memory.get("used_memory_peak"),
+                "max_bytes": memory.get("maxmemory"),
+                "eviction_policy": memory.get("maxmemory_policy"),
+            },
+            "evicted_keys": server_stats.get("evicted_keys"),
+            "expired_keys": server_stats.get("expired_keys"),
+            "routes": routes,
+            "tags": {tag: size for tag, size in tag_sizes.items() if size},
+            "top_keys": entries,
+        }
+    
+    def inspect(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached response with its expiration, size and hits"""
+        if not key.startswith(CACHE_KEY_PREFIXES):
+            raise ValueError(f"Only keys starting with {', '.join(CACHE_KEY_PREFIXES)} hold cached responses")
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.ttl(key)
+        pipe.memory_usage(key)
+        pipe.zscore(CACHE_HITS_KEY, key)
+        data, ttl, size, hits = pipe.execute()
+        if data is None:
+            return None
+        return {"key": key, "value": orjson.loads(data), "ttl": ttl, "memory_bytes": size, "hits": int(hits or 0)}
+    
     def _hash_prompt(self, prompt: str) -> str:
         """Create a simple hash of the prompt"""
         import hashlib
@@ -1,11 +1,17 @@
 import os
+import hmac
 import time
-from typing import Optional, Dict, Any
+import hashlib
+import orjson
+from typing import Optional, Dict, Any, List
 from fastapi import Depends, HTTPException, Security, status
 from fastapi.security.api_key import APIKeyHeader, APIKeyQuery
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 import logging
 from app.core.config import settings
+from app.cache.redis import cache
+from app.services import usage_log
 
 logger = logging.getLogger(__name__)
 
@@ -13,30 +19,88 @@ logger = logging.getLogger(__name__)
 API_KEY_NAME = "X-API-Key"
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 api_key_query = APIKeyQuery(name=API_KEY_NAME, auto_error=False)
+api_key_bearer = HTTPBearer(auto_error=False)  # "Authorization: Bearer", as sent by OpenAI SDKs
 
-# Load API keys from environment
-API_KEYS = {}
+# API keys are kept in Redis so every worker process sees the same keys:
+#
+#   apikeys  ->  hash of sha256(key) = JSON user data (name, role, key_prefix, ...)
+#
+# Only the hash of a key is stored. The admin key from the environment is
+# configuration, identical in every worker, so it is checked without Redis.
+API_KEYS_KEY = "apikeys"
+
+# Stores an admin key (KEYS[1] API_KEYS_KEY, ARGV[1] key hash, ARGV[2] user data)
+# unless an admin key is stored already, so concurrent workers generate only one.
+# Returns 1 when stored.
+_BOOTSTRAP_ADMIN_SCRIPT = """
+local users = redis.call('HVALS', KEYS[1])
+for i = 1, #users do
+    if cjson.decode(users[i]).role == 'admin' then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+# Length of the key prefix kept to list and revoke keys
+KEY_PREFIX_LENGTH = 12
+
+# Short fingerprint identifying an API key in usage counters without storing the key
+def key_fingerprint(key: str) -> str:
+    """Get a short, stable identifier for an API key"""
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+def _key_hash(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
 
 # Add admin API key from environment
 ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
-if ADMIN_API_KEY:
-    API_KEYS[ADMIN_API_KEY] = {"role": "admin", "name": "admin"}
+ADMIN_USER = {"role": "admin", "name": "admin", "key_id": key_fingerprint(ADMIN_API_KEY)} if ADMIN_API_KEY else None
 
 # Function to add a new API key
 def add_api_key(key: str, user_data: Dict[str, Any]) -> None:
     """Add a new API key to the system"""
-    API_KEYS[key] = user_data
+    user_data = {"key_prefix": key[:KEY_PREFIX_LENGTH], **user_data}
+    cache.redis_client.hset(API_KEYS_KEY, _key_hash(key), orjson.dumps(user_data))
 
-# Function to get API key from header or query parameter
+def lookup_api_key(key: str) -> Optional[Dict[str, Any]]:
+    """Get the user data of an API key, or None when the key is unknown"""
+    if ADMIN_USER is not None and hmac.compare_digest(key, ADMIN_API_KEY):
+        return ADMIN_USER
+    raw = cache.redis_client.hget(API_KEYS_KEY, _key_hash(key))
+    return orjson.loads(raw) if raw else None
+
+def list_api_keys() -> List[Dict[str, Any]]:
+    """Get the user data of every stored API key"""
+    return [orjson.loads(raw) for raw in cache.redis_client.hvals(API_KEYS_KEY)]
+
+def revoke_api_key(key_or_prefix: str) -> Optional[Dict[str, Any]]:
+    """Remove the API key that is, or starts with, `key_or_prefix`; returns its user data"""
+    stored = cache.redis_client.hgetall(API_KEYS_KEY)
+    field = _key_hash(key_or_prefix)
+    if field not in stored:
+        field = next(
+            (field for field, raw in stored.items() if orjson.loads(raw).get("key_prefix", "").startswith(key_or_prefix)),
+            None
+        )
+    if field is None or not cache.redis_client.hdel(API_KEYS_KEY, field):
+        return None
+    return orjson.loads(stored[field])
+
+# Function to get API key from header, query parameter or bearer token
 async def get_api_key(
     api_key_header: str = Security(api_key_header),
     api_key_query: str = Security(api_key_query),
+    api_key_bearer: Optional[HTTPAuthorizationCredentials] = Security(api_key_bearer),
 ) -> str:
-    """Get API key from header or query parameter"""
+    """Get API key from header, query parameter or bearer token"""
     if api_key_header:
         return api_key_header
     if api_key_query:
         return api_key_query
+    if api_key_bearer:
+        return api_key_bearer.credentials
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="API key is missing",
@@ -46,10 +110,16 @@ async def get_api_key(
 # Function to validate API key
 async def validate_api_key(api_key: str = Depends(get_api_key)) -> Dict[str, Any]:
     """Validate API key and return user data"""
-    if api_key in API_KEYS:
+    try:
+        user_data = lookup_api_key(api_key)
+    except Exception as e:
+        logger.error(f"Error looking up API key: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="API keys are unavailable")
+    if user_data is not None:
         # Log API key usage
         logger.info(f"API key used: {api_key[:5]}...")
-        return API_KEYS[api_key]
+        usage_log.annotate(key_id=user_data.get("key_id"))
+        return user_data
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid API key",
@@ -66,11 +136,25 @@ async def validate_admin(user_data: Dict[str, Any] = Depends(validate_api_key))
         detail="Insufficient permissions",
     )
 
+# Daily token quotas of API keys
+def check_token_quota(user_data: Dict[str, Any]) -> None:
+    """Reject the request when the API key has used up its daily token quota"""
+    quota = user_data.get("daily_token_quota")
+    if quota and cache.get_key_token_usage(user_data["key_id"]) >= quota:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Daily token quota exceeded")
+
+def record_token_usage(user_data: Dict[str, Any], usage: Optional[Dict[str, int]]) -> None:
+    """Count the tokens of a generated response against the API key"""
+    usage_log.add_tokens(usage)
+    if usage and user_data.get("key_id"):
+        cache.increment_key_token_usage(user_data["key_id"], usage["total_tokens"])
+
 # API key management models
 class APIKeyCreate(BaseModel):
     """Model for creating a new API key"""
     name: str
     role: str = "user"
+    daily_token_quota: Optional[int] = None  # tokens per day, unlimited when not set
 
 class APIKeyResponse(BaseModel):
     """Model for API key response"""
@@ -78,13 +162,41 @@ class APIKeyResponse(BaseModel):
     name: str
     role: str
     created_at: float
+    daily_token_quota: Optional[int] = None
 
 # Function to generate a new API key
-def generate_api_key(name: str, role: str = "user") -> APIKeyResponse:
-    """Generate a new API key"""
+def _new_api_key(name: str, role: str, daily_token_quota: Optional[int]):
+    """A new key with its user data"""
     import uuid
     key = f"ak-{uuid.uuid4().hex}"
-    created_at = time.time()
-    user_data = {"name": name, "role": role, "created_at": created_at}
-    API_KEYS[key] = user_data
-    return APIKeyResponse(key=key, name=name, role=role, created_at=created_at)
\ No newline at end of file
+    user_data = {
+        "name": name,
+        "role": role,
+        "created_at": time.time(),
+        "key_id": key_fingerprint(key),
+        "daily_token_quota": daily_token_quota
+    }
+    return key, user_data
+
+def generate_api_key(name: str, role: str = "user", daily_token_quota: Optional[int] = None) -> APIKeyResponse:
+    """Generate a new API key"""
+    key, user_data = _new_api_key(name, role, daily_token_quota)
+    add_api_key(key, user_data)
+    return APIKeyResponse(key=key, name=name, role=role, created_at=user_data["created_at"],
+                          daily_token_quota=daily_token_quota)
+
+def bootstrap_admin_key() -> Optional[APIKeyResponse]:
+    """Generate an admin API key when none is configured and no admin key is stored.
+
+    The check and the write are one Lua script, so only one of the workers
+    starting together stores a key. When every admin key was revoked the next
+    start generates a new one.
+    """
+    if ADMIN_API_KEY:
+        return None
+    key, user_data = _new_api_key("admin", "admin", None)
+    user_data = {"key_prefix": key[:KEY_PREFIX_LENGTH], **user_data}
+    stored = cache.redis_client.eval(_BOOTSTRAP_ADMIN_SCRIPT, 1, API_KEYS_KEY, _key_hash(key), orjson.dumps(user_data))
+    if not stored:
+        return None
+    return APIKeyResponse(key=key, name="admin", role="admin", created_at=user_data["created_at"])
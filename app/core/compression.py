@@ -0,0 +1,276 @@
+import zlib
+import asyncio
+import logging
+import orjson
+from typing import Dict, Optional, List
+from fastapi import HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+# Brotli and Zstandard are optional: without them responses fall back to gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Response compression. Bodies of compressible types from COMPRESSION_MIN_SIZE
+# bytes up are compressed with the best encoding the client accepts (zstd, br,
+# then gzip). Event streams are left alone so every event reaches the client
+# when it is sent, as are partial content, already encoded responses, zero-copy
+# file sends and responses that serve byte ranges (Accept-Ranges), whose
+# offsets and strong ETag refer to the identity bytes. Other ETags become weak
+# on compressed responses. Large bodies are compressed in a thread.
+#
+# Request bodies may be sent gzip- or deflate-compressed. They are inflated as
+# they are read, in bounded steps, and every body is counted against
+# MAX_REQUEST_BODY (after inflating) while it streams in, so a worker never
+# buffers more than that however large the request or its compression ratio.
+# File uploads have their own limit (FILE_MAX_SIZE) and are exempt.
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+# Levels trading ratio for CPU on the request path
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# Bodies compressed off the event loop from this size up
+THREAD_COMPRESS_SIZE = 256 * 1024
+
+# Paths whose request bodies are limited elsewhere
+BODY_LIMIT_EXEMPT_PREFIXES = ("/api/general/files",)
+
+# Largest step of decompressed request body produced at once
+INFLATE_STEP = 64 * 1024
+
+
+def available_encodings() -> List[str]:
+    """Response encodings supported here, most preferred first"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """Pick the encoding the client prefers (highest q > 0), then the first of `encodings`"""
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class _Encoder:
+    """Incremental compressor of one response"""
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        """Compress a chunk; without `final` the output is flushed so the client can decode it now"""
+        if self.encoding == "zstd":
+            out = self._compressor.compress(data)
+            return out + (self._compressor.flush() if final
+                          else self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK))
+        if self.encoding == "br":
+            out = self._compressor.process(data)
+            return out + (self._compressor.finish() if final else self._compressor.flush())
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _compressible(headers: Headers, status: int, minimum_size: int) -> bool:
+    if status < 200 or status in (204, 206, 304) or "content-encoding" in headers:
+        return False
+    if headers.get("accept-ranges", "none").lower() != "none":
+        return False
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("text/event-stream") or not content_type.startswith(COMPRESSIBLE_TYPES):
+        return False
+    length = headers.get("content-length")
+    return length is None or int(length) >= minimum_size
+
+
+class CompressionMiddleware:
+    """Compress response bodies with zstd, br or gzip, as negotiated"""
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = available_encodings()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.minimum_size <= 0:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder: Optional[_Encoder] = None
+
+        async def send_compressed(message):
+            nonlocal start_message, encoder
+            if message["type"] == "http.response.start":
+                # Held back until the first body message shows how the body is sent
+                start_message = message
+                return
+            if start_message is not None:
+                start, start_message = start_message, None
+                headers = MutableHeaders(scope=start)
+                single = message["type"] == "http.response.body" and not message.get("more_body", False)
+                if (message["type"] != "http.response.body"
+                        or not _compressible(headers, start["status"], self.minimum_size)
+                        or (single and len(message.get("body", b"")) < self.minimum_size)):
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = _Encoder(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                if "content-length" in headers:
+                    del headers["content-length"]
+                if single:
+                    body = message.get("body", b"")
+                    if len(body) >= THREAD_COMPRESS_SIZE:
+                        body = await asyncio.to_thread(encoder.compress, body, True)
+                    else:
+                        body = encoder.compress(body, True)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start)
+            if encoder is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            more_body = message.get("more_body", False)
+            await send({
+                "type": "http.response.body",
+                "body": encoder.compress(message.get("body", b""), not more_body),
+                "more_body": more_body,
+            })
+
+        await self.app(scope, receive, send_compressed)
+
+
+class RequestBodyMiddleware:
+    """Inflate gzip/deflate request bodies and enforce MAX_REQUEST_BODY while they stream in"""
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(BODY_LIMIT_EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "identity").strip().lower()
+        if content_encoding not in ("identity", "gzip", "deflate"):
+            await self._reject(send, 415, f"Unsupported request Content-Encoding {content_encoding}")
+            return
+        limit = self.max_size
+        length = headers.get("content-length")
+        if limit > 0 and content_encoding == "identity" and length and length.isdigit() and int(length) > limit:
+            # Rejected before reading any of it
+            await self._reject(send, 413, f"Request body is larger than {limit} bytes")
+            return
+        if content_encoding == "identity" and limit <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        inflater = None
+        if content_encoding != "identity":
+            # gzip, or deflate in its HTTP sense (zlib format)
+            inflater = zlib.decompressobj(31 if content_encoding == "gzip" else 15)
+            # The application sees the inflated body
+            scope = dict(scope)
+            scope["headers"] = [(name, value) for name, value in scope["headers"]
+                                if name not in (b"content-encoding", b"content-length")]
+        received = 0
+        finished = False
+        done = False
+
+        def count(data: bytes) -> bytes:
+            nonlocal received
+            received += len(data)
+            if limit > 0 and received > limit:
+                raise HTTPException(status_code=413, detail=f"Request body is larger than {limit} bytes")
+            return data
+
+        def inflate(data: bytes) -> bytes:
+            try:
+                return count(inflater.decompress(data, INFLATE_STEP))
+            except zlib.error:
+                raise HTTPException(status_code=400, detail="Request body is not valid compressed data")
+
+        async def limited_receive():
+            nonlocal finished, done
+            if inflater is None or done:
+                message = await receive()
+                if message["type"] == "http.request" and not done:
+                    count(message.get("body", b""))
+                return message
+            # Hand out the inflated body in steps of at most INFLATE_STEP bytes
+            while True:
+                if inflater.unconsumed_tail:
+                    data = inflate(inflater.unconsumed_tail)
+                elif finished:
+                    data = count(inflater.flush())
+                    if not inflater.eof:
+                        raise HTTPException(status_code=400, detail="Request body is truncated compressed data")
+                    done = True
+                    return {"type": "http.request", "body": data, "more_body": False}
+                else:
+                    message = await receive()
+                    if message["type"] != "http.request":
+                        return message
+                    finished = not message.get("more_body", False)
+                    data = inflate(message.get("body", b""))
+                if data:
+                    return {"type": "http.request", "body": data, "more_body": True}
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    async def _reject(send, status: int, detail: str) -> None:
+        body = orjson.dumps({"detail": detail})
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
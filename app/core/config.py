@@ -12,6 +12,40 @@ class Settings(BaseSettings):
     APP_VERSION: str = "0.1.0"
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     
+    # Server settings (used when started with `python main.py`)
+    SERVER_HOST: str = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT: int = int(os.getenv("SERVER_PORT", 8000))
+    WORKERS: int = int(os.getenv("WORKERS", 1))  # worker processes
+    RELOAD: bool = os.getenv("RELOAD", "false").lower() == "true"  # development only, implies one worker
+    GRACEFUL_SHUTDOWN_SECONDS: int = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", 30))  # time given to in-flight requests on shutdown
+    DRAIN_DELAY_SECONDS: int = int(os.getenv("DRAIN_DELAY_SECONDS", 0))  # keep serving while /ready fails before shutting down
+    
+    # Payload settings
+    MAX_REQUEST_BODY: int = int(os.getenv("MAX_REQUEST_BODY", 10 * 1024 ** 2))  # largest request body in bytes after decompression (file uploads excepted), 0 for no limit
+    COMPRESSION_MIN_SIZE: int = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))  # smallest response body compressed, in bytes, 0 disables compression
+    
+    # Traffic capture settings (records /generate traffic for benchmarks/replay.py)
+    CAPTURE_FILE: str = os.getenv("CAPTURE_FILE", "")  # append-only JSON lines file, empty disables capture
+    CAPTURE_REDACT: bool = os.getenv("CAPTURE_REDACT", "false").lower() == "true"  # keep only hashes and sizes of prompts and responses
+    
+    # Usage log settings (per-request records written to Postgres in batches)
+    USAGE_LOG_ENABLED: bool = os.getenv("USAGE_LOG_ENABLED", "false").lower() == "true"
+    USAGE_LOG_BUFFER: int = int(os.getenv("USAGE_LOG_BUFFER", 50000))  # records held in memory, the oldest are dropped beyond
+    USAGE_LOG_BATCH_SIZE: int = int(os.getenv("USAGE_LOG_BATCH_SIZE", 1000))  # records per COPY, a full batch is written at once
+    USAGE_LOG_FLUSH_INTERVAL: float = float(os.getenv("USAGE_LOG_FLUSH_INTERVAL", 2))  # seconds between writes of partial batches
+    
+    # Analytics settings (rollups of the usage log; day rollups are kept forever)
+    ANALYTICS_MINUTE_RETENTION_DAYS: int = int(os.getenv("ANALYTICS_MINUTE_RETENTION_DAYS", 7))  # 0 keeps them forever
+    ANALYTICS_HOUR_RETENTION_DAYS: int = int(os.getenv("ANALYTICS_HOUR_RETENTION_DAYS", 90))  # 0 keeps them forever
+    
+    # Tracing settings (OpenTelemetry is used only when installed and enabled)
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+    
+    # Profiling settings
+    ROUTE_PROFILING_ENABLED: bool = os.getenv("ROUTE_PROFILING_ENABLED", "false").lower() == "true"  # per-route event loop and CPU time, times every task step
+    SLOW_BLOCK_THRESHOLD_MS: float = float(os.getenv("SLOW_BLOCK_THRESHOLD_MS", 0))  # log steps holding the event loop this long, 0 disables
+    PROFILE_MAX_SECONDS: float = float(os.getenv("PROFILE_MAX_SECONDS", 60))  # longest sampling profile
+    
     # API Keys
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
     DEEPSEEK_API_KEY: str = os.getenv("DEEPSEEK_API_KEY", "")
@@ -24,12 +58,19 @@ class Settings(BaseSettings):
     OLAMA_ENDPOINT: str = os.getenv("OLAMA_ENDPOINT", "")
     OPENROUTER_ENDPOINT: str = os.getenv("OPENROUTER_ENDPOINT", "https://openrouter.ai/api/v1/chat/completions")
     
+    # Provider registry file (JSON); when unset providers are built from the settings above
+    PROVIDERS_CONFIG: str = os.getenv("PROVIDERS_CONFIG", "")
+    
     # API Rate Limits
     GEMINI_RATE_LIMIT: int = int(os.getenv("GEMINI_RATE_LIMIT", 60))
     DEEPSEEK_RATE_LIMIT: int = int(os.getenv("DEEPSEEK_RATE_LIMIT", 20))
     OLAMA_RATE_LIMIT: int = int(os.getenv("OLAMA_RATE_LIMIT", 30))
     OPENROUTER_RATE_LIMIT: int = int(os.getenv("OPENROUTER_RATE_LIMIT", 50))
     
+    # Routing settings
+    ROUTING_STRATEGY: str = os.getenv("ROUTING_STRATEGY", "priority")  # "priority" or "cost"
+    LATENCY_SLO_MS: int = int(os.getenv("LATENCY_SLO_MS", 0))  # default latency SLO for cost routing, 0 for none
+    
     # Database Configuration
     POSTGRES_USER: str = os.getenv("POSTGRES_USER", "postgres")
     POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD", "password")
@@ -48,9 +89,52 @@ class Settings(BaseSettings):
     # Cache settings
     CACHE_EXPIRATION: int = int(os.getenv("CACHE_EXPIRATION", 3600))  # in seconds
     
+    # Cache warming settings
+    CACHE_WARM_HISTORY_DAYS: int = int(os.getenv("CACHE_WARM_HISTORY_DAYS", 0))  # days of prompt popularity (and prompt text) kept for warming, 0 disables tracking
+    CACHE_WARM_RATE: int = int(os.getenv("CACHE_WARM_RATE", 30))  # upstream requests per minute of a warming job, 0 for no limit
+    CACHE_WARM_RESERVE: float = float(os.getenv("CACHE_WARM_RESERVE", 0.5))  # share of each provider's rate limit left to live traffic
+    CACHE_WARM_MAX_PROMPTS: int = int(os.getenv("CACHE_WARM_MAX_PROMPTS", 10000))  # prompts per warming job
+    
+    # Chat prefix cache settings
+    PREFIX_AFFINITY_SECONDS: int = int(os.getenv("PREFIX_AFFINITY_SECONDS", 300))  # keep continued conversations on the same provider, 0 disables
+    CONTEXT_CACHE_MIN_TOKENS: int = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 4096))  # smallest prefix put in a provider context cache, 0 disables
+    CONTEXT_CACHE_TTL: int = int(os.getenv("CONTEXT_CACHE_TTL", 600))  # lifetime of provider context caches, in seconds
+    
+    # Batch generation settings
+    BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", 20))  # prompts per batch request
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", 4))  # prompts of a batch generated in parallel
+    
+    # Generic data API settings
+    DATA_PAGE_MAX: int = int(os.getenv("DATA_PAGE_MAX", 500))  # largest page of a data listing
+    DATA_BULK_MAX: int = int(os.getenv("DATA_BULK_MAX", 1000))  # operations per bulk data request
+    
+    # File storage settings
+    FILE_STORAGE_DIR: str = os.getenv("FILE_STORAGE_DIR", "data/files")  # content-addressed blobs and upload parts
+    FILE_MAX_SIZE: int = int(os.getenv("FILE_MAX_SIZE", 1024 ** 3))  # largest file in bytes, 0 for no limit
+    FILE_UPLOAD_TTL: int = int(os.getenv("FILE_UPLOAD_TTL", 86400))  # lifetime of an idle resumable upload, in seconds
+    
+    # Upstream key pool settings
+    KEY_COOLDOWN_SECONDS: int = int(os.getenv("KEY_COOLDOWN_SECONDS", 60))  # after a 429
+    KEY_DISABLE_SECONDS: int = int(os.getenv("KEY_DISABLE_SECONDS", 3600))  # after a 401/403
+    
+    # Circuit breaker settings (per provider, shared through Redis)
+    BREAKER_ERROR_THRESHOLD: float = float(os.getenv("BREAKER_ERROR_THRESHOLD", 0.5))  # error rate that opens the circuit
+    BREAKER_SLOW_CALL_MS: int = int(os.getenv("BREAKER_SLOW_CALL_MS", 15000))  # requests slower than this count as slow
+    BREAKER_SLOW_CALL_THRESHOLD: float = float(os.getenv("BREAKER_SLOW_CALL_THRESHOLD", 0.8))  # slow rate that opens the circuit
+    BREAKER_MIN_REQUESTS: int = int(os.getenv("BREAKER_MIN_REQUESTS", 5))  # minimum requests in the window before tripping
+    BREAKER_WINDOW_SECONDS: int = int(os.getenv("BREAKER_WINDOW_SECONDS", 60))
+    BREAKER_OPEN_SECONDS: int = int(os.getenv("BREAKER_OPEN_SECONDS", 30))  # cooldown before a trial request
+    HEALTH_PROBE_INTERVAL: int = int(os.getenv("HEALTH_PROBE_INTERVAL", 10))  # 0 disables the health prober
+    
+    # Deadline settings (X-Request-Timeout overrides the defaults, up to the maximum)
+    REQUEST_DEADLINE_SECONDS: float = float(os.getenv("REQUEST_DEADLINE_SECONDS", 60))  # generate and chat requests
+    BATCH_DEADLINE_SECONDS: float = float(os.getenv("BATCH_DEADLINE_SECONDS", 300))  # batch requests
+    MAX_DEADLINE_SECONDS: float = float(os.getenv("MAX_DEADLINE_SECONDS", 600))
+    
     # Retry settings
     RETRY_ATTEMPTS: int = int(os.getenv("RETRY_ATTEMPTS", 3))
     RETRY_BACKOFF: int = int(os.getenv("RETRY_BACKOFF", 2))
+    RETRY_MAX_WAIT: int = int(os.getenv("RETRY_MAX_WAIT", 10))  # longest upstream Retry-After honoured in place, in seconds
     
     # Application URL for OpenRouter
     APP_URL: str = os.getenv("APP_URL", "http://localhost:8000")
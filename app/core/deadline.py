@@ -0,0 +1,170 @@
+import time
+import asyncio
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Dict, Optional, Awaitable, Any
+from fastapi import HTTPException, Request
+from starlette.datastructures import Headers
+
+logger = logging.getLogger(__name__)
+
+# Request deadlines. Generation requests get a deadline when they arrive: the
+# X-Request-Timeout header (seconds), or the default of their route, capped at
+# a maximum. The deadline lives in a context variable, which asyncio.to_thread
+# copies, so the blocking provider calls see it too:
+#
+# - every upstream attempt gets at most the remaining time as its timeout;
+# - retries that could not finish in time are not started, and retry backoff
+#   ends as soon as the request is cancelled;
+# - when the deadline passes, or the client disconnects, the endpoint stops
+#   waiting (504, or 499 in the logs) and the request is marked cancelled, so
+#   pending retries, failover and queued batch prompts are dropped at once.
+#
+# An HTTP call already on the wire cannot be interrupted from another thread;
+# it ends at the latest at its timeout, i.e. at the deadline. Streams are
+# bounded by the deadline until they are open; once tokens flow they run until
+# the client goes away.
+
+TIMEOUT_HEADER = "x-request-timeout"
+
+# Status recorded for requests whose client went away (nginx convention)
+CLIENT_CLOSED_REQUEST = 499
+
+
+class RequestAbortedError(Exception):
+    """The request ran out of time or was cancelled; no more upstream work should start"""
+
+
+class DeadlineExceededError(RequestAbortedError):
+    pass
+
+
+class RequestCancelledError(RequestAbortedError):
+    pass
+
+
+class Deadline:
+    """Time budget of one request, with a flag set once the request is abandoned"""
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.cancelled = threading.Event()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self) -> None:
+        """Raise when no more work should be started for the request"""
+        if self.cancelled.is_set():
+            raise RequestCancelledError("Request cancelled")
+        if self.remaining() <= 0:
+            raise DeadlineExceededError(f"Request deadline of {self.seconds:g}s exceeded")
+
+
+# Deadline of the request being handled, None outside deadline-bound routes
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def check() -> None:
+    """Raise RequestAbortedError when the current request is out of time or cancelled"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def timeout(default: float) -> float:
+    """Timeout for a blocking call: `default`, or less when the deadline is closer"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    return max(min(default, deadline.remaining()), 0.1)
+
+
+def allows(seconds: float) -> bool:
+    """Whether work taking `seconds` can still finish before the deadline"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return True
+    return not deadline.cancelled.is_set() and deadline.remaining() > seconds
+
+
+def sleep(seconds: float) -> None:
+    """Sleep in a worker thread, waking up early when the request is cancelled"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        time.sleep(seconds)
+    else:
+        deadline.cancelled.wait(min(seconds, deadline.remaining()))
+
+
+class DeadlineMiddleware:
+    """Give requests to the routes in `defaults` (path -> seconds) a deadline"""
+    def __init__(self, app, defaults: Dict[str, float], maximum: float):
+        self.app = app
+        self.defaults = defaults
+        self.maximum = maximum
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.defaults:
+            await self.app(scope, receive, send)
+            return
+        seconds = self.defaults[scope["path"]]
+        requested = Headers(scope=scope).get(TIMEOUT_HEADER)
+        if requested:
+            try:
+                seconds = float(requested)
+            except ValueError:
+                pass
+        seconds = min(max(seconds, 0.1), self.maximum)
+        token = _current_deadline.set(Deadline(seconds))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_deadline.reset(token)
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # The body has been read, so the next message is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until_disconnect(request: Request, work: Awaitable[Any]) -> Any:
+    """Await `work` until it finishes, the client disconnects or the deadline passes.
+
+    In the last two cases the work is cancelled, the request marked as
+    cancelled for the threads still running it, and an HTTPException raised.
+    """
+    deadline = _current_deadline.get()
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait(
+            {task, watcher},
+            timeout=deadline.remaining() if deadline is not None else None,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+    except asyncio.CancelledError:
+        task.cancel()
+        watcher.cancel()
+        raise
+    if task in done:
+        watcher.cancel()
+        return task.result()
+
+    task.cancel()
+    watcher.cancel()
+    if deadline is not None:
+        deadline.cancelled.set()
+    if watcher in done:
+        logger.info(f"Client disconnected from {request.url.path}, upstream work cancelled")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed the request")
+    logger.warning(f"Deadline of {deadline.seconds:g}s exceeded on {request.url.path}")
+    raise HTTPException(status_code=504, detail="Request deadline exceeded")
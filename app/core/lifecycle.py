@@ -0,0 +1,69 @@
+import signal
+import asyncio
+import logging
+from typing import Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    """Readiness of this worker process and its graceful drain on SIGTERM.
+
+    On SIGTERM the worker first reports itself as not ready, so load balancers
+    stop sending it new requests, and keeps serving for DRAIN_DELAY_SECONDS.
+    Then the server's own handler runs: it stops accepting connections and
+    gives in-flight requests (including streamed generations) up to
+    GRACEFUL_SHUTDOWN_SECONDS to finish before the application shuts down.
+    """
+    def __init__(self, drain_delay: int):
+        self.drain_delay = drain_delay
+        self.started = False
+        self.draining = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._previous_handler = None
+
+    @property
+    def ready(self) -> bool:
+        return self.started and not self.draining
+
+    def start(self) -> None:
+        """Mark the worker as started and hook SIGTERM in front of the server's handler"""
+        self.started = True
+        self.draining = False
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._previous_handler = signal.signal(signal.SIGTERM, self._handle_sigterm)
+        except ValueError:
+            # Not in the main thread (e.g. under a test client): nothing to hook
+            self._previous_handler = None
+
+    def stop(self) -> None:
+        """Mark the worker as stopped and give SIGTERM back to the previous handler"""
+        self.started = False
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGTERM, self._previous_handler)
+            self._previous_handler = None
+
+    def _handle_sigterm(self, signum, frame) -> None:
+        if self.draining:
+            return
+        self.draining = True
+        logger.info(f"SIGTERM received, draining for {self.drain_delay}s before shutting down")
+        if self.drain_delay > 0 and self._loop is not None:
+            # Wake the event loop from the signal handler and shut down later
+            self._loop.call_soon_threadsafe(self._loop.call_later, self.drain_delay, self._shutdown, signum, frame)
+        else:
+            self._shutdown(signum, frame)
+
+    def _shutdown(self, signum, frame) -> None:
+        previous = self._previous_handler
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.raise_signal(signal.SIGTERM)
+
+
+# Create a singleton instance
+lifecycle = Lifecycle(settings.DRAIN_DELAY_SECONDS)
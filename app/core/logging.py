@@ -4,9 +4,8 @@ from pathlib import Path
 from loguru import logger
 from app.core.config import settings
 
-# Create logs directory if it doesn't exist
+# Log directory, created by setup_logging()
 log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
 
 # Configure loguru logger
 config = {
@@ -47,6 +46,9 @@ class InterceptHandler(logging.Handler):
 
 
 def setup_logging():
+    # Create logs directory if it doesn't exist
+    log_dir.mkdir(exist_ok=True)
+    
     # Remove all handlers from the root logger
     logging.root.handlers = []
     
@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import functools
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, List, Tuple
+from starlette.routing import Match
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Profiling of a running worker, for when latency goes up in production:
+#
+# - a sampling profiler, started on demand, that reads the stacks of every
+#   thread of the worker (sys._current_frames) at a fixed interval and returns
+#   them as collapsed stacks, the input of flamegraph.pl, inferno or speedscope;
+# - per-route counters of wall time versus the time requests hold the event
+#   loop and the CPU time they use on it. Every task created on the loop runs
+#   its coroutine through a wrapper timing each step (the code between two
+#   awaits), and steps are charged to the request whose context the task runs
+#   in, so tasks a request spawns (batch prompts, streams) count for it. Loop
+#   time without CPU time is blocking I/O on the loop, e.g. synchronous Redis
+#   calls. Work sent to threads (asyncio.to_thread) is not counted;
+# - a warning for every request, or background task, holding the loop for
+#   longer than SLOW_BLOCK_THRESHOLD_MS in one step.
+#
+# The task timing is off unless ROUTE_PROFILING_ENABLED is set; the sampling
+# profiler costs nothing until it is started. The task wrapper works with
+# uvloop as with the default loop. All counters belong to the worker that
+# answers the admin request.
+
+
+class ProfileRunningError(Exception):
+    """A sampling profile is already being taken in this worker"""
+
+
+class RequestCost:
+    """Event loop time used by one request, over all the tasks working on it"""
+    __slots__ = ("loop_seconds", "cpu_seconds", "max_block_seconds", "steps", "done")
+
+    def __init__(self):
+        self.loop_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.max_block_seconds = 0.0
+        self.steps = 0
+        self.done = False
+
+    def add(self, wall: float, cpu: float) -> None:
+        self.loop_seconds += wall
+        self.cpu_seconds += cpu
+        self.steps += 1
+        if wall > self.max_block_seconds:
+            self.max_block_seconds = wall
+
+
+# Cost of the request being handled, None in background tasks
+_current_cost: ContextVar[Optional[RequestCost]] = ContextVar("request_cost", default=None)
+
+
+class _TimedCoroutine:
+    """Coroutine of a task, timing every step it runs on the event loop"""
+    __slots__ = ("_coro", "_profiler")
+
+    def __init__(self, coro, profiler: "RouteProfiler"):
+        self._coro = coro
+        self._profiler = profiler
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def __getattr__(self, name):
+        # cr_frame, cr_running, __qualname__... for asyncio and anyio task introspection
+        return getattr(self._coro, name)
+
+    def _step(self, method, *args):
+        start_time = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            return method(*args)
+        finally:
+            self._profiler.record(self._coro, time.perf_counter() - start_time, time.thread_time() - start_cpu)
+
+
+class RouteProfiler:
+    """Per-route counters of wall, event loop and CPU time, fed by the timed tasks"""
+    def __init__(self, enabled: bool, slow_block_ms: float):
+        self.enabled = enabled
+        self.slow_threshold = slow_block_ms / 1000
+        self.routes: Dict[str, Dict[str, float]] = {}
+        self.since = time.time()
+
+    def install(self) -> None:
+        """Time the steps of every task created on the running loop from now on"""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        previous = loop.get_task_factory()
+
+        def task_factory(loop, coro, **kwargs):
+            coro = _TimedCoroutine(coro, self)
+            if previous is not None:
+                return previous(loop, coro, **kwargs)
+            return asyncio.Task(coro, loop=loop, **kwargs)
+
+        loop.set_task_factory(task_factory)
+
+    def record(self, coro, wall: float, cpu: float) -> None:
+        """Charge one task step to the current request, or log it when it blocked the loop too long"""
+        cost = _current_cost.get()
+        if cost is not None and not cost.done:
+            cost.add(wall, cpu)
+        elif self.slow_threshold and wall >= self.slow_threshold:
+            name = getattr(coro, "__qualname__", repr(coro))
+            logger.warning(f"Event loop blocked for {wall * 1000:.0f}ms ({cpu * 1000:.0f}ms CPU) by task {name}")
+
+    def finish(self, route: str, wall: float, cost: RequestCost) -> None:
+        cost.done = True
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = {"requests": 0, "wall_ms": 0.0, "loop_ms": 0.0, "cpu_ms": 0.0,
+                                          "max_block_ms": 0.0, "slow_requests": 0}
+        stats["requests"] += 1
+        stats["wall_ms"] += wall * 1000
+        stats["loop_ms"] += cost.loop_seconds * 1000
+        stats["cpu_ms"] += cost.cpu_seconds * 1000
+        stats["max_block_ms"] = max(stats["max_block_ms"], cost.max_block_seconds * 1000)
+        if self.slow_threshold and cost.max_block_seconds >= self.slow_threshold:
+            stats["slow_requests"] += 1
+            logger.warning(
+                f"{route} blocked the event loop for {cost.max_block_seconds * 1000:.0f}ms in one step "
+                f"({cost.loop_seconds * 1000:.0f}ms on the loop, {cost.cpu_seconds * 1000:.0f}ms CPU "
+                f"over {cost.steps} steps, {wall * 1000:.0f}ms in total)"
+            )
+
+    def status(self) -> Dict[str, Any]:
+        """Counters per route, the routes using the most CPU first"""
+        routes = {}
+        for route, stats in sorted(self.routes.items(), key=lambda item: -item[1]["cpu_ms"]):
+            requests = stats["requests"]
+            routes[route] = {
+                "requests": requests,
+                "avg_wall_ms": round(stats["wall_ms"] / requests, 2),
+                "avg_loop_ms": round(stats["loop_ms"] / requests, 2),
+                "avg_cpu_ms": round(stats["cpu_ms"] / requests, 2),
+                "cpu_ms": round(stats["cpu_ms"], 2),
+                "cpu_share": round(stats["cpu_ms"] / stats["wall_ms"], 4) if stats["wall_ms"] else 0.0,
+                "max_block_ms": round(stats["max_block_ms"], 2),
+                "slow_requests": stats["slow_requests"],
+            }
+        return {
+            "enabled": self.enabled,
+            "pid": os.getpid(),
+            "since": self.since,
+            "slow_block_threshold_ms": self.slow_threshold * 1000,
+            "routes": routes,
+        }
+
+    def reset(self) -> None:
+        self.routes = {}
+        self.since = time.time()
+
+
+class RouteProfilingMiddleware:
+    """Measure the wall, event loop and CPU time of every request, per route"""
+    def __init__(self, app, profiler: RouteProfiler, routes: List[Any]):
+        self.app = app
+        self.profiler = profiler
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+        start_time = time.perf_counter()
+        cost = RequestCost()
+        token = _current_cost.set(cost)
+        try:
+            # In a task of its own, so every step of the request runs while the cost is current
+            await asyncio.ensure_future(self.app(scope, receive, send))
+        finally:
+            _current_cost.reset(token)
+            self.profiler.finish(f"{scope['method']} {self._route_path(scope)}",
+                                 time.perf_counter() - start_time, cost)
+
+    def _route_path(self, scope) -> str:
+        """Path template of the route that handled the request"""
+        route = scope.get("route")
+        if route is None:
+            # Routed on a copy of the scope (e.g. an inflated request body): match again
+            for candidate in self.routes:
+                match, _ = candidate.matches(scope)
+                if match == Match.FULL:
+                    route = candidate
+                    break
+        return getattr(route, "path", None) or "unmatched"
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    """File name relative to the longest sys.path entry containing it"""
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry.rstrip(os.sep) + os.sep) and len(entry) > len(best):
+            best = entry.rstrip(os.sep) + os.sep
+    return filename[len(best):]
+
+
+def _collapse(thread_name: str, frame) -> str:
+    """Stack of a frame in collapsed form: thread;outermost;...;innermost"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{_short_path(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(name.replace(";", ":") for name in reversed(names))
+
+
+class SamplingProfiler:
+    """Stack sampler over the threads of this worker, one profile at a time"""
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float, interval: float, thread_id: Optional[int] = None) -> Tuple[str, int]:
+        """Sample stacks for `seconds`; returns the collapsed stacks and the number of samples"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfileRunningError("A profile is already being taken in this worker")
+        try:
+            stacks: Counter = Counter()
+            own_id = threading.get_ident()
+            samples = 0
+            end_time = time.monotonic() + seconds
+            while time.monotonic() < end_time:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_id or (thread_id is not None and ident != thread_id):
+                        continue
+                    stacks[_collapse(names.get(ident, f"thread-{ident}"), frame)] += 1
+                samples += 1
+                time.sleep(interval)
+        finally:
+            self._lock.release()
+        logger.info(f"Profile taken: {samples} samples over {seconds:g}s")
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()), samples
+
+
+# Create singleton instances
+route_profiler = RouteProfiler(settings.ROUTE_PROFILING_ENABLED, settings.SLOW_BLOCK_THRESHOLD_MS)
+sampling_profiler = SamplingProfiler()
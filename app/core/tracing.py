@@ -0,0 +1,96 @@
+import time
+import asyncio
+import logging
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, List, Tuple
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# OpenTelemetry is optional: without it (or with TRACING_ENABLED=false) spans are no-ops
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry import propagate as otel_propagate
+except ImportError:
+    otel_trace = None
+    otel_propagate = None
+
+# Per-request list of (name, description, duration_ms) used to build the Server-Timing header
+_server_timings: ContextVar[Optional[List[Tuple[str, str, float]]]] = ContextVar("server_timings", default=None)
+
+
+class Tracer:
+    """Span helper that records Server-Timing entries and forwards to OpenTelemetry when enabled"""
+    def __init__(self):
+        self.enabled = settings.TRACING_ENABLED and otel_trace is not None
+        self._tracer = otel_trace.get_tracer(settings.APP_NAME) if self.enabled else None
+        if settings.TRACING_ENABLED and otel_trace is None:
+            logger.warning("TRACING_ENABLED is set but opentelemetry is not installed, tracing disabled")
+
+    @contextmanager
+    def span(self, name: str, desc: str = "", **attributes):
+        """Time a block of work as a span named `name`"""
+        start_time = time.perf_counter()
+        try:
+            if self._tracer is None:
+                yield None
+            else:
+                with self._tracer.start_as_current_span(name, attributes=attributes) as otel_span:
+                    yield otel_span
+        finally:
+            timings = _server_timings.get()
+            if timings is not None:
+                timings.append((name, desc, (time.perf_counter() - start_time) * 1000))
+
+    def traced(self, name: str, desc: Optional[str] = None):
+        """Decorator version of span(); without `desc` it is taken from `self.api_name` when present"""
+        def decorator(func):
+            def _desc(args) -> str:
+                if desc is not None:
+                    return desc
+                return getattr(args[0], "api_name", "") if args else ""
+
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name, desc=_desc(args)):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, desc=_desc(args)):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inject_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
+        """Add W3C trace context headers for the current span to an outgoing request"""
+        if self.enabled and otel_propagate is not None:
+            otel_propagate.inject(headers)
+        return headers
+
+
+def start_server_timing() -> List[Tuple[str, str, float]]:
+    """Start collecting Server-Timing entries for the current request"""
+    timings: List[Tuple[str, str, float]] = []
+    _server_timings.set(timings)
+    return timings
+
+
+def format_server_timing(timings: List[Tuple[str, str, float]], total_ms: float) -> str:
+    """Render collected timings as a Server-Timing header value"""
+    entries = []
+    for name, desc, duration in timings:
+        if desc:
+            entries.append(f'{name};desc="{desc}";dur={duration:.2f}')
+        else:
+            entries.append(f"{name};dur={duration:.2f}")
+    entries.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(entries)
+
+
+# Create a singleton instance
+tracer = Tracer()
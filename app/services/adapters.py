@@ -0,0 +1,196 @@
+import logging
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Iterable, Iterator
+from app.services import extraction
+
+logger = logging.getLogger(__name__)
+
+# One adapter per provider wire format. An adapter owns everything that depends
+# on the format: authentication headers, the request body, the response and
+# stream parsers and the usage extractor. Clients, the key pool, the breaker and
+# the router only ever see the gateway's own shapes (OpenAI-style messages and
+# usage dicts), so a new format only needs a new adapter.
+
+class StreamChunk:
+    """One parsed event of a streamed provider response"""
+    __slots__ = ("text", "usage")
+
+    def __init__(self, text: str = "", usage: Optional[Dict[str, int]] = None):
+        self.text = text
+        self.usage = usage
+
+
+def user_message(prompt: str) -> List[Dict[str, str]]:
+    """Wrap a single prompt as a chat history"""
+    return [{"role": "user", "content": prompt}]
+
+
+def sse_data(lines: Iterable[bytes]) -> Iterator[bytes]:
+    """Yield the payload of every `data:` line of a server-sent event stream"""
+    for line in lines:
+        if line.startswith(b"data:"):
+            data = line[5:].strip()
+            if data and data != b"[DONE]":
+                yield data
+
+
+class WireAdapter:
+    """Request building and response parsing for one provider wire format"""
+    # Whether the provider has explicit context caches for prompt prefixes
+    context_caching = False
+
+    def auth_headers(self, key: str) -> Dict[str, str]:
+        """Headers that authenticate a request with an upstream key"""
+        return {"Authorization": f"Bearer {key}"}
+
+    def stream_endpoint(self, endpoint: str) -> str:
+        """Endpoint URL to use for streamed requests"""
+        return endpoint
+
+    def build_request(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                      stream: bool = False, **params) -> Dict[str, Any]:
+        """Build the request body for a chat history"""
+        raise NotImplementedError
+
+    def parse_response(self, body: bytes) -> Dict[str, Any]:
+        """Parse a complete response body"""
+        return extraction.loads(body)
+
+    def extract_content(self, response: Dict[str, Any]) -> str:
+        """Extract the generated text from a parsed response"""
+        raise NotImplementedError
+
+    def extract_usage(self, response: Dict[str, Any]) -> Optional[Dict[str, int]]:
+        """Extract the token usage from a parsed response"""
+        raise NotImplementedError
+
+    def parse_stream(self, lines: Iterable[bytes]) -> Iterator[StreamChunk]:
+        """Turn the lines of a streamed response into text deltas and usage"""
+        raise NotImplementedError
+
+
+# Payload templates. Generation settings repeat across requests, so the nested
+# config objects are built once per distinct combination and shared by every
+# payload using it. They are only ever serialized, never mutated.
+
+@lru_cache(maxsize=256)
+def _gemini_generation_config(temperature, max_tokens, top_p, top_k) -> Dict[str, Any]:
+    return {
+        "temperature": temperature,
+        "maxOutputTokens": max_tokens,
+        "topP": top_p,
+        "topK": top_k
+    }
+
+
+@lru_cache(maxsize=8)
+def _gemini_system_parts(text: str) -> Dict[str, Any]:
+    return {"parts": [{"text": text}]}
+
+
+def _gemini_contents(messages: List[Dict[str, str]]):
+    """Split a chat history into system texts and Gemini contents"""
+    system = []
+    contents = []
+    for message in messages:
+        if message["role"] == "system":
+            system.append(message["content"])
+        else:
+            contents.append({
+                "role": "model" if message["role"] == "assistant" else "user",
+                "parts": [{"text": message["content"]}]
+            })
+    return system, contents
+
+
+class GeminiAdapter(WireAdapter):
+    """Gemini generateContent / streamGenerateContent"""
+    context_caching = True
+
+    def auth_headers(self, key: str) -> Dict[str, str]:
+        return {"x-goog-api-key": key}
+
+    def stream_endpoint(self, endpoint: str) -> str:
+        """Switch a generateContent URL to server-sent events streaming"""
+        endpoint = endpoint.replace(":generateContent", ":streamGenerateContent")
+        return endpoint + ("&" if "?" in endpoint else "?") + "alt=sse"
+
+    def build_request(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                      stream: bool = False, temperature: float = 0.7, max_tokens: int = 1024,
+                      top_p: float = 0.95, top_k: int = 40, cached_content: Optional[str] = None,
+                      **params) -> Dict[str, Any]:
+        """Build a Gemini request body; the model is part of the URL, not the body.
+        
+        With `cached_content` the messages continue a context cache created by
+        build_context_cache(), which already holds the system instruction.
+        """
+        system, contents = _gemini_contents(messages)
+        payload = {
+            "contents": contents,
+            "generationConfig": _gemini_generation_config(temperature, max_tokens, top_p, top_k)
+        }
+        if cached_content:
+            payload["cachedContent"] = cached_content
+        elif system:
+            payload["systemInstruction"] = _gemini_system_parts("\n\n".join(system))
+        return payload
+
+    def context_cache_endpoint(self, endpoint: str) -> str:
+        """cachedContents URL of the API version an endpoint belongs to"""
+        return endpoint.split("/models/")[0] + "/cachedContents"
+
+    def build_context_cache(self, messages: List[Dict[str, str]], model: str, ttl: int) -> Dict[str, Any]:
+        """Build a cachedContents body holding a conversation prefix"""
+        system, contents = _gemini_contents(messages)
+        payload = {
+            "model": f"models/{model}",
+            "contents": contents,
+            "ttl": f"{ttl}s"
+        }
+        if system:
+            payload["systemInstruction"] = {"parts": [{"text": "\n\n".join(system)}]}
+        return payload
+
+    def extract_content(self, response: Dict[str, Any]) -> str:
+        return extraction.gemini_text(response)
+
+    def extract_usage(self, response: Dict[str, Any]) -> Optional[Dict[str, int]]:
+        return extraction.gemini_usage(response)
+
+    def parse_stream(self, lines: Iterable[bytes]) -> Iterator[StreamChunk]:
+        """Every SSE event is a partial GenerateContentResponse; usage comes with the last ones"""
+        for data in sse_data(lines):
+            event = extraction.loads(data)
+            yield StreamChunk(extraction.gemini_text(event), extraction.gemini_usage(event))
+
+
+class OpenAIAdapter(WireAdapter):
+    """OpenAI chat completions (Deepseek, Olama, OpenRouter, ...)"""
+    def build_request(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                      stream: bool = False, temperature: float = 0.7, max_tokens: int = 1024,
+                      top_p: float = 0.95, **params) -> Dict[str, Any]:
+        """Build an OpenAI-style chat completions body; messages are already in this format"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+            "stream": stream
+        }
+        if stream:
+            # Ask for a final chunk carrying the token usage
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def extract_content(self, response: Dict[str, Any]) -> str:
+        return extraction.openai_text(response)
+
+    def extract_usage(self, response: Dict[str, Any]) -> Optional[Dict[str, int]]:
+        return extraction.openai_usage(response)
+
+    def parse_stream(self, lines: Iterable[bytes]) -> Iterator[StreamChunk]:
+        """Every SSE event is a chat.completion.chunk; usage comes with the last one"""
+        for data in sse_data(lines):
+            event = extraction.loads(data)
+            yield StreamChunk(extraction.openai_delta(event), extraction.openai_usage(event))
@@ -0,0 +1,276 @@
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List, Tuple
+from app.core.config import settings
+from app.services.sketch import DDSketch
+
+logger = logging.getLogger(__name__)
+
+# psycopg2 is only needed when analytics are used
+try:
+    import psycopg2
+    from psycopg2.extras import execute_values
+except ImportError:
+    psycopg2 = None
+
+# Pre-aggregated usage history. Every batch the usage log writes also updates,
+# in the same transaction, one rollup row per (granularity, bucket, dimension,
+# value): minute, hour and day buckets, for all traffic and per provider, API
+# key and model. Rows hold additive counters and the latency distribution as
+# DDSketch bins in usage_rollup_latency, so merging buckets is a SUM in SQL and
+# a query over any range reads a few rollup rows, never usage_log. Rows are
+# upserted in key order so concurrent workers lock them in the same order.
+
+GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+
+DIMENSIONS = ("all", "provider", "key", "model")
+
+# Additive counters of a rollup row, in storage order
+COUNTERS = ("requests", "errors", "client_errors", "cache_hits", "upstream_requests",
+            "prompt_tokens", "completion_tokens", "total_tokens", "latency_ms_sum")
+
+CREATE_TABLES = f"""
+CREATE TABLE IF NOT EXISTS usage_rollup (
+    granularity text NOT NULL,
+    dimension text NOT NULL,
+    value text NOT NULL,
+    bucket timestamptz NOT NULL,
+    {", ".join(f"{name} {'double precision' if name == 'latency_ms_sum' else 'bigint'} NOT NULL DEFAULT 0" for name in COUNTERS)},
+    PRIMARY KEY (granularity, dimension, value, bucket)
+);
+CREATE TABLE IF NOT EXISTS usage_rollup_latency (
+    granularity text NOT NULL,
+    dimension text NOT NULL,
+    value text NOT NULL,
+    bucket timestamptz NOT NULL,
+    bin integer NOT NULL,
+    count bigint NOT NULL,
+    PRIMARY KEY (granularity, dimension, value, bucket, bin)
+);
+"""
+
+# Seconds between deletions of expired minute and hour rollups
+PRUNE_INTERVAL = 3600
+
+# Quantiles reported by the queries
+QUANTILES = {"p50_ms": 0.5, "p90_ms": 0.9, "p99_ms": 0.99}
+
+
+class AnalyticsUnavailableError(Exception):
+    """The rollups cannot be read (no PostgreSQL driver or connection)"""
+
+
+def _dimensions(record: Dict[str, Any]) -> List[Tuple[str, str]]:
+    values = [("all", "")]
+    for dimension, field in (("provider", "provider"), ("key", "key_id"), ("model", "model")):
+        if record.get(field):
+            values.append((dimension, str(record[field])))
+    return values
+
+
+def _timestamp(seconds: float) -> datetime:
+    return datetime.fromtimestamp(seconds, timezone.utc)
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+
+def pick_granularity(start: float, end: float) -> str:
+    """Finest granularity that keeps a range to a few hundred buckets"""
+    span = end - start
+    if span <= 6 * 3600:
+        return "minute"
+    if span <= 14 * 86400:
+        return "hour"
+    return "day"
+
+
+class UsageRollups:
+    """Writer of the rollups (registered with the usage log) and their queries"""
+    def __init__(self, minute_retention_days: int, hour_retention_days: int):
+        self.retention = {"minute": minute_retention_days * 86400, "hour": hour_retention_days * 86400}
+        self._last_prune = 0.0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def create_tables(self, cursor) -> None:
+        cursor.execute(CREATE_TABLES)
+
+    def write(self, cursor, batch: List[Dict[str, Any]]) -> None:
+        """Add a batch of usage records to the rollups"""
+        totals: Dict[Tuple, List[float]] = {}
+        bins: Dict[Tuple, int] = {}
+        sketch = DDSketch()
+        for record in batch:
+            status = record.get("status") or 0
+            hit = record.get("cache_tier", "none") != "none"
+            latency = record.get("latency_ms") or 0.0
+            latency_bin = sketch.bin(latency)
+            values = (
+                1,
+                int(status >= 500),
+                int(400 <= status < 500),
+                int(hit),
+                int(not hit and status == 200 and record.get("total_tokens") is not None),
+                record.get("prompt_tokens") or 0,
+                record.get("completion_tokens") or 0,
+                record.get("total_tokens") or 0,
+                latency,
+            )
+            for granularity, seconds in GRANULARITIES.items():
+                bucket = record["ts"] - record["ts"] % seconds
+                for dimension, value in _dimensions(record):
+                    key = (granularity, dimension, value, bucket)
+                    row = totals.setdefault(key, [0] * len(COUNTERS))
+                    for i, amount in enumerate(values):
+                        row[i] += amount
+                    bins[key + (latency_bin,)] = bins.get(key + (latency_bin,), 0) + 1
+
+        updates = ", ".join(f"{name} = usage_rollup.{name} + EXCLUDED.{name}" for name in COUNTERS)
+        execute_values(
+            cursor,
+            f"INSERT INTO usage_rollup (granularity, dimension, value, bucket, {', '.join(COUNTERS)}) VALUES %s "
+            f"ON CONFLICT (granularity, dimension, value, bucket) DO UPDATE SET {updates}",
+            [(g, d, v, _timestamp(b), *row) for (g, d, v, b), row in sorted(totals.items())]
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO usage_rollup_latency (granularity, dimension, value, bucket, bin, count) VALUES %s "
+            "ON CONFLICT (granularity, dimension, value, bucket, bin) "
+            "DO UPDATE SET count = usage_rollup_latency.count + EXCLUDED.count",
+            [(g, d, v, _timestamp(b), i, count) for (g, d, v, b, i), count in sorted(bins.items())]
+        )
+        self._prune(cursor)
+
+    def _prune(self, cursor) -> None:
+        """Delete minute and hour rollups past their retention, at most once per PRUNE_INTERVAL"""
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        for granularity, retention in self.retention.items():
+            if retention <= 0:
+                continue
+            for table in ("usage_rollup", "usage_rollup_latency"):
+                cursor.execute(f"DELETE FROM {table} WHERE granularity = %s AND bucket < %s",
+                               (granularity, _timestamp(now - retention)))
+
+    def _query(self, sql: str, params: Tuple) -> List[Tuple]:
+        if psycopg2 is None:
+            raise AnalyticsUnavailableError("Analytics need psycopg2")
+        with self._lock:
+            try:
+                if self._connection is None or self._connection.closed:
+                    self._connection = psycopg2.connect(settings.DATABASE_URL)
+                    self._connection.autocommit = True
+                    with self._connection.cursor() as cursor:
+                        self.create_tables(cursor)
+                with self._connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    return cursor.fetchall()
+            except psycopg2.Error as e:
+                if self._connection is not None:
+                    self._connection.close()
+                raise AnalyticsUnavailableError(str(e)) from e
+
+    def _range(self, start: float, end: float, granularity: Optional[str]) -> Tuple[str, float, float]:
+        if end <= start:
+            raise ValueError("end must be after start")
+        granularity = granularity or pick_granularity(start, end)
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        seconds = GRANULARITIES[granularity]
+        # Whole buckets covering the range
+        return granularity, start - start % seconds, end + (-end % seconds)
+
+    def _read(self, group: str, dimension: str, granularity: str, start: float, end: float,
+              value: Optional[str]) -> Tuple[List[Tuple], List[Tuple]]:
+        """Counters and latency bins grouped by `group` (an SQL column list)"""
+        where = "granularity = %s AND dimension = %s AND bucket >= %s AND bucket < %s"
+        params = (granularity, dimension, _timestamp(start), _timestamp(end))
+        if value is not None:
+            where += " AND value = %s"
+            params += (value,)
+        counters = self._query(
+            f"SELECT {group}, {', '.join(f'SUM({name})' for name in COUNTERS)} FROM usage_rollup "
+            f"WHERE {where} GROUP BY {group} ORDER BY {group}",
+            params
+        )
+        latency_bins = self._query(
+            f"SELECT {group}, bin, SUM(count) FROM usage_rollup_latency WHERE {where} GROUP BY {group}, bin",
+            params
+        )
+        return counters, latency_bins
+
+    def summary(self, start: float, end: float, group_by: str = "all",
+                granularity: Optional[str] = None) -> Dict[str, Any]:
+        """Statistics over a time range, per value of a dimension"""
+        if group_by not in DIMENSIONS:
+            raise ValueError(f"group_by must be one of {', '.join(DIMENSIONS)}")
+        granularity, start, end = self._range(start, end, granularity)
+        counters, latency_bins = self._read("value", group_by, granularity, start, end, None)
+        return {
+            "start": _timestamp(start).isoformat(),
+            "end": _timestamp(end).isoformat(),
+            "granularity": granularity,
+            "group_by": group_by,
+            "groups": self._statistics(counters, latency_bins, lambda key: key or "all"),
+        }
+
+    def timeseries(self, start: float, end: float, group_by: str = "all", value: str = "",
+                   granularity: Optional[str] = None) -> Dict[str, Any]:
+        """Statistics per bucket over a time range, for one value of a dimension"""
+        if group_by not in DIMENSIONS:
+            raise ValueError(f"group_by must be one of {', '.join(DIMENSIONS)}")
+        granularity, start, end = self._range(start, end, granularity)
+        counters, latency_bins = self._read("bucket", group_by, granularity, start, end, value)
+        return {
+            "start": _timestamp(start).isoformat(),
+            "end": _timestamp(end).isoformat(),
+            "granularity": granularity,
+            "group_by": group_by,
+            "value": value,
+            "buckets": self._statistics(counters, latency_bins, lambda key: key.isoformat()),
+        }
+
+    def _statistics(self, counters: List[Tuple], latency_bins: List[Tuple], label) -> Dict[str, Dict[str, Any]]:
+        sketches: Dict[Any, DDSketch] = {}
+        for key, index, count in latency_bins:
+            sketches.setdefault(key, DDSketch()).add_bins([(index, int(count))])
+        statistics = {}
+        for key, *sums in counters:
+            row = dict(zip(COUNTERS, (float(amount) if name == "latency_ms_sum" else int(amount)
+                                      for name, amount in zip(COUNTERS, sums))))
+            statistics[label(key)] = self._describe(row, sketches.get(key, DDSketch()))
+        return statistics
+
+    def _describe(self, row: Dict[str, Any], sketch: DDSketch) -> Dict[str, Any]:
+        requests = row["requests"]
+        # Cache hits are assumed to have saved the average tokens of an upstream response
+        tokens_per_response = row["total_tokens"] / row["upstream_requests"] if row["upstream_requests"] else 0
+        return {
+            "requests": requests,
+            "error_rate": row["errors"] / requests if requests else 0.0,
+            "client_error_rate": row["client_errors"] / requests if requests else 0.0,
+            "cache_hit_rate": row["cache_hits"] / requests if requests else 0.0,
+            "prompt_tokens": row["prompt_tokens"],
+            "completion_tokens": row["completion_tokens"],
+            "total_tokens": row["total_tokens"],
+            "saved_upstream_requests": row["cache_hits"],
+            "saved_tokens_estimate": round(row["cache_hits"] * tokens_per_response),
+            "avg_latency_ms": row["latency_ms_sum"] / requests if requests else None,
+            **{name: _round(sketch.quantile(q)) for name, q in QUANTILES.items()},
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Create a singleton instance
+usage_rollups = UsageRollups(settings.ANALYTICS_MINUTE_RETENTION_DAYS, settings.ANALYTICS_HOUR_RETENTION_DAYS)
@@ -1,155 +1,440 @@
 import requests
-import json
 import time
 import logging
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Iterator, Callable, Union
 from tenacity import retry, stop_after_attempt, wait_exponential
 from app.core.config import settings
 from app.cache.redis import cache
+from app.core.tracing import tracer
+from app.core import deadline
+from app.core.deadline import RequestAbortedError
+from app.services.key_pool import KeyPool, UpstreamKey
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.rate_limit_headers import RateLimitInfo, parse_rate_limit_headers, parse_retry_delay
+from app.services.tokens import ASCII_CHARS_PER_TOKEN, estimate_tokens, estimate_messages_tokens, make_usage, usage_cost
+from app.services import extraction
+from app.services.adapters import WireAdapter, GeminiAdapter, OpenAIAdapter, StreamChunk, user_message
+from app.services.prefix_cache import prefix_cache, conversation_hashes
+from app.services.capture import traffic_recorder
+from app.services import usage_log
 
 logger = logging.getLogger(__name__)
 
+# A request body (already serialized when forwarded as is), or a function building
+# it for the upstream key chosen for the request
+Payload = Union[Dict[str, Any], bytes, Callable[[UpstreamKey], Dict[str, Any]]]
+
+# Client errors worth retrying; any other 4xx fails fast
+RETRYABLE_CLIENT_ERRORS = (401, 403, 408, 409, 429)
+
+class NoUpstreamKeyError(Exception):
+    """Raised when every upstream key of a provider is rate limited or disabled"""
+
+class UpstreamError(Exception):
+    """Raised when a provider request fails"""
+    def __init__(self, message: str, status_code: Optional[int] = None, retryable: bool = True,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after  # seconds to wait before retrying this provider
+
+def _should_retry(retry_state) -> bool:
+    """Retry failed attempts unless retrying cannot help or the provider's circuit opened meanwhile"""
+    if not retry_state.outcome.failed:
+        return False
+    exception = retry_state.outcome.exception()
+    if isinstance(exception, (NoUpstreamKeyError, RequestAbortedError)):
+        return False
+    if isinstance(exception, UpstreamError) and not exception.retryable:
+        return False
+    # Only retry when the attempt can still finish before the request's deadline
+    if not deadline.allows(_retry_wait(retry_state)):
+        return False
+    client = retry_state.args[0]
+    return client.breaker.is_closed()
+
+_backoff = wait_exponential(multiplier=settings.RETRY_BACKOFF)
+
+def _retry_wait(retry_state) -> float:
+    """Wait as long as the provider asked for, or back off exponentially"""
+    exception = retry_state.outcome.exception()
+    if isinstance(exception, UpstreamError):
+        if exception.retry_after is not None:
+            return exception.retry_after
+        if exception.status_code in (401, 403, 429):
+            # The key was taken out of rotation, the next attempt uses another one
+            return 0
+    return _backoff(retry_state)
+
 class APIClient:
-    """Base class for API clients"""
-    def __init__(self, api_name: str, api_key: str, endpoint: str, rate_limit: int):
+    """Base class for API clients.
+    
+    Subclasses pick the adapter of one wire format (payload building, response
+    and stream parsing); provider specifics such as endpoint, key, limits and
+    models come from configuration.
+    """
+    adapter: WireAdapter = None
+    
+    def __init__(self, api_name: str, endpoint: str, key_pool: KeyPool,
+                 models: Optional[List[str]] = None, weight: int = 1, priority: int = 0,
+                 headers: Optional[Dict[str, str]] = None, cost_per_1k_input: float = 0.0,
+                 cost_per_1k_output: float = 0.0):
         self.api_name = api_name
-        self.api_key = api_key
         self.endpoint = endpoint
-        self.rate_limit = rate_limit
+        self.key_pool = key_pool
+        self.breaker = CircuitBreaker(api_name)
+        self.models = models or []
+        self.weight = weight
+        self.priority = priority
+        self.cost_per_1k_input = cost_per_1k_input
+        self.cost_per_1k_output = cost_per_1k_output
         self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
+            "Content-Type": "application/json"
         }
+        self.headers.update(headers or {})
+    
+    @property
+    def rate_limit(self) -> int:
+        """Requests per minute over all upstream keys"""
+        return sum(upstream_key.rate_limit for upstream_key in self.key_pool.keys)
     
-    def check_availability(self) -> bool:
-        """Check if the API is available and not rate limited"""
-        # Check if we have API key
-        if not self.api_key:
+    @property
+    def default_model(self) -> Optional[str]:
+        """The model used when a request does not ask for one"""
+        return self.models[0] if self.models else None
+    
+    def supports_model(self, model: str) -> bool:
+        """Check if the provider serves the given model"""
+        return model in self.models
+    
+    def estimate_request_tokens(self, prompt: str, max_tokens: Optional[int],
+                                messages: Optional[List[Dict[str, Any]]] = None) -> int:
+        """Upper estimate of the tokens a request will use, reserved before it is sent"""
+        prompt_tokens = estimate_messages_tokens(messages) if messages else estimate_tokens(prompt)
+        return prompt_tokens + (max_tokens or 0)
+    
+    def estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """Cost of a request at the configured prices"""
+        return usage_cost(make_usage(prompt_tokens, completion_tokens), self.cost_per_1k_input, self.cost_per_1k_output)
+    
+    @tracer.traced("limiter")
+    def check_availability(self, estimated_tokens: int = 0) -> bool:
+        """Check if the API is available and not rate limited (by requests or tokens)"""
+        # Check if we have API keys
+        if not self.key_pool.keys:
             logger.warning(f"{self.api_name} API key not configured")
             return False
         
-        # Check rate limits
-        current_usage = cache.get_api_counter(self.api_name, "minute")
-        if current_usage >= self.rate_limit:
-            logger.warning(f"{self.api_name} API rate limit reached: {current_usage}/{self.rate_limit}")
+        # Check rate limits over the healthy keys
+        if self.key_pool.headroom(estimated_tokens) <= 0:
+            logger.warning(f"{self.api_name} API rate limit reached on all keys")
+            return False
+        
+        # Check the circuit breaker
+        if not self.breaker.allow_request():
+            logger.warning(f"{self.api_name} API circuit is open")
             return False
         
         return True
     
     @retry(stop=stop_after_attempt(settings.RETRY_ATTEMPTS), 
-           wait=wait_exponential(multiplier=settings.RETRY_BACKOFF))
-    def make_request(self, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+           wait=_retry_wait,
+           retry=_should_retry,
+           sleep=deadline.sleep,
+           reraise=True)
+    def make_request(self, payload: Payload, endpoint: Optional[str] = None,
+                     estimated_tokens: int = 0) -> Tuple[Dict[str, Any], bool]:
         """Make a request to the API with retry logic"""
+        return self._send_request(payload, endpoint, estimated_tokens)
+    
+    @retry(stop=stop_after_attempt(settings.RETRY_ATTEMPTS), 
+           wait=_retry_wait,
+           retry=_should_retry,
+           sleep=deadline.sleep,
+           reraise=True)
+    def open_stream(self, payload: Payload, endpoint: Optional[str] = None,
+                    estimated_tokens: int = 0) -> Tuple[requests.Response, UpstreamKey]:
+        """Open a streamed request with retry logic (only opening is retried, not the stream itself)"""
+        return self._open(payload, endpoint, estimated_tokens, stream=True)
+    
+    @tracer.traced("upstream")
+    @retry(stop=stop_after_attempt(settings.RETRY_ATTEMPTS), 
+           wait=_retry_wait,
+           retry=_should_retry,
+           sleep=deadline.sleep,
+           reraise=True)
+    def forward(self, body: bytes, estimated_tokens: int = 0,
+                stream: bool = False) -> Tuple[requests.Response, UpstreamKey]:
+        """Send an already serialized request body as is, with retry logic.
+        
+        The caller reads the response and settles the token reservation.
+        """
+        return self._open(body, self.endpoint_for(None), estimated_tokens, stream=stream)
+    
+    @tracer.traced("upstream")
+    def _send_request(self, payload: Payload, endpoint: Optional[str] = None,
+                      estimated_tokens: int = 0) -> Tuple[Dict[str, Any], bool]:
+        """Send a single request attempt to the API.
+        
+        `estimated_tokens` are reserved on the chosen key up front and corrected
+        with the usage reported by the provider afterwards.
+        """
+        response, upstream_key = self._open(payload, endpoint, estimated_tokens)
+        
+        # Parse response straight from the raw bytes
+        response_data = self.adapter.parse_response(response.content)
+        
+        # Replace the token reservation with the usage the provider reported
+        self.settle_tokens(upstream_key, self.adapter.extract_usage(response_data), estimated_tokens)
+        
+        # Log success
+        logger.info(f"{self.api_name} API request successful")
+        return response_data, True
+    
+    def _open(self, payload: Payload, endpoint: Optional[str], estimated_tokens: int,
+              stream: bool = False) -> Tuple[requests.Response, UpstreamKey]:
+        """Send the request with the upstream key that has the most headroom and check the status.
+        
+        `payload` is a request body, or a callable building the body for the
+        chosen key when it depends on the key (e.g. provider context caches).
+        Updates the key pool from the rate-limit headers and the breaker from the
+        outcome; the caller reads the body.
+        """
+        # Start nothing for a request that is out of time or was abandoned by its client
+        deadline.check()
+        
         start_time = time.time()
-        success = False
-        response_data = {}
+        provider_failed = False
+        response = None
+        retry_after = None
+        
+        # Pick the upstream key with the most headroom
+        upstream_key = self.key_pool.acquire(estimated_tokens)
+        if upstream_key is None:
+            raise NoUpstreamKeyError(f"No {self.api_name} API key with remaining capacity")
+        headers = dict(self.headers)
+        headers.update(self.adapter.auth_headers(upstream_key.key))
         
         try:
-            # Increment API counter
-            cache.increment_api_counter(self.api_name, "minute")
+            if callable(payload):
+                payload = payload(upstream_key)
+            
+            # Increment API counters for every time window
+            cache.increment_api_usage(self.api_name)
             
             # Make the request
             response = requests.post(
-                self.endpoint,
-                headers=self.headers,
-                json=payload,
-                timeout=30  # 30 second timeout
+                endpoint or self.endpoint,
+                headers=tracer.inject_headers(headers),
+                data=payload if isinstance(payload, bytes) else extraction.dumps(payload),
+                timeout=deadline.timeout(30),  # 30 seconds at most, less when the request's deadline is closer
+                stream=stream
             )
             
-            # Check if request was successful
-            response.raise_for_status()
+            # Learn the upstream quota from the rate-limit headers
+            limits = parse_rate_limit_headers(response.headers)
+            self.key_pool.update_quota(upstream_key, limits)
             
-            # Parse response
-            response_data = response.json()
-            success = True
+            # Check if request was successful
+            if response.status_code >= 400:
+                provider_failed = response.status_code >= 500
+                raise self._handle_error_response(response, upstream_key, limits)
             
-            # Log success
-            logger.info(f"{self.api_name} API request successful")
+            usage_log.annotate(provider=self.api_name)
+            return response, upstream_key
             
-        except requests.exceptions.RequestException as e:
+        except UpstreamError as e:
             logger.error(f"{self.api_name} API request failed: {str(e)}")
-            response_data = {"error": str(e)}
+            self.key_pool.record_tokens(upstream_key, -estimated_tokens)
+            retry_after = e.retry_after
             # Re-raise for retry mechanism
             raise
+        
+        except requests.exceptions.RequestException as e:
+            logger.error(f"{self.api_name} API request failed: {str(e)}")
+            self.key_pool.record_tokens(upstream_key, -estimated_tokens)
+            # No response at all counts against the provider's health
+            provider_failed = True
+            # Re-raise for retry mechanism
+            raise UpstreamError(str(e)) from e
             
         finally:
-            # Calculate latency
+            # Calculate latency (time to the response headers for streams)
             latency = (time.time() - start_time) * 1000  # in milliseconds
             logger.debug(f"{self.api_name} API request latency: {latency:.2f}ms")
-            
-        return response_data, success
-
-
-class GeminiClient(APIClient):
-    """Client for Gemini API"""
-    def __init__(self):
-        super().__init__(
-            api_name="gemini",
-            api_key=settings.GEMINI_API_KEY,
-            endpoint=settings.GEMINI_ENDPOINT,
-            rate_limit=settings.GEMINI_RATE_LIMIT
-        )
+            if provider_failed:
+                self.breaker.record_failure(latency)
+            else:
+                self.breaker.record_success(latency)
+            if traffic_recorder.enabled:
+                status_code = response.status_code if response is not None else None
+                body = response.content if status_code == 200 and not stream else None
+                traffic_recorder.record_upstream(self.api_name, status_code, latency, retry_after, body, self.adapter)
     
-    def generate_content(self, prompt: str, **kwargs) -> Dict[str, Any]:
-        """Generate content using Gemini API"""
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {
-                "temperature": kwargs.get("temperature", 0.7),
-                "maxOutputTokens": kwargs.get("max_tokens", 1024),
-                "topP": kwargs.get("top_p", 0.95),
-                "topK": kwargs.get("top_k", 40)
-            }
-        }
+    def settle_tokens(self, upstream_key: UpstreamKey, usage: Optional[Dict[str, int]], estimated_tokens: int) -> int:
+        """Replace the token reservation of a request with its actual usage (the estimate when unknown)"""
+        tokens = usage["total_tokens"] if usage else estimated_tokens
+        self.key_pool.record_tokens(upstream_key, tokens - estimated_tokens)
+        cache.increment_token_usage(self.api_name, tokens)
+        return tokens
+    
+    def _handle_error_response(self, response: requests.Response, upstream_key, limits: RateLimitInfo) -> UpstreamError:
+        """Turn an error response into an UpstreamError, updating key and provider state"""
+        status_code = response.status_code
+        message = f"{status_code} error from {self.api_name}: {response.text[:200]}"
         
-        response, success = self.make_request(payload)
-        return response
-
-
-class DeepseekClient(APIClient):
-    """Client for Deepseek API"""
-    def __init__(self):
-        super().__init__(
-            api_name="deepseek",
-            api_key=settings.DEEPSEEK_API_KEY,
-            endpoint=settings.DEEPSEEK_ENDPOINT,
-            rate_limit=settings.DEEPSEEK_RATE_LIMIT
-        )
+        if status_code == 429:
+            # Rest the key for as long as the provider asks (Gemini sends the delay in the body)
+            retry_after = limits.retry_after or limits.reset_after
+            if retry_after is None:
+                try:
+                    retry_after = parse_retry_delay(response.json())
+                except ValueError:
+                    retry_after = None
+            self.key_pool.disable(upstream_key, retry_after or settings.KEY_COOLDOWN_SECONDS, "rate_limited")
+            return UpstreamError(message, status_code)
+        
+        if status_code in (401, 403):
+            self.key_pool.disable(upstream_key, settings.KEY_DISABLE_SECONDS, "unauthorized")
+            return UpstreamError(message, status_code)
+        
+        if status_code >= 500:
+            retry_after = limits.retry_after
+            if retry_after is not None and retry_after > settings.RETRY_MAX_WAIT:
+                # Too long to wait here: let the router fail over and skip the provider meanwhile
+                self.key_pool.cool_down(retry_after, f"{status_code} with Retry-After")
+                return UpstreamError(message, status_code, retryable=False)
+            return UpstreamError(message, status_code, retry_after=retry_after)
+        
+        # Other client errors will not succeed on retry
+        return UpstreamError(message, status_code, retryable=status_code in RETRYABLE_CLIENT_ERRORS)
+    
+    def probe(self) -> bool:
+        """Send a minimal request to check if the provider has recovered"""
+        try:
+            self._send_request(self.build_payload("ping", max_tokens=1), self.endpoint_for(None))
+            return True
+        except Exception as e:
+            logger.info(f"{self.api_name} health probe failed: {str(e)}")
+            return False
+    
+    def build_payload(self, prompt: str, **kwargs) -> Payload:
+        """Build the provider request body for a prompt (or a chat history passed as `messages`)"""
+        messages = kwargs.pop("messages", None) or user_message(prompt)
+        model = kwargs.pop("model", None) or self.default_model
+        return self.adapter.build_request(messages, model, **kwargs)
+    
+    def extract_content(self, response: Dict[str, Any]) -> str:
+        """Extract the generated text from a provider response"""
+        return self.adapter.extract_content(response)
+    
+    def extract_usage(self, response: Dict[str, Any]) -> Optional[Dict[str, int]]:
+        """Extract the token usage reported in a provider response"""
+        return self.adapter.extract_usage(response)
+    
+    def endpoint_for(self, model: Optional[str], stream: bool = False) -> str:
+        """Get the endpoint URL for a model; the endpoint may contain a `{model}` placeholder"""
+        endpoint = self.endpoint
+        if "{model}" in endpoint:
+            endpoint = endpoint.replace("{model}", model or self.default_model or "")
+        return self.adapter.stream_endpoint(endpoint) if stream else endpoint
     
     def generate_content(self, prompt: str, **kwargs) -> Dict[str, Any]:
-        """Generate content using Deepseek API"""
-        payload = {
-            "model": kwargs.get("model", "deepseek-chat"),
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": kwargs.get("temperature", 0.7),
-            "max_tokens": kwargs.get("max_tokens", 1024),
-            "top_p": kwargs.get("top_p", 0.95),
-        }
-        
-        response, success = self.make_request(payload)
+        """Generate content using the provider API"""
+        estimated_tokens = self.estimate_request_tokens(prompt, kwargs.get("max_tokens", 1024), kwargs.get("messages"))
+        endpoint = self.endpoint_for(kwargs.get("model"))
+        payload = self.build_payload(prompt, **kwargs)
+        response, success = self.make_request(payload, endpoint, estimated_tokens)
         return response
+    
+    def start_stream(self, prompt: str, **kwargs) -> Iterator[StreamChunk]:
+        """Open a streamed generation and return an iterator over its chunks.
+        
+        Errors while opening are raised here so the caller can fail over before
+        anything was sent to its own client. The last chunk always carries the
+        usage, estimated when the provider does not report it.
+        """
+        estimated_tokens = self.estimate_request_tokens(prompt, kwargs.get("max_tokens", 1024), kwargs.get("messages"))
+        endpoint = self.endpoint_for(kwargs.get("model"), stream=True)
+        payload = self.build_payload(prompt, stream=True, **kwargs)
+        response, upstream_key = self.open_stream(payload, endpoint, estimated_tokens)
+        prompt_tokens = estimated_tokens - (kwargs.get("max_tokens", 1024) or 0)
+        return self._read_stream(response, upstream_key, prompt_tokens, estimated_tokens)
+    
+    def _read_stream(self, response: requests.Response, upstream_key: UpstreamKey, prompt_tokens: int,
+                     estimated_tokens: int) -> Iterator[StreamChunk]:
+        usage = None
+        completion_chars = 0
+        try:
+            for chunk in self.adapter.parse_stream(response.iter_lines()):
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.text:
+                    completion_chars += len(chunk.text)
+                    yield StreamChunk(chunk.text)
+        finally:
+            response.close()
+            if usage is None:
+                # Streams cut short or from providers without usage reporting
+                usage = make_usage(prompt_tokens, -(-completion_chars // ASCII_CHARS_PER_TOKEN))
+            self.settle_tokens(upstream_key, usage, estimated_tokens)
+        yield StreamChunk(usage=usage)
 
 
-class OlamaClient(APIClient):
-    """Client for Olama API"""
-    def __init__(self):
-        super().__init__(
-            api_name="olama",
-            api_key=settings.OLAMA_API_KEY,
-            endpoint=settings.OLAMA_ENDPOINT,
-            rate_limit=settings.OLAMA_RATE_LIMIT
-        )
+class GeminiClient(APIClient):
+    """Client for APIs using the Gemini generateContent wire format.
     
-    def generate_content(self, prompt: str, **kwargs) -> Dict[str, Any]:
-        """Generate content using Olama API"""
-        payload = {
-            "model": kwargs.get("model", "olama-chat"),
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": kwargs.get("temperature", 0.7),
-            "max_tokens": kwargs.get("max_tokens", 1024),
-            "top_p": kwargs.get("top_p", 0.95),
-            "stream": kwargs.get("stream", False)
-        }
-        
-        response, success = self.make_request(payload)
-        return response
\ No newline at end of file
+    The endpoint may contain a `{model}` placeholder to serve several models.
+    Long conversation prefixes are put in Gemini context caches so follow-up
+    turns only send (and pay full price for) the new messages.
+    """
+    adapter = GeminiAdapter()
+    
+    def build_payload(self, prompt: str, **kwargs) -> Payload:
+        messages = kwargs.get("messages")
+        if messages and len(messages) > 1 and settings.CONTEXT_CACHE_MIN_TOKENS > 0:
+            if estimate_messages_tokens(messages[:-1]) >= settings.CONTEXT_CACHE_MIN_TOKENS:
+                # Context caches belong to the key that created them, so build the body once the key is known
+                return lambda upstream_key: self._build_cached_payload(prompt, upstream_key, kwargs)
+        return super().build_payload(prompt, **kwargs)
+    
+    def _build_cached_payload(self, prompt: str, upstream_key: UpstreamKey, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Send everything but the last message through a context cache, creating it if needed"""
+        messages = kwargs["messages"]
+        model = kwargs.get("model") or self.default_model
+        prefix_hash = conversation_hashes(messages[:-1])[-1]
+        name = prefix_cache.get_context(prefix_hash, self.api_name, upstream_key.key_id, model)
+        if name is None:
+            name = self._create_context_cache(upstream_key, messages[:-1], model)
+            # Remember failures too (as ""), so a prefix the provider refuses is not retried on every turn
+            ttl = settings.CONTEXT_CACHE_TTL - 30 if name else settings.CONTEXT_CACHE_TTL
+            prefix_cache.set_context(prefix_hash, self.api_name, upstream_key.key_id, model, name or "", ttl)
+        if not name:
+            return super().build_payload(prompt, **kwargs)
+        return super().build_payload(prompt, **dict(kwargs, messages=messages[-1:], cached_content=name))
+    
+    def _create_context_cache(self, upstream_key: UpstreamKey, messages: List[Dict[str, Any]],
+                              model: Optional[str]) -> Optional[str]:
+        """Create a Gemini context cache for a conversation prefix and return its name"""
+        headers = dict(self.headers)
+        headers.update(self.adapter.auth_headers(upstream_key.key))
+        try:
+            response = requests.post(
+                self.adapter.context_cache_endpoint(self.endpoint),
+                headers=headers,
+                data=extraction.dumps(self.adapter.build_context_cache(messages, model, settings.CONTEXT_CACHE_TTL)),
+                timeout=deadline.timeout(30)
+            )
+            response.raise_for_status()
+            name = extraction.loads(response.content).get("name")
+            logger.info(f"{self.api_name} context cache created: {name}")
+            return name
+        except Exception as e:
+            logger.warning(f"{self.api_name} context cache not created: {str(e)}")
+            return None
+
+
+class OpenAIClient(APIClient):
+    """Client for APIs using the OpenAI chat completions wire format (Deepseek, Olama, ...)"""
+    adapter = OpenAIAdapter()
@@ -0,0 +1,183 @@
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, Any, Optional, List
+from app.core.config import settings
+from app.cache.redis import cache
+from app.services.registry import ProviderRegistry, registry
+from app.services.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Cache warming refills the response cache with popular prompts, e.g. after a
+# deploy or a Redis flush, so they do not all miss at once. A job goes through
+# a list of prompts (the most requested ones, or a list given by an admin) and
+# generates the responses that are not cached, in the background:
+#
+# - at most CACHE_WARM_RATE upstream requests per minute;
+# - only on providers with spare capacity: a provider is used while more than
+#   CACHE_WARM_RESERVE of its requests this minute are left, the rest is kept
+#   for live traffic. With no spare capacity anywhere the job waits.
+#
+# One job runs at a time over all workers (claimed in Redis); its progress is
+# kept in Redis so any worker can report or cancel it. The job renews its claim
+# while it works and while it waits for capacity, and stops as soon as the
+# progress in Redis belongs to another job.
+
+JOB_KEY = "warm:job"
+LOCK_KEY = "warm:lock"
+
+# Lifetime of the job lock, renewed with every prompt and every wait for capacity
+LOCK_SECONDS = 300
+
+# Wait before looking for spare capacity again
+IDLE_WAIT_SECONDS = 5
+
+# Generation settings of a /generate request that sets none: warmed responses
+# are generated with them and cached under them, so those requests find them
+WARM_PARAMS = {"temperature": 0.7, "max_tokens": 1024, "top_p": 0.95, "top_k": 40, "model": None}
+
+
+class WarmJobRunningError(Exception):
+    """A warming job is already running"""
+
+
+class CacheWarmer:
+    """Background job generating responses for prompts that are not cached"""
+    def __init__(self, registry: ProviderRegistry, rate: int, reserve: float):
+        self.registry = registry
+        self.rate = rate
+        self.reserve = reserve
+        self._task: Optional[asyncio.Task] = None
+
+    def status(self) -> Optional[Dict[str, Any]]:
+        """Get the progress of the current or last job"""
+        job = cache.redis_client.hgetall(JOB_KEY)
+        if not job:
+            return None
+        for name in ("total", "warmed", "cached", "failed"):
+            job[name] = int(job.get(name, 0))
+        return job
+
+    def start(self, prompts: List[str], source: str) -> Dict[str, Any]:
+        """Start warming the given prompts in the background"""
+        job_id = str(uuid.uuid4())
+        if not cache.redis_client.set(LOCK_KEY, job_id, nx=True, ex=LOCK_SECONDS):
+            raise WarmJobRunningError("A cache warming job is already running")
+        job = {
+            "id": job_id,
+            "source": source,
+            "status": "running",
+            "total": len(prompts),
+            "warmed": 0,
+            "cached": 0,
+            "failed": 0,
+            "started_at": time.time(),
+        }
+        pipe = cache.redis_client.pipeline()
+        pipe.delete(JOB_KEY)
+        pipe.hset(JOB_KEY, mapping=job)
+        pipe.execute()
+        self._task = asyncio.create_task(self._run(job_id, prompts))
+        logger.info(f"Cache warming job {job_id} started with {len(prompts)} prompts from {source}")
+        return job
+
+    def cancel(self) -> bool:
+        """Ask the running job to stop, whichever worker runs it"""
+        if cache.redis_client.hget(JOB_KEY, "status") != "running":
+            return False
+        cache.redis_client.hset(JOB_KEY, "status", "cancelling")
+        return True
+
+    def _keep_running(self, job_id: str) -> bool:
+        """Renew the claim of a job; False when it was cancelled or replaced by another job"""
+        pipe = cache.redis_client.pipeline(transaction=False)
+        pipe.hmget(JOB_KEY, ["id", "status"])
+        pipe.get(LOCK_KEY)
+        (current_id, status), lock = pipe.execute()
+        if current_id != job_id or status != "running":
+            return False
+        if lock == job_id:
+            return bool(cache.redis_client.expire(LOCK_KEY, LOCK_SECONDS))
+        # The claim lapsed: take it again unless another job holds it
+        return bool(cache.redis_client.set(LOCK_KEY, job_id, nx=True, ex=LOCK_SECONDS))
+
+    def _spare_client(self, prompt: str):
+        """The first provider in routing order with capacity to spare for warming"""
+        tokens = estimate_tokens(prompt)
+        for client in self.registry.candidates(strategy=settings.ROUTING_STRATEGY, prompt_tokens=tokens):
+            if client.key_pool.headroom(tokens) > client.rate_limit * self.reserve and client.check_availability(tokens):
+                return client
+        return None
+
+    async def _warm(self, job_id: str, prompt: str) -> str:
+        """Generate and cache the response of one prompt; returns the outcome counter"""
+        if cache.get_cached_response(prompt, WARM_PARAMS):
+            return "cached"
+        while True:
+            client = self._spare_client(prompt)
+            if client is not None:
+                break
+            await asyncio.sleep(IDLE_WAIT_SECONDS)
+            if not self._keep_running(job_id):
+                return "cancelled"
+        try:
+            response = await asyncio.to_thread(client.generate_content, prompt, **WARM_PARAMS)
+            content = client.extract_content(response)
+        except Exception as e:
+            logger.error(f"Error warming the cache with {client.api_name}: {str(e)}")
+            return "failed"
+        cache.cache_response(prompt, WARM_PARAMS, client.api_name, {"content": content}, model=client.default_model)
+        return "warmed"
+
+    async def _run(self, job_id: str, prompts: List[str]) -> None:
+        interval = 60 / self.rate if self.rate > 0 else 0
+        status = "done"
+        try:
+            for prompt in prompts:
+                if not self._keep_running(job_id):
+                    status = "cancelled"
+                    break
+                start_time = time.monotonic()
+                outcome = await self._warm(job_id, prompt)
+                if outcome == "cancelled":
+                    status = "cancelled"
+                    break
+                cache.redis_client.hincrby(JOB_KEY, outcome, 1)
+                if outcome != "cached":
+                    # Only upstream requests count against the rate budget
+                    await asyncio.sleep(max(0.0, interval - (time.monotonic() - start_time)))
+        except asyncio.CancelledError:
+            status = "interrupted"
+            raise
+        except Exception as e:
+            status = "failed"
+            logger.error(f"Cache warming job {job_id} failed: {str(e)}")
+        finally:
+            self._finish(job_id, status)
+
+    def _finish(self, job_id: str, status: str) -> None:
+        try:
+            # The progress may belong to a newer job by now
+            if cache.redis_client.hget(JOB_KEY, "id") == job_id:
+                cache.redis_client.hset(JOB_KEY, mapping={"status": status, "finished_at": time.time()})
+            if cache.redis_client.get(LOCK_KEY) == job_id:
+                cache.redis_client.delete(LOCK_KEY)
+        except Exception as e:
+            logger.error(f"Error finishing cache warming job {job_id}: {str(e)}")
+        self._task = None
+        logger.info(f"Cache warming job {job_id} {status}")
+
+    async def stop(self) -> None:
+        """Interrupt the job running in this worker, if any"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+# Create a singleton instance
+cache_warmer = CacheWarmer(registry, settings.CACHE_WARM_RATE, settings.CACHE_WARM_RESERVE)
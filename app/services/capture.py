@@ -0,0 +1,132 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, List
+from app.core.config import settings
+from app.services import extraction
+
+logger = logging.getLogger(__name__)
+
+# Capture mode records production-shaped traffic for replay (benchmarks/replay.py).
+# With CAPTURE_FILE set, every /generate request is appended to the file as one
+# JSON line once it is answered:
+#
+#   {"t": <unix time>, "request": {"prompt": ..., <generation settings>},
+#    "upstream": [{"provider", "status", "latency_ms", "retry_after", "body"}, ...],
+#    "response": {"status", "provider", "cached", "latency_ms"}}
+#
+# "upstream" lists every provider attempt in order, retries and failovers
+# included. With CAPTURE_REDACT the prompt is replaced by its SHA-256 and length
+# ("prompt_sha256", "prompt_chars") and upstream bodies by their token usage and
+# content length ("usage", "content_chars"), which is all a replay needs.
+#
+# Lines are written with a single O_APPEND write, so several workers can share
+# one file.
+
+# Request fields recorded next to the prompt
+REQUEST_FIELDS = ("temperature", "max_tokens", "top_p", "top_k", "model", "force_provider", "routing", "max_latency_ms")
+
+# Record of the request being handled, None when it is not captured
+_current_record: ContextVar[Optional[Dict[str, Any]]] = ContextVar("capture_record", default=None)
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+class TrafficRecorder:
+    """Append-only recorder of /generate requests and their upstream responses"""
+    def __init__(self, path: str, redact: bool):
+        self.path = path
+        self.redact = redact
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @contextmanager
+    def capture(self, request: Dict[str, Any]):
+        """Record a request handled inside the block; the caller fills record["response"]"""
+        if not self.enabled:
+            yield None
+            return
+        record = {"t": time.time(), "request": self._request(request), "upstream": [], "response": {}}
+        token = _current_record.set(record)
+        try:
+            yield record
+        finally:
+            _current_record.reset(token)
+            self._write(record)
+
+    def _request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        recorded = {name: request.get(name) for name in REQUEST_FIELDS if request.get(name) is not None}
+        prompt = request.get("prompt", "")
+        if self.redact:
+            recorded["prompt_sha256"] = prompt_hash(prompt)
+            recorded["prompt_chars"] = len(prompt)
+        else:
+            recorded["prompt"] = prompt
+        return recorded
+
+    def record_upstream(self, provider: str, status: Optional[int], latency_ms: float,
+                        retry_after: Optional[float] = None, body: Optional[bytes] = None,
+                        adapter=None) -> None:
+        """Add one upstream attempt to the record of the current request, if it is captured"""
+        record = _current_record.get()
+        if record is None:
+            return
+        attempt = {"provider": provider, "status": status, "latency_ms": round(latency_ms, 2)}
+        if retry_after is not None:
+            attempt["retry_after"] = retry_after
+        if body is not None:
+            if not self.redact:
+                attempt["body"] = body.decode("utf-8", "replace")
+            elif adapter is not None and status == 200:
+                try:
+                    response = adapter.parse_response(body)
+                    attempt["usage"] = adapter.extract_usage(response)
+                    attempt["content_chars"] = len(adapter.extract_content(response))
+                except Exception:
+                    pass
+        record["upstream"].append(attempt)
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        try:
+            line = extraction.dumps(record) + b"\n"
+            with self._lock:
+                if self._fd is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                os.write(self._fd, line)
+        except Exception as e:
+            logger.error(f"Error writing capture record: {str(e)}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def read_records(path: str) -> List[Dict[str, Any]]:
+    """Read a capture file, skipping a partly written last line"""
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                records.append(extraction.loads(line))
+            except Exception:
+                continue
+    return records
+
+
+# Create a singleton instance
+traffic_recorder = TrafficRecorder(settings.CAPTURE_FILE, settings.CAPTURE_REDACT)
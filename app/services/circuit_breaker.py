@@ -0,0 +1,186 @@
+import time
+import logging
+from typing import Dict, Any
+from app.core.config import settings
+from app.cache.redis import cache
+
+logger = logging.getLogger(__name__)
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Width of the buckets the rolling window is made of
+BUCKET_SECONDS = 10
+
+class CircuitBreaker:
+    """Circuit breaker for one provider.
+
+    Outcomes are counted in Redis buckets of BUCKET_SECONDS so the rolling error
+    and slow-call rates are shared by all workers. The breaker opens when either
+    rate crosses its threshold, rejects traffic for BREAKER_OPEN_SECONDS, then
+    lets a single trial request (or health probe) through in the half-open
+    state: success closes it, failure opens it again.
+    """
+    def __init__(self, api_name: str):
+        self.api_name = api_name
+        self.state_key = f"breaker:{api_name}"
+        self.probe_key = f"breaker:{api_name}:probe"
+        self.error_threshold = settings.BREAKER_ERROR_THRESHOLD
+        self.slow_call_ms = settings.BREAKER_SLOW_CALL_MS
+        self.slow_call_threshold = settings.BREAKER_SLOW_CALL_THRESHOLD
+        self.min_requests = settings.BREAKER_MIN_REQUESTS
+        self.window_buckets = max(settings.BREAKER_WINDOW_SECONDS // BUCKET_SECONDS, 1)
+        self.open_seconds = settings.BREAKER_OPEN_SECONDS
+
+    def _bucket_key(self, bucket: int) -> str:
+        return f"breaker:{self.api_name}:window:{bucket}"
+
+    def _get_state(self) -> Dict[str, Any]:
+        try:
+            data = cache.redis_client.hgetall(self.state_key)
+        except Exception as e:
+            logger.error(f"Error reading circuit breaker state for {self.api_name}: {str(e)}")
+            data = {}
+        return {
+            "state": data.get("state", CLOSED),
+            "opened_at": float(data.get("opened_at", 0)),
+        }
+
+    def _set_state(self, state: str) -> None:
+        try:
+            mapping = {"state": state}
+            if state == OPEN:
+                mapping["opened_at"] = time.time()
+            pipe = cache.redis_client.pipeline(transaction=False)
+            pipe.hset(self.state_key, mapping=mapping)
+            if state != HALF_OPEN:
+                pipe.delete(self.probe_key)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error writing circuit breaker state for {self.api_name}: {str(e)}")
+
+    @property
+    def state(self) -> str:
+        return self._get_state()["state"]
+
+    def is_closed(self) -> bool:
+        return self.state == CLOSED
+
+    def cooldown_elapsed(self) -> bool:
+        """Check if an open breaker may be tried again"""
+        current = self._get_state()
+        return current["state"] != CLOSED and time.time() - current["opened_at"] >= self.open_seconds
+
+    def try_acquire_trial(self) -> bool:
+        """Claim the single half-open trial slot (shared by all workers)"""
+        try:
+            acquired = bool(cache.redis_client.set(self.probe_key, "1", nx=True, ex=self.open_seconds))
+        except Exception as e:
+            logger.error(f"Error acquiring circuit breaker trial for {self.api_name}: {str(e)}")
+            return False
+        if acquired:
+            self._set_state(HALF_OPEN)
+            logger.info(f"{self.api_name} circuit half-open, sending a trial request")
+        return acquired
+
+    def allow_request(self) -> bool:
+        """Check if a request may be sent to the provider"""
+        current = self._get_state()
+        if current["state"] == CLOSED:
+            return True
+        if time.time() - current["opened_at"] < self.open_seconds:
+            return False
+        # Cooldown elapsed: only the worker holding the trial slot gets through
+        return self.try_acquire_trial()
+
+    def _record(self, latency_ms: float, failed: bool) -> str:
+        """Count an outcome in the current bucket and return the breaker state"""
+        bucket_key = self._bucket_key(int(time.time()) // BUCKET_SECONDS)
+        slow = latency_ms >= self.slow_call_ms
+        try:
+            pipe = cache.redis_client.pipeline(transaction=False)
+            pipe.hincrby(bucket_key, "total", 1)
+            pipe.hincrby(bucket_key, "errors", 1 if failed else 0)
+            pipe.hincrby(bucket_key, "slow", 1 if slow else 0)
+            pipe.hincrbyfloat(bucket_key, "latency_ms", latency_ms)
+            pipe.expire(bucket_key, (self.window_buckets + 1) * BUCKET_SECONDS)
+            pipe.hget(self.state_key, "state")
+            state = pipe.execute()[-1] or CLOSED
+        except Exception as e:
+            logger.error(f"Error recording circuit breaker outcome for {self.api_name}: {str(e)}")
+            return CLOSED
+
+        if state == HALF_OPEN:
+            if failed or slow:
+                logger.warning(f"{self.api_name} trial request failed, circuit opened again")
+                self._set_state(OPEN)
+                return OPEN
+            logger.info(f"{self.api_name} trial request succeeded, circuit closed")
+            self._set_state(CLOSED)
+            return CLOSED
+
+        if state == CLOSED and (failed or slow):
+            window = self.window_stats()
+            if window["total"] >= self.min_requests and (
+                window["error_rate"] >= self.error_threshold
+                or window["slow_rate"] >= self.slow_call_threshold
+            ):
+                logger.warning(
+                    f"{self.api_name} circuit opened: error rate {window['error_rate']:.0%}, "
+                    f"slow rate {window['slow_rate']:.0%} over {window['total']} requests"
+                )
+                self._set_state(OPEN)
+                return OPEN
+        return state
+
+    def record_success(self, latency_ms: float) -> str:
+        """Record a request the provider answered"""
+        return self._record(latency_ms, failed=False)
+
+    def record_failure(self, latency_ms: float) -> str:
+        """Record a request that failed because of the provider (no response or 5xx)"""
+        return self._record(latency_ms, failed=True)
+
+    def window_stats(self) -> Dict[str, Any]:
+        """Aggregate the buckets of the rolling window"""
+        current_bucket = int(time.time()) // BUCKET_SECONDS
+        totals = {"total": 0, "errors": 0, "slow": 0, "latency_ms": 0.0}
+        try:
+            pipe = cache.redis_client.pipeline(transaction=False)
+            for bucket in range(current_bucket - self.window_buckets + 1, current_bucket + 1):
+                pipe.hmget(self._bucket_key(bucket), "total", "errors", "slow", "latency_ms")
+            for values in pipe.execute():
+                totals["total"] += int(values[0] or 0)
+                totals["errors"] += int(values[1] or 0)
+                totals["slow"] += int(values[2] or 0)
+                totals["latency_ms"] += float(values[3] or 0)
+        except Exception as e:
+            logger.error(f"Error reading circuit breaker window for {self.api_name}: {str(e)}")
+
+        total = totals["total"]
+        return {
+            "total": total,
+            "errors": totals["errors"],
+            "error_rate": totals["errors"] / total if total else 0.0,
+            "slow_rate": totals["slow"] / total if total else 0.0,
+            "avg_latency_ms": totals["latency_ms"] / total if total else 0.0,
+        }
+
+    def close(self) -> None:
+        """Close the breaker (provider recovered)"""
+        self._set_state(CLOSED)
+
+    def open(self) -> None:
+        """Open the breaker, restarting the cooldown"""
+        self._set_state(OPEN)
+
+    def status(self) -> Dict[str, Any]:
+        """Get the breaker state and rolling window statistics"""
+        current = self._get_state()
+        return {
+            "state": current["state"],
+            "opened_at": current["opened_at"] or None,
+            "window": self.window_stats(),
+        }
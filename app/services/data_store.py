@@ -0,0 +1,434 @@
+import uuid
+import logging
+import functools
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Set, Tuple
+from app.cache.redis import cache
+from app.services import extraction
+
+logger = logging.getLogger(__name__)
+
+# Records of the generic data API are Redis hashes without expiration. Every
+# top-level field is its own hash field holding the JSON-encoded value, so an
+# update only writes the fields it changes. Bookkeeping lives in fields starting
+# with "_", which record fields may not use.
+#
+#   data:{id}             ->  _version, _created_at, _updated_at, <field> = <json>, ...
+#   data:ids              ->  sorted set of all record ids (lexicographic, for cursor pagination)
+#   data:idx:{field}:num  ->  sorted set of ids scored by the numeric value of the field
+#   data:idx:{field}:str  ->  sorted set of "<string>\0<id>" for string values, queried by
+#                             lexicographic range
+#   data:idx:{field}:bool ->  sorted set of ids scored 1 (true) or 0 (false)
+#
+# Every top-level scalar field is indexed; objects, arrays and null are not.
+# String index members hold the UTF-8 text itself, not its JSON, so members
+# sort like the strings do. "\1" and "\0" in the text are escaped as "\1\2"
+# and "\1\1", which keeps that order and leaves "\0" to the separator, below
+# every byte that can follow a value. Booleans can only be compared for equality.
+# Creates, updates and deletes run as Lua scripts: the version check, the write and the
+# index maintenance happen atomically in one round trip, so concurrent writers
+# never lose each other's changes and a stale version is detected instead of
+# overwritten. The scripts touch index keys they do not declare, which needs a
+# standalone (non-cluster) Redis.
+
+# Names that appear next to the record fields in API responses
+RESERVED_FIELDS = {"id", "version", "created_at", "updated_at"}
+
+# Separator between the value and the id in string index members
+INDEX_SEPARATOR = "\0"
+
+# Query filter operators
+FILTER_OPS = ("eq", "gt", "gte", "lt", "lte")
+
+_INDEX_FUNCTIONS = """
+local function index_kind(raw)
+    local first = string.sub(raw, 1, 1)
+    if first == '"' then
+        return 'str'
+    elseif first == 't' or first == 'f' then
+        return 'bool'
+    elseif first == '-' or tonumber(first) then
+        return 'num'
+    end
+    return nil
+end
+local function string_member(id, raw)
+    local text = string.gsub(cjson.decode(raw), '\\1', '\\1\\2')
+    text = string.gsub(text, '%z', '\\1\\1')
+    return text .. '\\0' .. id
+end
+local function unindex(id, field, raw)
+    local kind = index_kind(raw)
+    if kind == 'str' then
+        redis.call('ZREM', 'data:idx:' .. field .. ':str', string_member(id, raw))
+    elseif kind then
+        redis.call('ZREM', 'data:idx:' .. field .. ':' .. kind, id)
+    end
+end
+local function index(id, field, raw)
+    local kind = index_kind(raw)
+    if kind == 'str' then
+        redis.call('ZADD', 'data:idx:' .. field .. ':str', 0, string_member(id, raw))
+    elseif kind == 'bool' then
+        redis.call('ZADD', 'data:idx:' .. field .. ':bool', raw == 'true' and 1 or 0, id)
+    elseif kind == 'num' then
+        redis.call('ZADD', 'data:idx:' .. field .. ':num', tonumber(raw), id)
+    end
+end
+"""
+
+# KEYS[1] record; ARGV[1] record id, ARGV[2] created_at, then name/value pairs.
+# Writes the record at version 1 with its index entries and returns 1.
+_CREATE_SCRIPT = _INDEX_FUNCTIONS + """
+local id = ARGV[1]
+redis.call('HSET', KEYS[1], '_version', 1, '_created_at', ARGV[2], '_updated_at', ARGV[2])
+for i = 3, #ARGV, 2 do
+    index(id, ARGV[i], ARGV[i + 1])
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('ZADD', 'data:ids', 0, id)
+return 1
+"""
+
+# KEYS[1] record; ARGV[1] record id, ARGV[2] expected version ("" for any), ARGV[3] updated_at,
+# ARGV[4] number of fields to delete, then the names to delete, then name/value pairs to set.
+# Returns {-1} when the record does not exist, {-2, version} on a version conflict,
+# otherwise the new version followed by the HGETALL of the record.
+_UPDATE_SCRIPT = _INDEX_FUNCTIONS + """
+local id = ARGV[1]
+local version = redis.call('HGET', KEYS[1], '_version')
+if not version then
+    return {-1}
+end
+if ARGV[2] ~= '' and ARGV[2] ~= version then
+    return {-2, tonumber(version)}
+end
+local removed = tonumber(ARGV[4])
+for i = 5, 4 + removed do
+    local old = redis.call('HGET', KEYS[1], ARGV[i])
+    if old then
+        unindex(id, ARGV[i], old)
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+for i = 5 + removed, #ARGV, 2 do
+    local old = redis.call('HGET', KEYS[1], ARGV[i])
+    if old ~= ARGV[i + 1] then
+        if old then
+            unindex(id, ARGV[i], old)
+        end
+        index(id, ARGV[i], ARGV[i + 1])
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+version = tonumber(version) + 1
+redis.call('HSET', KEYS[1], '_version', version, '_updated_at', ARGV[3])
+local record = redis.call('HGETALL', KEYS[1])
+table.insert(record, 1, version)
+return record
+"""
+
+# KEYS[1] record; ARGV[1] record id, ARGV[2] expected version ("" for any).
+# Returns 1 when deleted, 0 when the record does not exist and -2 on a version conflict.
+_DELETE_SCRIPT = _INDEX_FUNCTIONS + """
+local id = ARGV[1]
+local version = redis.call('HGET', KEYS[1], '_version')
+if not version then
+    return 0
+end
+if ARGV[2] ~= '' and ARGV[2] ~= version then
+    return -2
+end
+local record = redis.call('HGETALL', KEYS[1])
+for i = 1, #record, 2 do
+    if string.sub(record[i], 1, 1) ~= '_' then
+        unindex(id, record[i], record[i + 1])
+    end
+end
+redis.call('ZREM', 'data:ids', id)
+return redis.call('DEL', KEYS[1])
+"""
+
+class RecordNotFoundError(Exception):
+    """Raised when a record does not exist"""
+
+class VersionConflictError(Exception):
+    """Raised when a record was changed since the version the client has"""
+    def __init__(self, message: str, current_version: Optional[int] = None):
+        super().__init__(message)
+        self.current_version = current_version
+
+class InvalidFieldError(ValueError):
+    """Raised when a record uses a reserved field name"""
+
+class InvalidFilterError(ValueError):
+    """Raised when a query filter cannot be served by the indexes"""
+
+
+def index_text(value: str) -> str:
+    """Text of a string in its index members, with "\\1" and "\\0" escaped (same as string_member in Lua)"""
+    return value.replace("\1", "\1\2").replace("\0", "\1\1")
+
+
+class DataStore:
+    """Storage of the records of the generic data API"""
+    # The scripts are registered on first use, when the Redis client exists
+    @functools.cached_property
+    def _create_script(self):
+        return cache.redis_client.register_script(_CREATE_SCRIPT)
+
+    @functools.cached_property
+    def _update_script(self):
+        return cache.redis_client.register_script(_UPDATE_SCRIPT)
+
+    @functools.cached_property
+    def _delete_script(self):
+        return cache.redis_client.register_script(_DELETE_SCRIPT)
+
+    @staticmethod
+    def _key(record_id: str) -> str:
+        # Only ids the store generated, so an id never names one of the index keys
+        try:
+            uuid.UUID(record_id)
+        except (ValueError, TypeError, AttributeError):
+            raise RecordNotFoundError(f"Data with ID {record_id} not found")
+        return f"data:{record_id}"
+
+    @staticmethod
+    def _check_names(fields: Dict[str, Any]) -> None:
+        for name in fields:
+            if name in RESERVED_FIELDS or name.startswith("_"):
+                raise InvalidFieldError(f"Field name {name} is reserved")
+
+    @staticmethod
+    def _decode(record_id: str, raw: Dict[str, str]) -> Dict[str, Any]:
+        """Turn a stored hash into the record returned by the API"""
+        record = {
+            "id": record_id,
+            "version": int(raw.pop("_version")),
+            "created_at": raw.pop("_created_at", None),
+            "updated_at": raw.pop("_updated_at", None),
+        }
+        for name, value in raw.items():
+            if not name.startswith("_"):
+                record[name] = extraction.loads(value)
+        return record
+
+    def _queue_create(self, client, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Run (or queue, on a pipeline) the create script of a new record and return the record"""
+        self._check_names(fields)
+        record_id = str(uuid.uuid4())
+        timestamp = datetime.now().isoformat()
+        args = [record_id, timestamp]
+        for name, value in fields.items():
+            args.append(name)
+            args.append(extraction.dumps(value))
+        self._create_script(keys=[self._key(record_id)], args=args, client=client)
+        return {"id": record_id, "version": 1, "created_at": timestamp, "updated_at": timestamp, **fields}
+
+    def _update_args(self, record_id: str, fields: Dict[str, Any], expected_version: Optional[int],
+                     remove_nulls: bool) -> List[Any]:
+        self._check_names(fields)
+        args = [record_id, "" if expected_version is None else expected_version, datetime.now().isoformat()]
+        removed = [name for name, value in fields.items() if value is None] if remove_nulls else []
+        args.append(len(removed))
+        args.extend(removed)
+        for name, value in fields.items():
+            if not (remove_nulls and value is None):
+                args.append(name)
+                args.append(extraction.dumps(value))
+        return args
+
+    def _update_result(self, record_id: str, result: List[Any]) -> Dict[str, Any]:
+        if result[0] == -1:
+            raise RecordNotFoundError(f"Data with ID {record_id} not found")
+        if result[0] == -2:
+            raise VersionConflictError(f"Data with ID {record_id} is at version {result[1]}", result[1])
+        return self._decode(record_id, dict(zip(result[1::2], result[2::2])))
+
+    def _delete_result(self, record_id: str, deleted: int) -> None:
+        if deleted == -2:
+            raise VersionConflictError(f"Data with ID {record_id} has changed")
+        if not deleted:
+            raise RecordNotFoundError(f"Data with ID {record_id} not found")
+
+    def create(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a new record at version 1"""
+        return self._queue_create(cache.redis_client, fields)
+
+    def get(self, record_id: str) -> Dict[str, Any]:
+        """Get a record"""
+        raw = cache.redis_client.hgetall(self._key(record_id))
+        if not raw:
+            raise RecordNotFoundError(f"Data with ID {record_id} not found")
+        return self._decode(record_id, raw)
+
+    def update(self, record_id: str, fields: Dict[str, Any], expected_version: Optional[int] = None,
+               remove_nulls: bool = False) -> Dict[str, Any]:
+        """Atomically set the given fields and bump the version.
+
+        With `expected_version` the update only applies if the record is still
+        at that version. With `remove_nulls` fields set to null are removed
+        (JSON merge patch) instead of stored as null.
+        """
+        result = self._update_script(
+            keys=[self._key(record_id)],
+            args=self._update_args(record_id, fields, expected_version, remove_nulls),
+            client=cache.redis_client
+        )
+        return self._update_result(record_id, result)
+
+    def delete(self, record_id: str, expected_version: Optional[int] = None) -> None:
+        """Delete a record and its index entries in one round trip, optionally only if it is still at `expected_version`"""
+        deleted = self._delete_script(
+            keys=[self._key(record_id)],
+            args=[record_id, "" if expected_version is None else expected_version],
+            client=cache.redis_client
+        )
+        self._delete_result(record_id, deleted)
+
+    def get_many(self, record_ids: List[str]) -> List[Dict[str, Any]]:
+        """Get several records in one round trip, skipping the ones that do not exist"""
+        pipe = cache.redis_client.pipeline(transaction=False)
+        for record_id in record_ids:
+            pipe.hgetall(self._key(record_id))
+        return [self._decode(record_id, raw) for record_id, raw in zip(record_ids, pipe.execute()) if raw]
+
+    def _matching_ids(self, field: str, op: str, value: Any) -> Set[str]:
+        """Ids of the records whose field matches a filter, read from the field's index"""
+        if op not in FILTER_OPS:
+            raise InvalidFilterError(f"Unknown filter operator {op}")
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            minimum, maximum = {
+                "eq": (value, value),
+                "gt": (f"({value}", "+inf"),
+                "gte": (value, "+inf"),
+                "lt": ("-inf", f"({value}"),
+                "lte": ("-inf", value),
+            }[op]
+            return set(cache.redis_client.zrangebyscore(f"data:idx:{field}:num", minimum, maximum))
+        if isinstance(value, bool):
+            if op != "eq":
+                raise InvalidFilterError(f"Booleans can only be filtered with eq (field {field})")
+            return set(cache.redis_client.zrangebyscore(f"data:idx:{field}:bool", int(value), int(value)))
+        if isinstance(value, str):
+            # Members are "<text>\0<id>": "\0" sorts before and "\1" after every id of a value
+            text = index_text(value)
+            minimum, maximum = {
+                "eq": (f"[{text}\0", f"[{text}\1"),
+                "gt": (f"[{text}\1", "+"),
+                "gte": (f"[{text}\0", "+"),
+                "lt": ("-", f"[{text}\0"),
+                "lte": ("-", f"[{text}\1"),
+            }[op]
+            members = cache.redis_client.zrangebylex(f"data:idx:{field}:str", minimum, maximum)
+            return {member.rsplit(INDEX_SEPARATOR, 1)[1] for member in members}
+        raise InvalidFilterError(f"Only numbers, strings and booleans can be filtered on (field {field})")
+
+    def query(self, filters: Optional[List[Tuple[str, str, Any]]] = None, cursor: Optional[str] = None,
+              limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """List records in id order, optionally filtered, starting after `cursor`.
+
+        `filters` are (field, operator, value) tuples combined with AND; the
+        operators are eq, gt, gte, lt and lte. Returns the records and the
+        cursor of the next page (None on the last page).
+        """
+        if not filters:
+            start = f"({cursor}" if cursor else "-"
+            record_ids = cache.redis_client.zrangebylex("data:ids", start, "+", start=0, num=limit + 1)
+        else:
+            # Intersect the matches of every filter, smallest index result first
+            matches = sorted((self._matching_ids(*condition) for condition in filters), key=len)
+            record_ids = set.intersection(*matches)
+            record_ids = sorted(record_id for record_id in record_ids if not cursor or record_id > cursor)[:limit + 1]
+        next_cursor = record_ids[limit - 1] if len(record_ids) > limit else None
+        return self.get_many(record_ids[:limit]), next_cursor
+
+    def bulk(self, create: Optional[List[Dict[str, Any]]] = None,
+             update: Optional[List[Dict[str, Any]]] = None,
+             delete: Optional[List[Dict[str, Any]]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Apply many creates, updates and deletes with one pipelined round trip.
+
+        Updates are {"id", "data", "version"?, "remove_nulls"?} and deletes
+        {"id", "version"?}. Every operation is atomic on its own; the batch is
+        not. Returns one result per operation with the record or an error.
+        """
+        create, update, delete = create or [], update or [], delete or []
+        results = {"created": [], "updated": [], "deleted": []}
+        pipe = cache.redis_client.pipeline(transaction=False)
+
+        # Operations are validated up front, so the pipeline only holds valid writes
+        created = []
+        for fields in create:
+            try:
+                created.append(self._queue_create(pipe, fields))
+            except InvalidFieldError as e:
+                created.append(e)
+        queued_updates = []
+        for item in update:
+            try:
+                args = self._update_args(item["id"], item.get("data") or {}, item.get("version"),
+                                         item.get("remove_nulls", False))
+                self._update_script(keys=[self._key(item["id"])], args=args, client=pipe)
+                queued_updates.append(None)
+            except (InvalidFieldError, RecordNotFoundError) as e:
+                queued_updates.append(e)
+        queued_deletes = []
+        for item in delete:
+            try:
+                self._delete_script(
+                    keys=[self._key(item["id"])],
+                    args=[item["id"], "" if item.get("version") is None else item["version"]],
+                    client=pipe
+                )
+                queued_deletes.append(None)
+            except RecordNotFoundError as e:
+                queued_deletes.append(e)
+        replies = iter(pipe.execute(raise_on_error=False))
+
+        for record in created:
+            if isinstance(record, Exception):
+                results["created"].append({"error": str(record), "status_code": 400})
+                continue
+            reply = next(replies)
+            if isinstance(reply, Exception):
+                results["created"].append({"error": str(reply), "status_code": error_status(reply)})
+                continue
+            results["created"].append({"record": record, "status_code": 200})
+        for item, error in zip(update, queued_updates):
+            try:
+                if error is not None:
+                    raise error
+                reply = next(replies)
+                if isinstance(reply, Exception):
+                    raise reply
+                results["updated"].append({"record": self._update_result(item["id"], reply), "status_code": 200})
+            except Exception as e:
+                results["updated"].append({"id": item["id"], "error": str(e), "status_code": error_status(e)})
+        for item, error in zip(delete, queued_deletes):
+            try:
+                if error is not None:
+                    raise error
+                reply = next(replies)
+                if isinstance(reply, Exception):
+                    raise reply
+                self._delete_result(item["id"], reply)
+                results["deleted"].append({"id": item["id"], "status_code": 200})
+            except Exception as e:
+                results["deleted"].append({"id": item["id"], "error": str(e), "status_code": error_status(e)})
+        return results
+
+
+def error_status(e: Exception) -> int:
+    """HTTP status of a data store error"""
+    if isinstance(e, RecordNotFoundError):
+        return 404
+    if isinstance(e, VersionConflictError):
+        return 412
+    if isinstance(e, ValueError):
+        return 400
+    return 500
+
+
+# Create a singleton instance
+data_store = DataStore()
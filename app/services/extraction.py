@@ -0,0 +1,73 @@
+import logging
+from typing import Dict, Any, Optional
+import orjson
+from app.services.tokens import make_usage
+
+logger = logging.getLogger(__name__)
+
+# Fast extraction of the few fields the gateway needs from provider responses.
+#
+# Bodies are parsed with orjson straight from the raw bytes (no intermediate
+# str, much faster than the json module on large completions with logprobs or
+# candidate lists), then only the needed paths are indexed directly instead of
+# walking the nested dicts with membership checks.
+
+def loads(body: bytes) -> Any:
+    """Parse a JSON body from bytes"""
+    return orjson.loads(body)
+
+
+def dumps(data: Any) -> bytes:
+    """Serialize to compact JSON bytes"""
+    return orjson.dumps(data)
+
+
+def gemini_text(response: Dict[str, Any]) -> str:
+    """Get the text of the first candidate of a Gemini generateContent response"""
+    try:
+        parts = response["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError, TypeError):
+        return ""
+    if len(parts) == 1:
+        return parts[0].get("text", "")
+    return "".join(part.get("text", "") for part in parts)
+
+
+def gemini_usage(response: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Get the token usage of a Gemini response"""
+    metadata = response.get("usageMetadata")
+    if not metadata:
+        return None
+    return make_usage(
+        metadata.get("promptTokenCount", 0),
+        metadata.get("candidatesTokenCount", 0),
+        metadata.get("totalTokenCount")
+    )
+
+
+def openai_text(response: Dict[str, Any]) -> str:
+    """Get the message content of the first choice of an OpenAI-style response"""
+    try:
+        return response["choices"][0]["message"].get("content") or ""
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+
+def openai_delta(chunk: Dict[str, Any]) -> str:
+    """Get the content delta of the first choice of an OpenAI-style stream chunk"""
+    try:
+        return chunk["choices"][0]["delta"].get("content") or ""
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+
+def openai_usage(response: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Get the token usage of an OpenAI-style response"""
+    usage = response.get("usage")
+    if not usage:
+        return None
+    return make_usage(
+        usage.get("prompt_tokens", 0),
+        usage.get("completion_tokens", 0),
+        usage.get("total_tokens")
+    )
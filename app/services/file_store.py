@@ -0,0 +1,333 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple, AsyncIterator
+from app.cache.redis import cache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Files of the generic API are stored on local disk under the SHA-256 of their
+# content, so identical uploads share one blob. Request bodies are streamed to a
+# temporary file in the same directory tree while they are hashed, then renamed
+# into place (or dropped when the blob already exists); a file is never held in
+# memory. Metadata lives in Redis:
+#
+#   {FILE_STORAGE_DIR}/blobs/{sha256[:2]}/{sha256}  ->  content
+#   {FILE_STORAGE_DIR}/tmp/                         ->  bodies being received
+#   {FILE_STORAGE_DIR}/uploads/{upload_id}/{part}   ->  parts of resumable uploads
+#
+#   file:{id}           ->  filename, content_type, size, sha256, uploaded_at
+#   upload:{upload_id}  ->  filename, content_type, created_at, part:{number} = "<size> <sha256>"
+#
+# Resumable uploads send their parts separately, in any order and as often as
+# needed; a part is only recorded once its body was received completely, and
+# an upload is only completed when its parts are numbered 1 to N without gaps. The
+# upload session expires FILE_UPLOAD_TTL seconds after its last part, and the
+# parts of expired sessions are removed when the next upload starts. Several
+# workers need a shared FILE_STORAGE_DIR.
+
+# Size of the buffer used when copying stored bytes
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Received bytes gathered before they are hashed and written in a thread
+WRITE_BATCH_SIZE = 1024 * 1024
+
+# Highest part number of a resumable upload
+MAX_PARTS = 10000
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class StoredFileNotFoundError(Exception):
+    """Raised when a file or upload does not exist"""
+
+class FileTooLargeError(ValueError):
+    """Raised when a file is larger than FILE_MAX_SIZE"""
+
+class InvalidRangeError(ValueError):
+    """Raised when a Range header cannot be satisfied"""
+    def __init__(self, message: str, size: int):
+        super().__init__(message)
+        self.size = size
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range `Range: bytes=...` header into (offset, length).
+
+    Returns None when the whole file should be sent: no header, or a header
+    this server ignores (other units, several ranges). Raises InvalidRangeError
+    when the range lies outside the file.
+    """
+    if not header:
+        return None
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = min(int(last), size)
+        if length == 0:
+            raise InvalidRangeError("Empty suffix range", size)
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise InvalidRangeError(f"Range {header} not satisfiable for {size} bytes", size)
+    return start, end - start + 1
+
+
+class FileStore:
+    """Content-addressed storage of the files of the generic API"""
+    def __init__(self, root: str):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.upload_dir = os.path.join(root, "uploads")
+        self._ready = False
+
+    def _ensure_dirs(self) -> None:
+        # Created on first use rather than at import
+        if not self._ready:
+            for directory in (self.blob_dir, self.tmp_dir, self.upload_dir):
+                os.makedirs(directory, exist_ok=True)
+            self._ready = True
+
+    @staticmethod
+    def _key(file_id: str) -> str:
+        return f"file:{file_id}"
+
+    @staticmethod
+    def _upload_key(upload_id: str) -> str:
+        return f"upload:{upload_id}"
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def _part_path(self, upload_id: str, number: int) -> str:
+        return os.path.join(self.upload_dir, upload_id, f"{number:05d}")
+
+    @staticmethod
+    def _check_id(value: str) -> None:
+        # Ids end up in paths, so only accept the UUIDs this store hands out
+        try:
+            uuid.UUID(value)
+        except ValueError:
+            raise StoredFileNotFoundError(f"{value} is not a valid ID")
+
+    async def _receive(self, chunks: AsyncIterator[bytes], directory: str,
+                       max_size: int) -> Tuple[str, int, str]:
+        """Write a stream of chunks to a temporary file in `directory` while hashing it.
+
+        Chunks are gathered up to WRITE_BATCH_SIZE bytes, then hashed and written
+        in a thread, so large uploads do not block the event loop. Returns the
+        temporary path, the size and the SHA-256; the file is removed when the
+        stream fails or grows over `max_size` (0 for no limit).
+        """
+        digest = hashlib.sha256()
+        size = 0
+        batch = bytearray()
+
+        def write(f, data: bytes) -> None:
+            digest.update(data)
+            f.write(data)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        raise FileTooLargeError(f"Files are limited to {max_size} bytes")
+                    batch += chunk
+                    if len(batch) >= WRITE_BATCH_SIZE:
+                        data, batch = bytes(batch), bytearray()
+                        await asyncio.to_thread(write, f, data)
+                if batch:
+                    await asyncio.to_thread(write, f, bytes(batch))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path, size, digest.hexdigest()
+
+    def _commit_blob(self, tmp_path: str, sha256: str) -> None:
+        """Move a received file into the blob store, or drop it when the content is already stored"""
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def _record(self, filename: str, content_type: str, size: int, sha256: str) -> Dict[str, Any]:
+        file_data = {
+            "id": str(uuid.uuid4()),
+            "filename": filename,
+            "content_type": content_type,
+            "size": size,
+            "sha256": sha256,
+            "uploaded_at": datetime.now().isoformat(),
+        }
+        cache.redis_client.hset(self._key(file_data["id"]), mapping=file_data)
+        return file_data
+
+    async def save(self, chunks: AsyncIterator[bytes], filename: str, content_type: str) -> Dict[str, Any]:
+        """Store a file streamed in chunks and return its metadata"""
+        self._ensure_dirs()
+        tmp_path, size, sha256 = await self._receive(chunks, self.tmp_dir, settings.FILE_MAX_SIZE)
+        self._commit_blob(tmp_path, sha256)
+        return self._record(filename, content_type, size, sha256)
+
+    def get(self, file_id: str) -> Dict[str, Any]:
+        """Get the metadata of a file"""
+        self._check_id(file_id)
+        file_data = cache.redis_client.hgetall(self._key(file_id))
+        if not file_data:
+            raise StoredFileNotFoundError(f"File with ID {file_id} not found")
+        file_data["size"] = int(file_data["size"])
+        return file_data
+
+    def _purge_expired_uploads(self) -> None:
+        """Remove the parts of upload sessions that expired"""
+        cutoff = time.time() - settings.FILE_UPLOAD_TTL
+        for upload_id in os.listdir(self.upload_dir):
+            path = os.path.join(self.upload_dir, upload_id)
+            try:
+                if os.path.getmtime(path) < cutoff and not cache.redis_client.exists(self._upload_key(upload_id)):
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def create_upload(self, filename: str, content_type: str) -> Dict[str, Any]:
+        """Start a resumable upload"""
+        self._ensure_dirs()
+        self._purge_expired_uploads()
+        upload = {
+            "upload_id": str(uuid.uuid4()),
+            "filename": filename,
+            "content_type": content_type,
+            "created_at": datetime.now().isoformat(),
+        }
+        os.makedirs(os.path.join(self.upload_dir, upload["upload_id"]))
+        key = self._upload_key(upload["upload_id"])
+        pipe = cache.redis_client.pipeline(transaction=True)
+        pipe.hset(key, mapping=upload)
+        pipe.expire(key, settings.FILE_UPLOAD_TTL)
+        pipe.execute()
+        return upload
+
+    def get_upload(self, upload_id: str) -> Dict[str, Any]:
+        """Get an upload session with the parts received so far, to resume it"""
+        self._check_id(upload_id)
+        raw = cache.redis_client.hgetall(self._upload_key(upload_id))
+        if not raw:
+            raise StoredFileNotFoundError(f"Upload with ID {upload_id} not found")
+        upload = {"upload_id": upload_id, "parts": []}
+        for name, value in raw.items():
+            if name.startswith("part:"):
+                size, sha256 = value.split(" ", 1)
+                upload["parts"].append({"number": int(name[5:]), "size": int(size), "sha256": sha256})
+            else:
+                upload[name] = value
+        upload["parts"].sort(key=lambda part: part["number"])
+        upload["size"] = sum(part["size"] for part in upload["parts"])
+        return upload
+
+    async def write_part(self, upload_id: str, number: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Store one part of a resumable upload, replacing an earlier copy of the same part"""
+        upload = self.get_upload(upload_id)
+        if not 1 <= number <= MAX_PARTS:
+            raise ValueError(f"Part numbers go from 1 to {MAX_PARTS}")
+        received = sum(part["size"] for part in upload["parts"] if part["number"] != number)
+        max_size = settings.FILE_MAX_SIZE - received if settings.FILE_MAX_SIZE else 0
+        if settings.FILE_MAX_SIZE and max_size <= 0:
+            raise FileTooLargeError(f"Files are limited to {settings.FILE_MAX_SIZE} bytes")
+        directory = os.path.join(self.upload_dir, upload_id)
+        tmp_path, size, sha256 = await self._receive(chunks, directory, max_size)
+        os.replace(tmp_path, self._part_path(upload_id, number))
+
+        key = self._upload_key(upload_id)
+        pipe = cache.redis_client.pipeline(transaction=True)
+        pipe.hset(key, f"part:{number}", f"{size} {sha256}")
+        pipe.expire(key, settings.FILE_UPLOAD_TTL)
+        pipe.execute()
+        return {"number": number, "size": size, "sha256": sha256}
+
+    def complete_upload(self, upload_id: str) -> Dict[str, Any]:
+        """Join the parts of an upload in part order into a stored file.
+
+        The parts are read once to hash the whole file; this blocks, so callers
+        on the event loop run it in a thread.
+        """
+        upload = self.get_upload(upload_id)
+        if not upload["parts"]:
+            raise ValueError(f"Upload with ID {upload_id} has no parts")
+        numbers = {part["number"] for part in upload["parts"]}
+        missing = [number for number in range(1, max(numbers) + 1) if number not in numbers]
+        if missing:
+            shown = ", ".join(str(number) for number in missing[:20])
+            raise ValueError(f"Upload with ID {upload_id} is missing parts {shown}{'...' if len(missing) > 20 else ''}")
+        self._ensure_dirs()
+        digest = hashlib.sha256()
+        size = 0
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for part in upload["parts"]:
+                    with open(self._part_path(upload_id, part["number"]), "rb") as f:
+                        while True:
+                            read = f.readinto(buffer)
+                            if not read:
+                                break
+                            digest.update(view[:read])
+                            out.write(view[:read])
+                            size += read
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        sha256 = digest.hexdigest()
+        self._commit_blob(tmp_path, sha256)
+        file_data = self._record(upload["filename"], upload["content_type"], size, sha256)
+        self._discard_upload(upload_id)
+        return file_data
+
+    def _discard_upload(self, upload_id: str) -> bool:
+        deleted = cache.redis_client.delete(self._upload_key(upload_id))
+        shutil.rmtree(os.path.join(self.upload_dir, upload_id), ignore_errors=True)
+        return bool(deleted)
+
+    def abort_upload(self, upload_id: str) -> None:
+        """Drop an upload session and its parts"""
+        self._check_id(upload_id)
+        if not self._discard_upload(upload_id):
+            raise StoredFileNotFoundError(f"Upload with ID {upload_id} not found")
+
+
+def error_status(e: Exception) -> int:
+    """HTTP status of a file store error"""
+    if isinstance(e, StoredFileNotFoundError):
+        return 404
+    if isinstance(e, FileTooLargeError):
+        return 413
+    if isinstance(e, InvalidRangeError):
+        return 416
+    if isinstance(e, ValueError):
+        return 400
+    return 500
+
+
+# Create a singleton instance
+file_store = FileStore(settings.FILE_STORAGE_DIR)
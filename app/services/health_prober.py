@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from typing import Optional
+from app.core.config import settings
+from app.services.registry import ProviderRegistry, registry
+
+logger = logging.getLogger(__name__)
+
+class HealthProber:
+    """Background task that probes providers with an open circuit and brings them back once they recover.
+
+    The half-open trial slot is claimed in Redis, so with several workers only
+    one of them probes a given provider per cooldown period.
+    """
+    def __init__(self, registry: ProviderRegistry, interval: int):
+        self.registry = registry
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def probe_once(self) -> None:
+        """Probe every provider whose breaker cooldown has elapsed"""
+        for client in self.registry.clients.values():
+            if not client.breaker.cooldown_elapsed() or not client.breaker.try_acquire_trial():
+                continue
+            # The probe outcome is recorded by the breaker itself (half-open -> closed/open)
+            recovered = await asyncio.to_thread(client.probe)
+            logger.info(f"{client.api_name} health probe {'succeeded' if recovered else 'failed'}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_once()
+            except Exception as e:
+                logger.error(f"Health prober error: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Start probing in the background"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Health prober started with interval {self.interval}s")
+
+    async def stop(self) -> None:
+        """Stop the background task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Create a singleton instance
+health_prober = HealthProber(registry, settings.HEALTH_PROBE_INTERVAL)
@@ -0,0 +1,189 @@
+import time
+import hashlib
+import logging
+from typing import Dict, Any, Optional, List
+from app.cache.redis import cache
+from app.services.rate_limit_headers import RateLimitInfo
+
+logger = logging.getLogger(__name__)
+
+class UpstreamKey:
+    """One upstream credential of a provider"""
+    def __init__(self, api_name: str, key: str, rate_limit: int, tpm_limit: Optional[int] = None):
+        self.api_name = api_name
+        self.key = key
+        self.rate_limit = rate_limit
+        self.tpm_limit = tpm_limit  # tokens per minute, None when the provider has no token limit
+        # Keys are only ever stored in Redis and logs by a short fingerprint
+        self.key_id = hashlib.sha256(key.encode()).hexdigest()[:12]
+
+    def counter_key(self, minute: int) -> str:
+        return f"api:{self.api_name}:key:{self.key_id}:count:minute:{minute}"
+
+    def token_counter_key(self, minute: int) -> str:
+        return f"api:{self.api_name}:key:{self.key_id}:tokens:minute:{minute}"
+
+    @property
+    def disabled_key(self) -> str:
+        return f"api:{self.api_name}:key:{self.key_id}:disabled"
+
+    @property
+    def remaining_key(self) -> str:
+        return f"api:{self.api_name}:key:{self.key_id}:remaining"
+
+    @property
+    def remaining_tokens_key(self) -> str:
+        return f"api:{self.api_name}:key:{self.key_id}:remaining_tokens"
+
+
+class KeyPool:
+    """Pool of upstream credentials for one provider.
+
+    Every key has its own per-minute counter and health flag in Redis, so the
+    state is shared by all workers. Requests go to the key with the most
+    headroom and keys rejected by the provider are taken out of rotation
+    until their disable period expires. When the provider reports its quota
+    in rate-limit headers, the learned remaining count replaces the static
+    per-key limit until the upstream window resets.
+    """
+    def __init__(self, api_name: str, keys: List[UpstreamKey]):
+        self.api_name = api_name
+        self.keys = keys
+        self.cooldown_key = f"api:{api_name}:cooldown"
+
+    def _load_state(self) -> List[Dict[str, Any]]:
+        """Read the counters, learned quota and health flag of every key with one MGET"""
+        minute = int(time.time()) // 60
+        redis_keys = [self.cooldown_key]
+        for upstream_key in self.keys:
+            redis_keys.append(upstream_key.counter_key(minute))
+            redis_keys.append(upstream_key.token_counter_key(minute))
+            redis_keys.append(upstream_key.remaining_key)
+            redis_keys.append(upstream_key.remaining_tokens_key)
+            redis_keys.append(upstream_key.disabled_key)
+        try:
+            values = cache.redis_client.mget(redis_keys)
+        except Exception as e:
+            logger.error(f"Error reading key pool state for {self.api_name}: {str(e)}")
+            values = [None] * len(redis_keys)
+
+        # A provider-wide cooldown (Retry-After on a server error) blocks every key
+        cooldown = values[0]
+        state = []
+        for index, upstream_key in enumerate(self.keys):
+            used, tokens_used, remaining, remaining_tokens, disabled = values[1 + index * 5:6 + index * 5]
+            used = int(used or 0)
+            tokens_used = int(tokens_used or 0)
+            if remaining_tokens is not None:
+                token_headroom = int(remaining_tokens)
+            elif upstream_key.tpm_limit:
+                token_headroom = upstream_key.tpm_limit - tokens_used
+            else:
+                token_headroom = None  # no token limit
+            state.append({
+                "key": upstream_key,
+                "used": used,
+                "tokens_used": tokens_used,
+                "remaining": int(remaining) if remaining is not None else None,
+                "headroom": int(remaining) if remaining is not None else upstream_key.rate_limit - used,
+                "token_headroom": token_headroom,
+                "disabled": disabled or (f"provider_cooldown:{cooldown}" if cooldown else None),
+            })
+        return state
+
+    @staticmethod
+    def _has_capacity(entry: Dict[str, Any], tokens: int) -> bool:
+        if entry["disabled"] or entry["headroom"] <= 0:
+            return False
+        return entry["token_headroom"] is None or entry["token_headroom"] >= max(tokens, 1)
+
+    def headroom(self, tokens: int = 0) -> int:
+        """Total remaining requests this minute over the healthy keys that can take `tokens` more tokens"""
+        return sum(entry["headroom"] for entry in self._load_state() if self._has_capacity(entry, tokens))
+
+    def acquire(self, tokens: int = 0) -> Optional[UpstreamKey]:
+        """Pick the healthy key with the most headroom and count a request (and its estimated tokens) against it"""
+        candidates = [entry for entry in self._load_state() if self._has_capacity(entry, tokens)]
+        if not candidates:
+            return None
+        upstream_key = max(candidates, key=lambda entry: entry["headroom"])["key"]
+
+        try:
+            minute = int(time.time()) // 60
+            pipe = cache.redis_client.pipeline(transaction=False)
+            pipe.incr(upstream_key.counter_key(minute))
+            pipe.expire(upstream_key.counter_key(minute), 120)
+            if tokens:
+                pipe.incrby(upstream_key.token_counter_key(minute), tokens)
+                pipe.expire(upstream_key.token_counter_key(minute), 120)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error counting request for {self.api_name} key {upstream_key.key_id}: {str(e)}")
+        return upstream_key
+
+    def record_tokens(self, upstream_key: UpstreamKey, tokens: int) -> None:
+        """Correct the token counter of a key once the actual usage is known (tokens may be negative)"""
+        if not tokens:
+            return
+        try:
+            key = upstream_key.token_counter_key(int(time.time()) // 60)
+            pipe = cache.redis_client.pipeline(transaction=False)
+            pipe.incrby(key, tokens)
+            pipe.expire(key, 120)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error recording tokens for {self.api_name} key {upstream_key.key_id}: {str(e)}")
+
+    def disable(self, upstream_key: UpstreamKey, seconds: int, reason: str) -> None:
+        """Take a key out of rotation for the given number of seconds"""
+        try:
+            cache.redis_client.setex(upstream_key.disabled_key, max(int(seconds), 1), reason)
+            logger.warning(f"{self.api_name} key {upstream_key.key_id} disabled for {seconds}s: {reason}")
+        except Exception as e:
+            logger.error(f"Error disabling {self.api_name} key {upstream_key.key_id}: {str(e)}")
+
+    def update_quota(self, upstream_key: UpstreamKey, limits: RateLimitInfo) -> None:
+        """Remember the quota the provider reported for a key until its window resets"""
+        if limits.remaining is None and limits.remaining_tokens is None:
+            return
+        try:
+            pipe = cache.redis_client.pipeline(transaction=False)
+            if limits.remaining is not None:
+                pipe.setex(upstream_key.remaining_key, max(int(limits.reset_after or 60), 1), limits.remaining)
+            if limits.remaining_tokens is not None:
+                pipe.setex(upstream_key.remaining_tokens_key, max(int(limits.tokens_reset_after or 60), 1),
+                           limits.remaining_tokens)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error storing quota for {self.api_name} key {upstream_key.key_id}: {str(e)}")
+
+    def cool_down(self, seconds: float, reason: str) -> None:
+        """Stop sending requests to the provider with any key for the given number of seconds"""
+        try:
+            cache.redis_client.setex(self.cooldown_key, max(int(seconds), 1), reason)
+            logger.warning(f"{self.api_name} cooling down for {seconds:.0f}s: {reason}")
+        except Exception as e:
+            logger.error(f"Error setting cooldown for {self.api_name}: {str(e)}")
+
+    def enable(self, key_id: str) -> bool:
+        """Put a disabled key back into rotation"""
+        for upstream_key in self.keys:
+            if upstream_key.key_id == key_id:
+                cache.delete(upstream_key.disabled_key)
+                return True
+        return False
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Get the usage and health of every key"""
+        return [
+            {
+                "key_id": entry["key"].key_id,
+                "minute": entry["used"],
+                "limit_per_minute": entry["key"].rate_limit,
+                "tokens_minute": entry["tokens_used"],
+                "tpm_limit": entry["key"].tpm_limit,
+                "upstream_remaining": entry["remaining"],
+                "disabled": entry["disabled"],
+            }
+            for entry in self._load_state()
+        ]
@@ -0,0 +1,101 @@
+import hashlib
+import logging
+from typing import Dict, Any, Optional, List
+from app.core.config import settings
+from app.cache.redis import cache
+from app.services import extraction
+
+logger = logging.getLogger(__name__)
+
+# Conversations are identified by a chain of hashes, one per message: the hash
+# of a prefix is the hash of the previous prefix and the next message. A
+# conversation that continues an earlier one therefore shares all the prefix
+# hashes of the earlier one, and each message is hashed only once.
+
+def extend_hash(previous: Optional[str], message: Dict[str, Any]) -> str:
+    """Hash of a conversation prefix extended by one message"""
+    data = extraction.dumps((message.get("role"), message.get("content"), message.get("name")))
+    return hashlib.sha256((previous or "").encode() + data).hexdigest()
+
+
+def conversation_hashes(messages: List[Dict[str, Any]]) -> List[str]:
+    """Hash of every prefix of a conversation; the last one identifies the whole conversation"""
+    hashes = []
+    previous = None
+    for message in messages:
+        previous = extend_hash(previous, message)
+        hashes.append(previous)
+    return hashes
+
+
+class PrefixCache:
+    """Redis-backed cache of chat responses and of what providers know about conversation prefixes.
+
+    - Complete conversations (with their generation settings) map to the response,
+      so repeated requests are served without calling a provider.
+    - Prefixes map to the provider that last served them. Providers cache prompt
+      prefixes on their side (automatically for OpenAI-style APIs), so sending a
+      continued conversation to the same provider reuses that work.
+    - For providers with explicit context caching (Gemini), prefixes map to the
+      provider-side cache created for them, per upstream key.
+    """
+    def response_key(self, conversation_hash: str, params: Dict[str, Any]) -> str:
+        params_hash = hashlib.md5(extraction.dumps(params)).hexdigest()[:12]
+        return f"chat:{conversation_hash}:{params_hash}"
+
+    def get_response(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached chat response"""
+        return cache.get(key, route="chat")
+
+    def set_response(self, key: str, api_name: str, model: Optional[str], content: str) -> None:
+        """Cache a chat response"""
+        cache.set(key, {"api_name": api_name, "model": model, "content": content},
+                  tags={"provider": api_name, "model": model, "route": "chat"})
+
+    def remember(self, hashes: List[str], reply: Dict[str, Any], api_name: str) -> None:
+        """Remember that a provider has seen a conversation, and its reply as the prefix of the next turn"""
+        if settings.PREFIX_AFFINITY_SECONDS <= 0:
+            return
+        try:
+            pipe = cache.redis_client.pipeline(transaction=False)
+            pipe.setex(f"prefix:{hashes[-1]}", settings.PREFIX_AFFINITY_SECONDS, api_name)
+            pipe.setex(f"prefix:{extend_hash(hashes[-1], reply)}", settings.PREFIX_AFFINITY_SECONDS, api_name)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error storing prefix affinity: {str(e)}")
+
+    def affinity(self, hashes: List[str]) -> Optional[str]:
+        """Get the provider that last served the longest known prefix of a conversation"""
+        if settings.PREFIX_AFFINITY_SECONDS <= 0 or len(hashes) < 2:
+            return None
+        try:
+            # The last hash is the conversation itself, which is not a prefix
+            for api_name in reversed(cache.redis_client.mget([f"prefix:{h}" for h in hashes[:-1]])):
+                if api_name:
+                    return api_name
+        except Exception as e:
+            logger.error(f"Error reading prefix affinity: {str(e)}")
+        return None
+
+    def _context_key(self, prefix_hash: str, api_name: str, key_id: str, model: Optional[str]) -> str:
+        return f"prefix:{prefix_hash}:context:{api_name}:{key_id}:{model}"
+
+    def get_context(self, prefix_hash: str, api_name: str, key_id: str, model: Optional[str]) -> Optional[str]:
+        """Get the provider-side context cache of a prefix ("" when creating one failed recently)"""
+        try:
+            return cache.redis_client.get(self._context_key(prefix_hash, api_name, key_id, model))
+        except Exception as e:
+            logger.error(f"Error reading context cache of {api_name}: {str(e)}")
+            return ""
+
+    def set_context(self, prefix_hash: str, api_name: str, key_id: str, model: Optional[str],
+                    name: str, ttl: int) -> None:
+        """Remember the provider-side context cache of a prefix for `ttl` seconds"""
+        try:
+            cache.redis_client.setex(self._context_key(prefix_hash, api_name, key_id, model), max(int(ttl), 1), name)
+        except Exception as e:
+            logger.error(f"Error storing context cache of {api_name}: {str(e)}")
+
+
+# Create a singleton instance
+prefix_cache = PrefixCache()
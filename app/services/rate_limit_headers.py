@@ -0,0 +1,123 @@
+import re
+import time
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, Mapping
+
+logger = logging.getLogger(__name__)
+
+# Duration format used by OpenAI-style providers, e.g. "1s", "6m0s", "20ms", "1h2m3.5s"
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+class RateLimitInfo:
+    """Upstream quota state learned from a provider response"""
+    def __init__(self, remaining: Optional[int] = None, reset_after: Optional[float] = None,
+                 retry_after: Optional[float] = None, remaining_tokens: Optional[int] = None,
+                 tokens_reset_after: Optional[float] = None):
+        self.remaining = remaining  # requests left in the current upstream window
+        self.reset_after = reset_after  # seconds until the upstream window resets
+        self.retry_after = retry_after  # seconds the provider asked us to wait
+        self.remaining_tokens = remaining_tokens  # tokens left in the current upstream window
+        self.tokens_reset_after = tokens_reset_after  # seconds until the upstream token window resets
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "remaining": self.remaining,
+            "reset_after": self.reset_after,
+            "retry_after": self.retry_after,
+            "remaining_tokens": self.remaining_tokens,
+            "tokens_reset_after": self.tokens_reset_after,
+        }
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Parse a duration such as "30", "1.5s", "6m0s" or "20ms" into seconds"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """Parse a Retry-After header (delay in seconds or an HTTP date) into seconds"""
+    seconds = parse_duration(value)
+    if seconds is not None:
+        return max(seconds, 0.0)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset(value: str) -> Optional[float]:
+    """Parse a rate-limit reset header into seconds from now.
+
+    Providers send either a duration ("6m0s") or an absolute epoch time in
+    seconds or milliseconds (OpenRouter).
+    """
+    seconds = parse_duration(value)
+    if seconds is None:
+        return None
+    now = time.time()
+    if seconds > 1e12:  # epoch milliseconds
+        return max(seconds / 1000 - now, 0.0)
+    if seconds > 1e9:  # epoch seconds
+        return max(seconds - now, 0.0)
+    return seconds
+
+
+def _first(headers: Mapping[str, str], *names: str) -> Optional[str]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def parse_rate_limit_headers(headers: Mapping[str, str]) -> RateLimitInfo:
+    """Extract remaining/reset/Retry-After information from response headers (case-insensitive mapping)"""
+    info = RateLimitInfo()
+
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        info.retry_after = parse_retry_after(retry_after)
+
+    info.remaining = _parse_count(_first(headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining"))
+    info.remaining_tokens = _parse_count(headers.get("x-ratelimit-remaining-tokens"))
+
+    reset = _first(headers, "x-ratelimit-reset-requests", "x-ratelimit-reset")
+    if reset is not None:
+        info.reset_after = parse_reset(reset)
+
+    tokens_reset = headers.get("x-ratelimit-reset-tokens")
+    if tokens_reset is not None:
+        info.tokens_reset_after = parse_reset(tokens_reset)
+
+    return info
+
+
+def _parse_count(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        logger.debug(f"Ignoring unparsable rate-limit header value: {value}")
+        return None
+
+
+def parse_retry_delay(body: Dict[str, Any]) -> Optional[float]:
+    """Extract the retry delay Gemini sends in the body of a 429 (google.rpc.RetryInfo)"""
+    error = body.get("error") if isinstance(body, dict) else None
+    if not isinstance(error, dict):
+        return None
+    for detail in error.get("details") or []:
+        if isinstance(detail, dict) and "retryDelay" in detail:
+            return parse_duration(str(detail["retryDelay"]))
+    return None
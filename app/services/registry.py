@@ -0,0 +1,230 @@
+import os
+import re
+import json
+import random
+import logging
+from typing import Dict, Any, Optional, List, Union
+from pydantic import BaseModel, Field
+from app.core.config import settings
+from app.services.api_client import APIClient, GeminiClient, OpenAIClient
+from app.services.openrouter_client import OpenRouterClient
+from app.services.key_pool import KeyPool, UpstreamKey
+
+logger = logging.getLogger(__name__)
+
+# Client class for each supported wire format
+WIRE_FORMATS = {
+    "gemini": GeminiClient,
+    "openai": OpenAIClient,
+    "openrouter": OpenRouterClient,  # OpenAI-style with OpenRouter attribution headers
+}
+
+class KeyConfig(BaseModel):
+    """Configuration of one upstream credential"""
+    key: str
+    rate_limit: Optional[int] = None  # defaults to the provider rate limit
+    tpm_limit: Optional[int] = None  # defaults to the provider token limit
+
+class ProviderConfig(BaseModel):
+    """Configuration of one upstream provider"""
+    name: str
+    wire_format: str = "openai"
+    endpoint: str
+    api_key: str = ""  # a single key, or several separated by commas
+    api_keys: List[Union[str, KeyConfig]] = Field(default_factory=list)
+    rate_limit: int = 60  # requests per minute, per key
+    tpm_limit: Optional[int] = None  # tokens per minute, per key
+    cost_per_1k_input: float = 0.0  # price of 1000 prompt tokens
+    cost_per_1k_output: float = 0.0  # price of 1000 completion tokens
+    weight: int = Field(1, ge=1)  # relative share of traffic among providers with the same priority
+    priority: int = 0  # lower values are tried first
+    models: List[str] = Field(default_factory=list)  # the first model is the default
+    headers: Dict[str, str] = Field(default_factory=dict)
+    enabled: bool = True
+
+
+def _legacy_provider_configs() -> List[Dict[str, Any]]:
+    """Build provider configs from the per-provider *_API_KEY/*_ENDPOINT/*_RATE_LIMIT settings"""
+    return [
+        {
+            "name": "gemini",
+            "wire_format": "gemini",
+            "endpoint": settings.GEMINI_ENDPOINT,
+            "api_key": settings.GEMINI_API_KEY,
+            "rate_limit": settings.GEMINI_RATE_LIMIT,
+            "priority": 0,
+            "models": ["gemini-pro"],
+        },
+        {
+            "name": "deepseek",
+            "wire_format": "openai",
+            "endpoint": settings.DEEPSEEK_ENDPOINT,
+            "api_key": settings.DEEPSEEK_API_KEY,
+            "rate_limit": settings.DEEPSEEK_RATE_LIMIT,
+            "priority": 1,
+            "models": ["deepseek-chat"],
+        },
+        {
+            "name": "olama",
+            "wire_format": "openai",
+            "endpoint": settings.OLAMA_ENDPOINT,
+            "api_key": settings.OLAMA_API_KEY,
+            "rate_limit": settings.OLAMA_RATE_LIMIT,
+            "priority": 2,
+            "models": ["olama-chat"],
+        },
+        {
+            "name": "openrouter",
+            "wire_format": "openrouter",
+            "endpoint": settings.OPENROUTER_ENDPOINT,
+            "api_key": settings.OPENROUTER_API_KEY,
+            "rate_limit": settings.OPENROUTER_RATE_LIMIT,
+            "priority": 3,
+            "models": ["openai/gpt-3.5-turbo", "google/gemini-pro", "deepseek/deepseek-chat"],
+        },
+    ]
+
+
+def _expand_env(value: Any) -> Any:
+    """Expand ${VAR} references so secrets can stay in the environment (unset variables expand to "")"""
+    if isinstance(value, str):
+        return re.sub(r"\$\{(\w+)\}", lambda match: os.getenv(match.group(1), ""), value)
+    if isinstance(value, list):
+        return [_expand_env(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _expand_env(item) for key, item in value.items()}
+    return value
+
+
+def load_provider_configs(path: Optional[str] = None) -> List[ProviderConfig]:
+    """Load provider configs from a JSON file, falling back to the legacy settings"""
+    path = path if path is not None else settings.PROVIDERS_CONFIG
+    if path:
+        with open(path) as f:
+            raw = json.load(f)
+        # Accept either a list of providers or {"providers": [...]}
+        items = raw.get("providers", []) if isinstance(raw, dict) else raw
+        logger.info(f"Loaded {len(items)} provider(s) from {path}")
+    else:
+        items = _legacy_provider_configs()
+    return [ProviderConfig(**_expand_env(item)) for item in items]
+
+
+class ProviderRegistry:
+    """Registry of the configured API clients, used by the router for dispatch.
+
+    Without `configs` the providers are read from the settings, and the clients
+    are built on first use (or by load() at application startup) rather than
+    when the registry is created.
+    """
+    def __init__(self, configs: Optional[List[ProviderConfig]] = None):
+        self._initial_configs = configs
+        self._configs: Optional[Dict[str, ProviderConfig]] = None
+        self._clients: Optional[Dict[str, APIClient]] = None
+
+    @classmethod
+    def from_settings(cls) -> "ProviderRegistry":
+        """Create the registry from the configured providers"""
+        return cls()
+
+    def load(self) -> None:
+        """Build the clients of the configured providers, if not done yet"""
+        if self._clients is not None:
+            return
+        configs = self._initial_configs if self._initial_configs is not None else load_provider_configs()
+        self._configs, clients = {}, {}
+        for config in configs:
+            if not config.enabled:
+                continue
+            if config.wire_format not in WIRE_FORMATS:
+                logger.error(f"Unknown wire format {config.wire_format} for provider {config.name}, skipping")
+                continue
+            self._configs[config.name] = config
+            clients[config.name] = self._create_client(config)
+        self._clients = clients
+
+    @property
+    def configs(self) -> Dict[str, ProviderConfig]:
+        self.load()
+        return self._configs
+
+    @property
+    def clients(self) -> Dict[str, APIClient]:
+        self.load()
+        return self._clients
+
+    def _create_key_pool(self, config: ProviderConfig) -> KeyPool:
+        """Create the pool of upstream keys for a provider config"""
+        keys = []
+        for entry in [key.strip() for key in config.api_key.split(",")] + config.api_keys:
+            if isinstance(entry, str):
+                entry = KeyConfig(key=entry)
+            if entry.key:
+                keys.append(UpstreamKey(
+                    config.name,
+                    entry.key,
+                    entry.rate_limit or config.rate_limit,
+                    entry.tpm_limit or config.tpm_limit
+                ))
+        return KeyPool(config.name, keys)
+
+    def _create_client(self, config: ProviderConfig) -> APIClient:
+        """Create the API client for a provider config"""
+        client_class = WIRE_FORMATS[config.wire_format]
+        return client_class(
+            api_name=config.name,
+            endpoint=config.endpoint,
+            key_pool=self._create_key_pool(config),
+            models=config.models,
+            weight=config.weight,
+            priority=config.priority,
+            headers=config.headers,
+            cost_per_1k_input=config.cost_per_1k_input,
+            cost_per_1k_output=config.cost_per_1k_output,
+        )
+
+    def names(self) -> List[str]:
+        """Get the names of all registered providers"""
+        return list(self.clients)
+
+    def get(self, name: str) -> Optional[APIClient]:
+        """Get the client for a provider"""
+        return self.clients.get(name)
+
+    def candidates(self, model: Optional[str] = None, strategy: str = "priority",
+                   prompt_tokens: int = 0, max_tokens: int = 0,
+                   max_latency_ms: Optional[float] = None) -> List[APIClient]:
+        """Get the providers to try, in order.
+
+        With the "priority" strategy providers are ordered by priority; providers
+        sharing a priority are put in a weighted random order so traffic is spread
+        according to their weights.
+
+        With the "cost" strategy providers are ordered by the estimated cost of
+        the request, and providers whose recent average latency is above
+        `max_latency_ms` are left out (providers without recent traffic are kept).
+        """
+        clients = [client for client in self.clients.values() if not model or client.supports_model(model)]
+        if strategy == "cost":
+            if max_latency_ms:
+                clients = [
+                    client for client in clients
+                    if self._meets_latency(client, max_latency_ms)
+                ]
+            return sorted(
+                clients,
+                key=lambda client: (client.estimate_cost(prompt_tokens, max_tokens), client.priority)
+            )
+        return sorted(
+            clients,
+            key=lambda client: (client.priority, -random.random() ** (1.0 / client.weight))
+        )
+
+    @staticmethod
+    def _meets_latency(client: APIClient, max_latency_ms: float) -> bool:
+        window = client.breaker.window_stats()
+        return window["total"] == 0 or window["avg_latency_ms"] <= max_latency_ms
+
+
+# Create a singleton instance (the providers are loaded on first use)
+registry = ProviderRegistry.from_settings()
@@ -0,0 +1,60 @@
+import math
+from typing import Dict, Iterable, Optional, Tuple
+
+# DDSketch: a quantile sketch with relative-error guarantees. A value v goes into
+# bin ceil(log_gamma(v)), with gamma = (1 + a) / (1 - a); every quantile it
+# returns is within a relative error a of the exact one. Bins are plain counts,
+# so sketches merge by adding counts per bin, which is also how the rollups add
+# them up in SQL.
+
+# Relative accuracy of the latency sketches (2%)
+RELATIVE_ACCURACY = 0.02
+
+# Values below this (in ms) share the lowest bin
+MIN_VALUE = 0.01
+
+
+class DDSketch:
+    """Mergeable quantile sketch with relative accuracy `relative_accuracy`"""
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.count = 0
+
+    def bin(self, value: float) -> int:
+        """Bin index of a value"""
+        return math.ceil(math.log(max(value, MIN_VALUE)) / self.log_gamma)
+
+    def value(self, index: int) -> float:
+        """Representative value of a bin, within the relative accuracy of all its values"""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        index = self.bin(value)
+        self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+
+    def add_bins(self, bins: Iterable[Tuple[int, int]]) -> None:
+        """Add (bin index, count) pairs, e.g. read back from storage"""
+        for index, count in bins:
+            self.bins[index] = self.bins.get(index, 0) + count
+            self.count += count
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.gamma != self.gamma:
+            raise ValueError("Sketches with different accuracies cannot be merged")
+        self.add_bins(other.bins.items())
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0 to 1), None when the sketch is empty"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return self.value(index)
+        return self.value(max(self.bins))
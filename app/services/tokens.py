@@ -0,0 +1,49 @@
+import logging
+from typing import Dict, Any, Optional, List
+
+logger = logging.getLogger(__name__)
+
+# Average number of ASCII characters per token for English text and code
+ASCII_CHARS_PER_TOKEN = 4
+
+# Tokens added by chat formats around every message (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate used before a request is sent.
+
+    ASCII text averages about four characters per token, while non-ASCII
+    characters (CJK, emoji, ...) mostly cost a token each. Both counts are
+    computed by C-level string operations, so this stays fast on large prompts.
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return max(1, (ascii_chars + ASCII_CHARS_PER_TOKEN - 1) // ASCII_CHARS_PER_TOKEN + other_chars)
+
+
+def content_text(content: Any) -> str:
+    """Text of a message content, a string or a list of OpenAI content parts"""
+    if isinstance(content, list):
+        return "".join(part["text"] for part in content if isinstance(part, dict) and isinstance(part.get("text"), str))
+    return content or ""
+
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Cheap local token estimate of a chat history, including the per-message overhead"""
+    return sum(estimate_tokens(content_text(message.get("content"))) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def make_usage(prompt_tokens: int, completion_tokens: int, total_tokens: Optional[int] = None) -> Dict[str, int]:
+    """Build a usage dict in the OpenAI format used throughout the gateway"""
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens if total_tokens is not None else prompt_tokens + completion_tokens,
+    }
+
+
+def usage_cost(usage: Dict[str, int], cost_per_1k_input: float, cost_per_1k_output: float) -> float:
+    """Cost of a request in the currency of the configured prices"""
+    return (usage["prompt_tokens"] * cost_per_1k_input + usage["completion_tokens"] * cost_per_1k_output) / 1000
@@ -0,0 +1,241 @@
+import io
+import csv
+import time
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List, Deque
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# psycopg2 is only needed when the usage log is enabled
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# Durable per-request history in Postgres. Generation requests leave one record
+# each in a bounded in-memory ring buffer; a background task copies the buffer
+# to the usage_log table in batches with COPY, off the event loop. Requests only
+# ever append to the buffer, so a slow or unreachable database never adds
+# latency: when the buffer is full the oldest records are dropped and counted.
+# Failed batches go back to the front of the buffer (space permitting) and are
+# retried with exponential backoff.
+#
+# Records are filled in while the request runs: the middleware opens one per
+# request, and the endpoints, key validation and token accounting annotate it
+# with the key, provider, model, tokens and cache tier.
+
+COLUMNS = ("ts", "endpoint", "key_id", "provider", "model", "prompt_tokens", "completion_tokens",
+           "total_tokens", "latency_ms", "cache_tier", "status")
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS usage_log (
+    id bigserial PRIMARY KEY,
+    ts timestamptz NOT NULL,
+    endpoint text NOT NULL,
+    key_id text,
+    provider text,
+    model text,
+    prompt_tokens integer,
+    completion_tokens integer,
+    total_tokens integer,
+    latency_ms real,
+    cache_tier text,
+    status smallint
+);
+CREATE INDEX IF NOT EXISTS usage_log_ts ON usage_log (ts);
+"""
+
+# Paths of the requests that are logged
+LOGGED_PATHS = ("/api/ai/generate", "/api/ai/batch", "/api/ai/chat/completions", "/v1/chat/completions")
+
+# Cache tiers a response can come from; "none" means an upstream call
+CACHE_TIERS = ("none", "response", "prefix", "proxy")
+
+# Longest wait between retries of a failing database
+MAX_BACKOFF_SECONDS = 60
+
+# Record of the request being handled, None when it is not logged
+_current_usage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("usage_record", default=None)
+
+
+def annotate(**fields) -> None:
+    """Set fields of the usage record of the current request, if it is logged"""
+    record = _current_usage.get()
+    if record is not None:
+        record.update(fields)
+
+
+def add_tokens(usage: Optional[Dict[str, int]]) -> None:
+    """Add token usage to the record of the current request (batches add up their prompts)"""
+    record = _current_usage.get()
+    if record is None or not usage:
+        return
+    for name in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        record[name] = (record.get(name) or 0) + usage.get(name, 0)
+
+
+class UsageLog:
+    """Ring buffer of request records and the task flushing it to Postgres"""
+    def __init__(self, enabled: bool, capacity: int, batch_size: int, flush_interval: float):
+        self.enabled = enabled and psycopg2 is not None
+        if enabled and psycopg2 is None:
+            logger.warning("USAGE_LOG_ENABLED is set but psycopg2 is not installed, usage log disabled")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.dropped = 0
+        self.written = 0
+        self.last_error: Optional[str] = None
+        self._connection = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Derived tables kept up to date in the transaction of every batch (e.g. rollups)
+        self.writers: List = []
+
+    def add_writer(self, writer) -> None:
+        """Register an object with `create_tables(cursor)` and `write(cursor, batch)`"""
+        if writer not in self.writers:
+            self.writers.append(writer)
+
+    def begin(self, endpoint: str) -> Optional[Dict[str, Any]]:
+        """Open the record of a request; returns None when the log is disabled"""
+        if not self.enabled:
+            return None
+        record = {"ts": time.time(), "endpoint": endpoint, "cache_tier": "none"}
+        _current_usage.set(record)
+        return record
+
+    def finish(self, record: Dict[str, Any], status: int, latency_ms: float) -> None:
+        """Queue a finished record; never blocks"""
+        record["status"] = status
+        record["latency_ms"] = round(latency_ms, 2)
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        batch = []
+        while self.buffer and len(batch) < self.batch_size:
+            batch.append(self.buffer.popleft())
+        return batch
+
+    def _requeue(self, batch: List[Dict[str, Any]]) -> None:
+        """Put a failed batch back at the front, dropping what no longer fits"""
+        room = self.buffer.maxlen - len(self.buffer)
+        kept = batch[:room]
+        self.dropped += len(batch) - len(kept)
+        self.buffer.extendleft(reversed(kept))
+
+    def _connect(self):
+        if self._connection is None or self._connection.closed:
+            self._connection = psycopg2.connect(settings.DATABASE_URL)
+            with self._connection, self._connection.cursor() as cursor:
+                cursor.execute(CREATE_TABLE)
+                for writer in self.writers:
+                    writer.create_tables(cursor)
+        return self._connection
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        """COPY a batch into usage_log and update the derived tables, in one transaction (runs in a thread)"""
+        rows = io.StringIO()
+        writer = csv.writer(rows)
+        for record in batch:
+            row = []
+            for column in COLUMNS:
+                value = record.get(column)
+                if column == "ts":
+                    value = datetime.fromtimestamp(value, timezone.utc).isoformat()
+                row.append("" if value is None else value)
+            writer.writerow(row)
+        rows.seek(0)
+        connection = self._connect()
+        try:
+            with connection, connection.cursor() as cursor:
+                cursor.copy_expert(f"COPY usage_log ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", rows)
+                for writer in self.writers:
+                    writer.write(cursor, batch)
+        except Exception:
+            connection.close()
+            raise
+
+    async def flush(self) -> int:
+        """Write everything buffered; returns the number of records written"""
+        written = 0
+        while self.buffer:
+            batch = self._take_batch()
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                self._requeue(batch)
+                raise
+            written += len(batch)
+            self.written += len(batch)
+        return written
+
+    async def _run(self) -> None:
+        backoff = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                self.last_error = None
+                backoff = self.flush_interval
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Usage log flush failed, {len(self.buffer)} records buffered: {str(e)}")
+                backoff = min(max(backoff, 1) * 2, MAX_BACKOFF_SECONDS)
+
+    def start(self) -> None:
+        """Start flushing in the background"""
+        if self.enabled and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Usage log started, flushing every {self.flush_interval}s or {self.batch_size} records")
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Stop the background task and write what is left, giving up after `timeout` seconds"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout=timeout)
+        except Exception as e:
+            logger.error(f"Usage log final flush failed, {len(self.buffer)} records lost: {str(e)}")
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self.buffer),
+            "capacity": self.buffer.maxlen,
+            "written": self.written,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+        }
+
+
+# Create a singleton instance
+usage_log = UsageLog(
+    settings.USAGE_LOG_ENABLED,
+    settings.USAGE_LOG_BUFFER,
+    settings.USAGE_LOG_BATCH_SIZE,
+    settings.USAGE_LOG_FLUSH_INTERVAL
+)
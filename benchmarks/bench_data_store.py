@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import random
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.data_store import data_store
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Runs against the Redis configured in the settings (REDIS_HOST, REDIS_PORT, REDIS_DB).
+# Only the records created here are deleted at the end, but use a scratch database.
+RECORDS = int(os.getenv("BENCH_RECORDS", 100000))
+BULK_SIZE = int(os.getenv("BENCH_BULK_SIZE", 1000))
+SINGLE_SAMPLE = 1000
+QUERY_SAMPLE = 200
+COLORS = ["red", "green", "blue", "yellow", "black"]
+
+def make_record(n: int) -> dict:
+    return {
+        "n": n,
+        "score": random.random() * 1000,
+        "color": random.choice(COLORS),
+        "active": n % 3 == 0,
+        "tags": ["bench", str(n % 10)],
+    }
+
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:10.0f}/s"
+
+
+def bench_inserts(created: list) -> None:
+    """Compare one round trip per record with pipelined bulk creates"""
+    start = time.perf_counter()
+    for n in range(SINGLE_SAMPLE):
+        created.append(data_store.create(make_record(n))["id"])
+    logger.info(f"single create     {SINGLE_SAMPLE:7d} records  {rate(SINGLE_SAMPLE, time.perf_counter() - start)}")
+
+    start = time.perf_counter()
+    for offset in range(SINGLE_SAMPLE, RECORDS, BULK_SIZE):
+        batch = [make_record(n) for n in range(offset, min(offset + BULK_SIZE, RECORDS))]
+        results = data_store.bulk(create=batch)
+        created.extend(result["record"]["id"] for result in results["created"])
+    count = RECORDS - SINGLE_SAMPLE
+    logger.info(f"bulk create       {count:7d} records  {rate(count, time.perf_counter() - start)}  ({BULK_SIZE} per bulk)")
+
+
+def bench_queries() -> None:
+    """Cursor walk over every record, then indexed equality and range filters"""
+    start = time.perf_counter()
+    count, cursor, pages = 0, None, 0
+    while True:
+        records, cursor = data_store.query(cursor=cursor, limit=500)
+        count += len(records)
+        pages += 1
+        if not cursor:
+            break
+    logger.info(f"cursor walk       {count:7d} records  {rate(count, time.perf_counter() - start)}  ({pages} pages)")
+
+    for label, make_filters in (
+        ("eq string", lambda: [("color", "eq", random.choice(COLORS))]),
+        ("eq bool + string", lambda: [("active", "eq", True), ("color", "eq", random.choice(COLORS))]),
+        ("number range", lambda: [("score", "gte", (low := random.random() * 990)), ("score", "lt", low + 10)]),
+    ):
+        start = time.perf_counter()
+        matched = 0
+        for _ in range(QUERY_SAMPLE):
+            records, _ = data_store.query(make_filters(), limit=50)
+            matched += len(records)
+        elapsed = time.perf_counter() - start
+        logger.info(f"query {label:17s} {QUERY_SAMPLE:5d} queries  {rate(QUERY_SAMPLE, elapsed)}  "
+                    f"{elapsed / QUERY_SAMPLE * 1000:8.2f} ms/query  ({matched / QUERY_SAMPLE:.0f} records/page)")
+
+
+def bench_updates(created: list) -> None:
+    """Single versioned updates against pipelined bulk updates"""
+    sample = random.sample(created, min(SINGLE_SAMPLE, len(created)))
+    start = time.perf_counter()
+    for record_id in sample:
+        data_store.update(record_id, {"color": random.choice(COLORS), "score": random.random() * 1000})
+    logger.info(f"single update     {len(sample):7d} records  {rate(len(sample), time.perf_counter() - start)}")
+
+    start = time.perf_counter()
+    for offset in range(0, len(sample), BULK_SIZE):
+        data_store.bulk(update=[
+            {"id": record_id, "data": {"color": random.choice(COLORS), "score": random.random() * 1000}}
+            for record_id in sample[offset:offset + BULK_SIZE]
+        ])
+    logger.info(f"bulk update       {len(sample):7d} records  {rate(len(sample), time.perf_counter() - start)}")
+
+
+def cleanup(created: list) -> None:
+    start = time.perf_counter()
+    for offset in range(0, len(created), BULK_SIZE):
+        data_store.bulk(delete=[{"id": record_id} for record_id in created[offset:offset + BULK_SIZE]])
+    logger.info(f"bulk delete       {len(created):7d} records  {rate(len(created), time.perf_counter() - start)}")
+
+
+if __name__ == "__main__":
+    logger.info(f"Benchmarking the data store with {RECORDS} records")
+    random.seed(0)
+    created = []
+    start = time.time()
+    try:
+        bench_inserts(created)
+        bench_queries()
+        bench_updates(created)
+    finally:
+        cleanup(created)
+    logger.info(f"Done in {time.time() - start:.1f}s")
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import timeit
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.api.router import GenerateResponse
+from app.services import extraction
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Approximate provider response sizes to benchmark
+SIZES = {"1KB": 1024, "100KB": 100 * 1024, "1MB": 1024 * 1024}
+
+def make_gemini_body(size: int) -> bytes:
+    """Build a Gemini generateContent response of roughly `size` bytes.
+
+    Large responses are padded the way real ones grow, with per-token
+    logprobs rather than a longer text.
+    """
+    text = "The quick brown fox jumps over the lazy dog. " * 8
+    body = {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": 12, "candidatesTokenCount": 96, "totalTokenCount": 108},
+    }
+    entry = {"token": "fox", "logProbability": -0.0123, "topCandidates": [{"token": "dog", "logProbability": -4.56}] * 4}
+    count = max(0, size - len(json.dumps(body))) // (len(json.dumps(entry)) + 2)
+    body["candidates"][0]["logprobsResult"] = {"chosenCandidates": [entry] * count}
+    return json.dumps(body).encode()
+
+
+def make_openai_body(size: int) -> bytes:
+    """Build an OpenAI chat completion of roughly `size` bytes padded with logprobs"""
+    text = "The quick brown fox jumps over the lazy dog. " * 8
+    body = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 12, "completion_tokens": 96, "total_tokens": 108},
+    }
+    entry = {"token": "fox", "logprob": -0.0123, "top_logprobs": [{"token": "dog", "logprob": -4.56}] * 4}
+    count = max(0, size - len(json.dumps(body))) // (len(json.dumps(entry)) + 2)
+    body["choices"][0]["logprobs"] = {"content": [entry] * count}
+    return json.dumps(body).encode()
+
+
+def legacy_gemini(body: bytes) -> bytes:
+    """Previous path: json module, nested membership checks, validated response model"""
+    response = json.loads(body.decode())
+    content = ""
+    if "candidates" in response and len(response["candidates"]) > 0:
+        candidate = response["candidates"][0]
+        if "content" in candidate and "parts" in candidate["content"]:
+            for part in candidate["content"]["parts"]:
+                if "text" in part:
+                    content += part["text"]
+    model = GenerateResponse(content=content, provider="gemini", cached=False, latency_ms=1.0)
+    return model.model_dump_json().encode()
+
+
+def fast_gemini(body: bytes) -> bytes:
+    """Current path: orjson from bytes, direct indexing, unvalidated model, orjson output"""
+    response = extraction.loads(body)
+    model = GenerateResponse.model_construct(
+        content=extraction.gemini_text(response),
+        provider="gemini",
+        cached=False,
+        latency_ms=1.0,
+        usage=extraction.gemini_usage(response)
+    )
+    return extraction.dumps(model.model_dump())
+
+
+def legacy_openai(body: bytes) -> bytes:
+    response = json.loads(body.decode())
+    content = ""
+    if "choices" in response and len(response["choices"]) > 0:
+        choice = response["choices"][0]
+        if "message" in choice and "content" in choice["message"]:
+            content = choice["message"]["content"]
+    model = GenerateResponse(content=content, provider="openai", cached=False, latency_ms=1.0)
+    return model.model_dump_json().encode()
+
+
+def fast_openai(body: bytes) -> bytes:
+    response = extraction.loads(body)
+    model = GenerateResponse.model_construct(
+        content=extraction.openai_text(response),
+        provider="openai",
+        cached=False,
+        latency_ms=1.0,
+        usage=extraction.openai_usage(response)
+    )
+    return extraction.dumps(model.model_dump())
+
+
+def bench(func, body: bytes) -> float:
+    """Return the best mean time per call in microseconds"""
+    number = max(1, int(20000 / (len(body) / 1024 + 1)))
+    best = min(timeit.repeat(lambda: func(body), number=number, repeat=5))
+    return best / number * 1e6
+
+
+def same_output(left: bytes, right: bytes) -> bool:
+    """The paths only have to agree on content and provider (the legacy one has no usage)"""
+    left, right = extraction.loads(left), extraction.loads(right)
+    return left["content"] == right["content"] and left["provider"] == right["provider"]
+
+
+def run_benchmarks():
+    """Compare the legacy and current extraction paths for every response size"""
+    results = []
+    for provider, make_body, legacy, fast in (
+        ("gemini", make_gemini_body, legacy_gemini, fast_gemini),
+        ("openai", make_openai_body, legacy_openai, fast_openai),
+    ):
+        for label, size in SIZES.items():
+            body = make_body(size)
+            assert same_output(legacy(body), fast(body)), f"{provider} {label}: outputs differ"
+            legacy_us = bench(legacy, body)
+            fast_us = bench(fast, body)
+            results.append((provider, label, legacy_us, fast_us))
+            logger.info(f"{provider:7s} {label:6s} ({len(body)} bytes) legacy {legacy_us:10.1f} us  fast {fast_us:10.1f} us  "
+                        f"speedup {legacy_us / fast_us:5.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    logger.info("Benchmarking provider response extraction")
+    start = time.time()
+    run_benchmarks()
+    logger.info(f"Done in {time.time() - start:.1f}s")
@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from typing import Dict, Any, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_providers import STUBS, DEFAULT_PROFILE, stub_endpoints
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Offline load test of the gateway. Stub providers (benchmarks/stub_providers.py)
+# run in a separate process; the application runs in this one and is driven
+# through its ASGI interface by an in-process HTTP client, so the measured CPU is
+# the gateway's plus the client's, without the stubs. Every scenario starts from
+# an empty Redis and reports throughput, latency percentiles, CPU per request,
+# the status codes and which providers served the responses.
+#
+# BENCH_REDIS=fake uses fakeredis (pip install -r requirements-dev.txt); otherwise the Redis of
+# the settings is used and REDIS_DB (15 unless set) is FLUSHED between scenarios.
+# BENCH_OUTPUT writes the results as JSON; BENCH_BASELINE compares them with an
+# earlier output and fails when throughput, p99 latency or CPU per request got
+# worse by more than BENCH_TOLERANCE.
+REQUESTS = int(os.getenv("BENCH_REQUESTS", 2000))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", 32))
+REDIS_MODE = os.getenv("BENCH_REDIS", "local")
+OUTPUT = os.getenv("BENCH_OUTPUT", "")
+BASELINE = os.getenv("BENCH_BASELINE", "")
+TOLERANCE = float(os.getenv("BENCH_TOLERANCE", 0.2))
+STUB_PORT = int(os.getenv("STUB_BASE_PORT", 18100))
+API_KEY = "bench-admin-key"
+
+# Upstreams fast enough that the gateway's own overhead shows
+FAST = {"latency_ms": 20.0, "latency_p99_ms": 80.0}
+
+# Stub profiles per scenario, and how prompts are picked ("repeat" draws from a
+# small warmed-up set, "unique" never repeats)
+SCENARIOS = {
+    "cache_hit": {
+        "prompts": "repeat",
+        "profiles": {name: FAST for name in STUBS},
+    },
+    "cache_miss": {
+        "prompts": "unique",
+        "profiles": {name: FAST for name in STUBS},
+    },
+    "failover": {
+        "prompts": "unique",
+        "profiles": {
+            "gemini": dict(FAST, error_rate=0.2, rate_limit_rate=0.2, retry_after=0),
+            "deepseek": dict(FAST, error_rate=0.05),
+            "openai": FAST,
+        },
+    },
+}
+
+REPEATED_PROMPTS = 20
+
+
+def providers_config(base_port: int) -> Dict[str, Any]:
+    """Providers config pointing every provider at its stub, with limits out of the way"""
+    endpoints = stub_endpoints(base_port)
+    models = {"gemini": ["gemini-pro"], "deepseek": ["deepseek-chat"], "openai": ["gpt-4o-mini"]}
+    return {"providers": [
+        {
+            "name": name,
+            "wire_format": wire_format,
+            "endpoint": endpoints[name],
+            "api_key": f"stub-{name}-key",
+            "rate_limit": 1000000,
+            "priority": priority,
+            "models": models[name],
+        }
+        for priority, (name, wire_format) in enumerate(STUBS.items())
+    ]}
+
+
+def start_stubs(base_port: int) -> subprocess.Popen:
+    """Start the stub providers in their own process and wait until they answer"""
+    env = dict(os.environ, STUB_BASE_PORT=str(base_port))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "stub_providers.py")], env=env)
+    deadline = time.time() + 10
+    for offset in range(len(STUBS)):
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{base_port + offset}/_health", timeout=1).read()
+                break
+            except OSError:
+                if time.time() > deadline or process.poll() is not None:
+                    process.kill()
+                    raise SystemExit("Stub providers did not start")
+                time.sleep(0.05)
+    return process
+
+
+def set_profiles(base_port: int, profiles: Dict[str, Dict[str, Any]]) -> None:
+    for offset, name in enumerate(STUBS):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{base_port + offset}/_profile",
+            data=json.dumps(dict(DEFAULT_PROFILE, **profiles.get(name, {}))).encode(),
+            headers={"Content-Type": "application/json"}
+        )
+        urllib.request.urlopen(request, timeout=5).read()
+
+
+def configure_environment(config_path: str) -> None:
+    """Settings of the gateway under test; must run before the app is imported"""
+    os.environ["PROVIDERS_CONFIG"] = config_path
+    os.environ["ADMIN_API_KEY"] = API_KEY
+    os.environ["HEALTH_PROBE_INTERVAL"] = "0"
+    os.environ.setdefault("REDIS_DB", "15")
+
+
+def use_redis(cache) -> None:
+    """Point the gateway at fakeredis when asked to"""
+    if REDIS_MODE == "fake":
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit("BENCH_REDIS=fake needs fakeredis (pip install -r requirements-dev.txt)")
+        cache._redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+
+def quiet_gateway_logs() -> None:
+    """Keep this script's report on the console and only the gateway's errors.
+
+    The application's startup routes standard logging to loguru; take it back.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', force=True)
+    for name in ("app", "main", "httpx"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_scenario(client, name: str, scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """Send REQUESTS generate requests, CONCURRENCY at a time, and summarize them"""
+    rng = random.Random(name)
+    if scenario["prompts"] == "repeat":
+        pool = [f"Benchmark prompt {i}: summarize the routing policy." for i in range(REPEATED_PROMPTS)]
+        # Warm the cache so the measured requests are all hits
+        for prompt in pool:
+            await client.post("/api/ai/generate", json={"prompt": prompt})
+        prompts = [rng.choice(pool) for _ in range(REQUESTS)]
+    else:
+        prompts = [f"Benchmark prompt {name} {i} {rng.random()}" for i in range(REQUESTS)]
+
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    providers: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def send(prompt: str) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/ai/generate", json={"prompt": prompt})
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+            if response.status_code == 200:
+                body = response.json()
+                provider = "cache" if body.get("cached") else body.get("provider", "?")
+                providers[provider] = providers.get(provider, 0) + 1
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(send(prompt) for prompt in prompts))
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+    return {
+        "requests": len(prompts),
+        "throughput_rps": len(prompts) / wall,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": percentile(latencies, 0.99),
+        "cpu_ms_per_request": cpu / len(prompts) * 1000,
+        "statuses": statuses,
+        "providers": providers,
+    }
+
+
+def report(name: str, result: Dict[str, Any]) -> None:
+    logger.info(f"{name:11s} {result['throughput_rps']:8.1f} req/s  p50 {result['p50_ms']:8.1f} ms  "
+                f"p99 {result['p99_ms']:8.1f} ms  cpu {result['cpu_ms_per_request']:6.2f} ms/req  "
+                f"status {result['statuses']}  providers {result['providers']}")
+
+
+def regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Scenarios that got worse than the baseline by more than TOLERANCE"""
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - TOLERANCE):
+            found.append(f"{name}: throughput {before['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+        if result["p99_ms"] > before["p99_ms"] * (1 + TOLERANCE):
+            found.append(f"{name}: p99 {before['p99_ms']:.1f} -> {result['p99_ms']:.1f} ms")
+        if result["cpu_ms_per_request"] > before["cpu_ms_per_request"] * (1 + TOLERANCE):
+            found.append(f"{name}: cpu {before['cpu_ms_per_request']:.2f} -> {result['cpu_ms_per_request']:.2f} ms/req")
+    return found
+
+
+async def run_benchmarks(scenarios: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    import httpx
+    import main
+    from app.cache.redis import cache
+
+    use_redis(cache)
+    results = {}
+    async with main.lifespan(main.app):
+        quiet_gateway_logs()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway",
+                                     headers={"X-API-Key": API_KEY}, timeout=120) as client:
+            for name in scenarios or list(SCENARIOS):
+                cache.redis_client.flushdb()
+                set_profiles(STUB_PORT, SCENARIOS[name]["profiles"])
+                results[name] = await run_scenario(client, name, SCENARIOS[name])
+                report(name, results[name])
+    return results
+
+
+if __name__ == "__main__":
+    logger.info(f"Benchmarking the gateway: {REQUESTS} requests per scenario, concurrency {CONCURRENCY}, redis {REDIS_MODE}")
+    start = time.time()
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(providers_config(STUB_PORT), f)
+    configure_environment(f.name)
+    stubs = start_stubs(STUB_PORT)
+    try:
+        results = asyncio.run(run_benchmarks(sys.argv[1:]))
+    finally:
+        stubs.terminate()
+        os.unlink(f.name)
+    if OUTPUT:
+        with open(OUTPUT, "w") as out:
+            json.dump(results, out, indent=2)
+    logger.info(f"Done in {time.time() - start:.1f}s")
+    if BASELINE:
+        with open(BASELINE) as baseline_file:
+            found = regressions(results, json.load(baseline_file))
+        if found:
+            raise SystemExit("Regressions against the baseline:\n" + "\n".join(found))
+        logger.info(f"No regression against {BASELINE} (tolerance {TOLERANCE:.0%})")
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import logging
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Fresh interpreters per measurement
+RUNS = int(os.getenv("BENCH_RUNS", 5))
+
+# Fail when the median import of main takes longer than this, 0 to only report
+MAX_IMPORT_MS = float(os.getenv("BENCH_MAX_IMPORT_MS", 0))
+
+MODULES = ["app.cache.redis", "app.services.registry", "app.api.general_router", "app.api.router", "main"]
+
+# Imports a module, then reports its import time and whether anything was built
+_IMPORT_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+from app.cache.redis import cache
+from app.services.registry import registry
+print(json.dumps({{
+    "ms": elapsed,
+    "redis_client": cache._redis_client is not None,
+    "provider_clients": registry._clients is not None,
+}}))
+"""
+
+# Runs the application startup and shutdown and reports how long each took
+_LIFESPAN_SCRIPT = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def run():
+    async with main.lifespan(main.app):
+        started = time.perf_counter()
+    return started
+
+started = asyncio.run(run())
+stopped = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": (started - imported) * 1000,
+    "shutdown_ms": (stopped - started) * 1000,
+}))
+"""
+
+
+def run_python(script: str) -> dict:
+    """Run a script in a fresh interpreter from the repository root and parse its last output line"""
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_imports():
+    """Median import time of each module, and whether importing built any resource"""
+    results = {}
+    for module in MODULES:
+        runs = [run_python(_IMPORT_SCRIPT.format(module=module)) for _ in range(RUNS)]
+        eager = [name for name in ("redis_client", "provider_clients") if any(run[name] for run in runs)]
+        results[module] = statistics.median(run["ms"] for run in runs)
+        logger.info(f"import {module:25s} {results[module]:8.1f} ms" + (f"  built at import: {', '.join(eager)}" if eager else ""))
+        if eager:
+            raise SystemExit(f"Importing {module} built {', '.join(eager)}")
+    return results
+
+
+def bench_cold_start():
+    """Median import, startup and shutdown time of the application"""
+    runs = [run_python(_LIFESPAN_SCRIPT) for _ in range(RUNS)]
+    results = {name: statistics.median(run[name] for run in runs) for name in ("import_ms", "startup_ms", "shutdown_ms")}
+    logger.info(f"cold start: import {results['import_ms']:.1f} ms  startup {results['startup_ms']:.1f} ms  "
+                f"shutdown {results['shutdown_ms']:.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    logger.info(f"Benchmarking imports and cold start ({RUNS} runs each)")
+    start = time.time()
+    imports = bench_imports()
+    bench_cold_start()
+    logger.info(f"Done in {time.time() - start:.1f}s")
+    if MAX_IMPORT_MS and imports["main"] > MAX_IMPORT_MS:
+        raise SystemExit(f"Importing main took {imports['main']:.1f} ms, over BENCH_MAX_IMPORT_MS={MAX_IMPORT_MS:.0f}")
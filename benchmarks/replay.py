@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import tempfile
+import statistics
+from typing import Dict, Any, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_providers import StubProvider, serve, completion_text, gemini_body, openai_body
+from benchmarks.bench_gateway import API_KEY, configure_environment, use_redis, quiet_gateway_logs, percentile
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Replays a capture file (CAPTURE_FILE, see app/services/capture.py) against the
+# gateway under a config to evaluate, without calling any provider:
+#
+#   python benchmarks/replay.py capture.jsonl
+#
+# (dependencies: pip install -r requirements-dev.txt)
+#
+# The config under test is REPLAY_CONFIG (a providers config, PROVIDERS_CONFIG
+# when unset) plus any gateway settings in the environment, e.g. ROUTING_STRATEGY
+# or CACHE_EXPIRATION. Every provider of the config is served by a replay stub:
+# a prompt sent to a provider that served it when it was captured gets the
+# recorded outcomes in order (errors and 429s included) after the recorded
+# latency; other requests get the recorded answer after a latency drawn from
+# that provider's recorded latencies. Requests are sent at
+# their captured times and upstream latencies shortened REPLAY_SPEED times;
+# reported latencies are scaled back to real time. A speed-up the gateway
+# cannot sustain shows up as queueing in the replayed latencies. The report compares the
+# captured and replayed cache hit rate, provider mix, error rate and latency.
+#
+# Redis is chosen as in bench_gateway.py (BENCH_REDIS, REDIS_DB) and starts
+# empty, so the replay has a cold cache where production may have had a warm one.
+SPEED = float(os.getenv("REPLAY_SPEED", 10))
+CONFIG = os.getenv("REPLAY_CONFIG", "") or os.getenv("PROVIDERS_CONFIG", "")
+OUTPUT = os.getenv("REPLAY_OUTPUT", "")
+LIMIT = int(os.getenv("REPLAY_LIMIT", 0))
+STUB_PORT = int(os.getenv("STUB_BASE_PORT", 18100))
+
+
+def replayed_prompt(request: Dict[str, Any]) -> str:
+    """Prompt sent during the replay; redacted prompts become a placeholder of the same length"""
+    if "prompt" in request:
+        return request["prompt"]
+    placeholder = f"[redacted {request['prompt_sha256']}]"
+    return placeholder + " " * max(0, request.get("prompt_chars", 0) - len(placeholder))
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def body_text(body: Dict[str, Any]) -> str:
+    """Text of a recorded Gemini or OpenAI-style response body"""
+    try:
+        if "candidates" in body:
+            return "".join(part.get("text", "") for part in body["candidates"][0]["content"]["parts"])
+        return body["choices"][0]["message"]["content"] or ""
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+
+def body_usage(body: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    if "usageMetadata" in body:
+        usage = body["usageMetadata"]
+        return usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0)
+    if "usage" in body:
+        return body["usage"].get("prompt_tokens", 0), body["usage"].get("completion_tokens", 0)
+    return None
+
+
+def request_prompt(body: Dict[str, Any]) -> str:
+    """Last user text of a Gemini or OpenAI-style request body"""
+    try:
+        if "contents" in body:
+            return body["contents"][-1]["parts"][0]["text"]
+        return body["messages"][-1]["content"]
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+
+class Recording:
+    """Upstream outcomes of a capture, indexed by prompt and provider"""
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.attempts: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.answers: Dict[str, Dict[str, Any]] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        for record in records:
+            key = prompt_key(replayed_prompt(record["request"]))
+            for attempt in record.get("upstream", []):
+                self.attempts.setdefault((key, attempt["provider"]), []).append(attempt)
+                if attempt.get("status") == 200:
+                    self.latencies.setdefault(attempt["provider"], []).append(attempt["latency_ms"])
+                    self.answers.setdefault(key, self._answer(attempt))
+
+    @staticmethod
+    def _answer(attempt: Dict[str, Any]) -> Dict[str, Any]:
+        """Text and token usage of a successful attempt, from its body or its redacted summary"""
+        if "body" in attempt:
+            try:
+                body = json.loads(attempt["body"])
+            except ValueError:
+                body = {}
+            usage = body_usage(body)
+            return {"text": body_text(body), "prompt_tokens": usage[0] if usage else 0,
+                    "completion_tokens": usage[1] if usage else 0}
+        usage = attempt.get("usage") or {}
+        completion = usage.get("completion_tokens", 0)
+        return {"text": completion_text(completion)[:attempt.get("content_chars", completion * 4)],
+                "prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": completion}
+
+    def latency_sample(self, provider: str, rng: random.Random) -> float:
+        samples = self.latencies.get(provider) or [latency for values in self.latencies.values() for latency in values]
+        return rng.choice(samples) if samples else 200.0
+
+
+class ReplayStub(StubProvider):
+    """Stub provider answering with the outcomes recorded for each prompt"""
+    def __init__(self, name: str, wire_format: str, recording: Recording, speed: float, seed: int = 0):
+        super().__init__(name, wire_format, seed=seed)
+        self.recording = recording
+        self.speed = speed
+        self.cursors: Dict[str, int] = {}
+
+    def respond(self, path: str, body: Dict[str, Any]):
+        key = prompt_key(request_prompt(body))
+        with self.lock:
+            self.counts["requests"] += 1
+            recorded = self.recording.attempts.get((key, self.name), [])
+            position = self.cursors.get(key, 0)
+            self.cursors[key] = position + 1
+            if position < len(recorded):
+                attempt = recorded[position]
+            else:
+                attempt = {"status": 200, "latency_ms": self.recording.latency_sample(self.name, self.rng)}
+        delay = attempt["latency_ms"] / 1000 / self.speed
+        status = attempt.get("status") or 502
+        if status != 200:
+            headers = {"Content-Type": "application/json"}
+            if attempt.get("retry_after") is not None:
+                headers["Retry-After"] = str(max(0, round(attempt["retry_after"] / self.speed)))
+            return delay, status, headers, [json.dumps({"error": {"code": status, "message": "replayed error"}}).encode()]
+        if "body" in attempt:
+            return delay, 200, {"Content-Type": "application/json"}, [attempt["body"].encode()]
+
+        answer = self.recording.answers.get(key) or {"text": completion_text(64), "prompt_tokens": 0, "completion_tokens": 64}
+        prompt_tokens = answer["prompt_tokens"] or max(1, len(request_prompt(body)) // 4)
+        if self.wire_format == "gemini":
+            payload = gemini_body(answer["text"], prompt_tokens, answer["completion_tokens"])
+        else:
+            payload = openai_body(answer["text"], prompt_tokens, answer["completion_tokens"], body.get("model", self.name))
+        return delay, 200, {"Content-Type": "application/json"}, [json.dumps(payload).encode()]
+
+
+def load_config(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        raw = json.load(f)
+    return raw.get("providers", []) if isinstance(raw, dict) else raw
+
+
+def stub_config(providers: List[Dict[str, Any]], base_port: int) -> Dict[str, Any]:
+    """The config under test with every endpoint pointing at its replay stub and limits kept"""
+    rewritten = []
+    for offset, provider in enumerate(providers):
+        provider = dict(provider)
+        base = f"http://127.0.0.1:{base_port + offset}"
+        if provider.get("wire_format", "openai") == "gemini":
+            provider["endpoint"] = f"{base}/v1beta/models/{{model}}:generateContent"
+        else:
+            provider["endpoint"] = f"{base}/v1/chat/completions"
+        # Keys are not checked by the stubs, but keep their number: limits are per key
+        keys = [key for key in str(provider.get("api_key", "")).split(",") if key.strip()]
+        provider["api_key"] = ",".join(f"replay-{provider['name']}-{i}" for i in range(max(1, len(keys))))
+        provider["api_keys"] = [
+            dict(entry, key=f"replay-{provider['name']}-extra-{i}") if isinstance(entry, dict) else f"replay-{provider['name']}-extra-{i}"
+            for i, entry in enumerate(provider.get("api_keys", []))
+        ]
+        rewritten.append(provider)
+    return {"providers": rewritten}
+
+
+def summarize(latencies: List[float], outcomes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    answered = [outcome for outcome in outcomes if outcome.get("status") == 200]
+    served = [outcome for outcome in answered if not outcome.get("cached")]
+    mix: Dict[str, int] = {}
+    for outcome in served:
+        mix[outcome.get("provider") or "?"] = mix.get(outcome.get("provider") or "?", 0) + 1
+    return {
+        "requests": len(outcomes),
+        "cache_hit_rate": (len(answered) - len(served)) / len(outcomes) if outcomes else 0.0,
+        "error_rate": (len(outcomes) - len(answered)) / len(outcomes) if outcomes else 0.0,
+        "provider_mix": {name: count / len(served) for name, count in sorted(mix.items())} if served else {},
+        "p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "p99_ms": percentile(latencies, 0.99) if latencies else 0.0,
+    }
+
+
+async def replay(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Send the captured requests at their captured pace, REPLAY_SPEED times faster"""
+    import httpx
+    import main
+    from app.cache.redis import cache
+
+    use_redis(cache)
+    outcomes: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    async with main.lifespan(main.app):
+        quiet_gateway_logs()
+        cache.redis_client.flushdb()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway",
+                                     headers={"X-API-Key": API_KEY}, timeout=300) as client:
+            first = records[0]["t"]
+            start = time.perf_counter()
+
+            async def send(index: int, record: Dict[str, Any]) -> None:
+                await asyncio.sleep(max(0.0, (record["t"] - first) / SPEED - (time.perf_counter() - start)))
+                request = {name: value for name, value in record["request"].items()
+                           if name not in ("prompt", "prompt_sha256", "prompt_chars")}
+                request["prompt"] = replayed_prompt(record["request"])
+                sent = time.perf_counter()
+                response = await client.post("/api/ai/generate", json=request)
+                outcome = {"status": response.status_code, "latency_ms": (time.perf_counter() - sent) * 1000 * SPEED}
+                if response.status_code == 200:
+                    body = response.json()
+                    outcome.update(provider=body.get("provider"), cached=body.get("cached", False))
+                outcomes[index] = outcome
+
+            await asyncio.gather(*(send(index, record) for index, record in enumerate(records)))
+    return outcomes
+
+
+def report(captured: Dict[str, Any], replayed: Dict[str, Any]) -> None:
+    logger.info(f"{'':16s} {'captured':>12s} {'replayed':>12s}")
+    logger.info(f"{'requests':16s} {captured['requests']:12d} {replayed['requests']:12d}")
+    for name, label in (("cache_hit_rate", "cache hit rate"), ("error_rate", "error rate")):
+        logger.info(f"{label:16s} {captured[name]:12.1%} {replayed[name]:12.1%}")
+    for name, label in (("p50_ms", "p50 latency ms"), ("p99_ms", "p99 latency ms")):
+        logger.info(f"{label:16s} {captured[name]:12.1f} {replayed[name]:12.1f}")
+    for provider in sorted(set(captured["provider_mix"]) | set(replayed["provider_mix"])):
+        logger.info(f"{'mix ' + provider:16s} {captured['provider_mix'].get(provider, 0):12.1%} "
+                    f"{replayed['provider_mix'].get(provider, 0):12.1%}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or not CONFIG:
+        raise SystemExit("Usage: REPLAY_CONFIG=providers.json python benchmarks/replay.py <capture file>")
+    providers = load_config(CONFIG)
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(stub_config(providers, STUB_PORT), f)
+    configure_environment(f.name)
+    # Do not capture the replay itself
+    os.environ["CAPTURE_FILE"] = ""
+
+    from app.services.capture import read_records
+    records = sorted(read_records(sys.argv[1]), key=lambda record: record["t"])
+    if LIMIT:
+        records = records[:LIMIT]
+    if not records:
+        raise SystemExit(f"No records in {sys.argv[1]}")
+    logger.info(f"Replaying {len(records)} requests from {sys.argv[1]} at {SPEED:g}x against {CONFIG}")
+
+    recording = Recording(records)
+    stubs = {
+        provider["name"]: ReplayStub(provider["name"], provider.get("wire_format", "openai"), recording, SPEED, seed=offset)
+        for offset, provider in enumerate(providers)
+    }
+    servers = serve(stubs, STUB_PORT)
+    start = time.time()
+    try:
+        outcomes = asyncio.run(replay(records))
+    finally:
+        for server in servers:
+            server.shutdown()
+        os.unlink(f.name)
+
+    captured = summarize([record["response"].get("latency_ms", 0.0) for record in records if record["response"].get("status") == 200],
+                         [record["response"] for record in records])
+    replayed = summarize([outcome["latency_ms"] for outcome in outcomes if outcome["status"] == 200], outcomes)
+    report(captured, replayed)
+    if OUTPUT:
+        with open(OUTPUT, "w") as out:
+            json.dump({"captured": captured, "replayed": replayed}, out, indent=2)
+    logger.info(f"Done in {time.time() - start:.1f}s")
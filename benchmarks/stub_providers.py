@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, List, Tuple
+
+# Local stand-ins for the upstream providers, so the gateway can be benchmarked
+# offline. Every stub listens on its own port and speaks one wire format:
+#
+#   gemini  ->  POST .../models/{model}:generateContent and :streamGenerateContent?alt=sse
+#   openai  ->  POST .../chat/completions (Deepseek, Olama, OpenRouter, OpenAI), with "stream": true as SSE
+#
+# Each stub has a profile: a log-normal latency given by its median and p99, an
+# error rate (500s), a rate of 429s with Retry-After, and the completion size.
+# Profiles are changed at run time with POST /_profile, so one set of stub
+# processes serves every benchmark scenario. GET /_health answers once the stub
+# is up. Run standalone with `python benchmarks/stub_providers.py`; ports start
+# at STUB_BASE_PORT in the order of STUBS.
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# name -> wire format, in port order
+STUBS = {"gemini": "gemini", "deepseek": "openai", "openai": "openai"}
+
+BASE_PORT = int(os.getenv("STUB_BASE_PORT", 18100))
+
+DEFAULT_PROFILE = {
+    "latency_ms": 200.0,  # median
+    "latency_p99_ms": 800.0,
+    "error_rate": 0.0,  # share of 500 responses
+    "rate_limit_rate": 0.0,  # share of 429 responses
+    "retry_after": 1,  # seconds, sent with 429s
+    "completion_tokens": 64,
+    "stream_chunks": 8,  # SSE events per streamed response
+}
+
+# z-score of the 99th percentile of a normal distribution
+_Z99 = 2.326
+
+_WORDS = "the quick brown fox jumps over the lazy dog while the gateway routes every request".split()
+
+
+def sample_latency(profile: Dict[str, Any], rng: random.Random) -> float:
+    """Draw a latency in seconds from the log-normal distribution of a profile"""
+    median = max(profile["latency_ms"], 0.0)
+    if median == 0:
+        return 0.0
+    sigma = max(math.log(max(profile["latency_p99_ms"], median) / median) / _Z99, 0.0)
+    return rng.lognormvariate(math.log(median), sigma) / 1000
+
+
+def completion_text(tokens: int) -> str:
+    # About one token per word, as the gateway's estimate assumes
+    return " ".join(_WORDS[i % len(_WORDS)] for i in range(tokens))
+
+
+def prompt_tokens(body: Dict[str, Any]) -> int:
+    return max(1, len(json.dumps(body)) // 4)
+
+
+def gemini_body(text: str, prompt: int, completion: int) -> Dict[str, Any]:
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": prompt, "candidatesTokenCount": completion,
+                          "totalTokenCount": prompt + completion},
+    }
+
+
+def openai_body(text: str, prompt: int, completion: int, model: str) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-stub-{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion},
+    }
+
+
+def split_text(text: str, parts: int) -> List[str]:
+    size = max(1, math.ceil(len(text) / max(parts, 1)))
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def sse_events(wire_format: str, text: str, prompt: int, completion: int, chunks: int, model: str) -> List[bytes]:
+    """Server-sent events of a streamed response"""
+    events = []
+    pieces = split_text(text, chunks)
+    for i, piece in enumerate(pieces):
+        last = i == len(pieces) - 1
+        if wire_format == "gemini":
+            event = {"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}]}
+            if last:
+                event = gemini_body(piece, prompt, completion)
+        else:
+            event = {"object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": "stop" if last else None}]}
+            if last:
+                event["usage"] = {"prompt_tokens": prompt, "completion_tokens": completion,
+                                  "total_tokens": prompt + completion}
+        events.append(b"data: " + json.dumps(event).encode() + b"\n\n")
+    if wire_format != "gemini":
+        events.append(b"data: [DONE]\n\n")
+    return events
+
+
+class StubProvider:
+    """One simulated provider: decides the outcome, delay and body of each request"""
+    def __init__(self, name: str, wire_format: str, profile: Optional[Dict[str, Any]] = None, seed: int = 0):
+        self.name = name
+        self.wire_format = wire_format
+        self.profile = dict(DEFAULT_PROFILE, **(profile or {}))
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    def set_profile(self, profile: Dict[str, Any]) -> None:
+        with self.lock:
+            self.profile = dict(DEFAULT_PROFILE, **profile)
+            self.counts = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    def respond(self, path: str, body: Dict[str, Any]) -> Tuple[float, int, Dict[str, str], List[bytes]]:
+        """Return the delay in seconds, status, headers and body chunks of a response"""
+        with self.lock:
+            profile = self.profile
+            delay = sample_latency(profile, self.rng)
+            roll = self.rng.random()
+            self.counts["requests"] += 1
+            if roll < profile["rate_limit_rate"]:
+                self.counts["rate_limited"] += 1
+                error = (429, {"Retry-After": str(profile["retry_after"])})
+            elif roll < profile["rate_limit_rate"] + profile["error_rate"]:
+                self.counts["errors"] += 1
+                error = (500, {})
+            else:
+                error = None
+        if error is not None:
+            status, headers = error
+            headers["Content-Type"] = "application/json"
+            return delay, status, headers, [json.dumps({"error": {"code": status, "message": "stub error"}}).encode()]
+
+        completion = int(profile["completion_tokens"])
+        text = completion_text(completion)
+        prompt = prompt_tokens(body)
+        model = body.get("model", self.name)
+        streamed = "streamGenerateContent" in path or body.get("stream") is True
+        if streamed:
+            events = sse_events(self.wire_format, text, prompt, completion, int(profile["stream_chunks"]), model)
+            return delay, 200, {"Content-Type": "text/event-stream"}, events
+        if self.wire_format == "gemini":
+            payload = gemini_body(text, prompt, completion)
+        else:
+            payload = openai_body(text, prompt, completion, model)
+        return delay, 200, {"Content-Type": "application/json"}, [json.dumps(payload).encode()]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub: StubProvider = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith("/_health"):
+            self._send_json(200, {"name": self.stub.name, "counts": self.stub.counts, "profile": self.stub.profile})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        if self.path.startswith("/_profile"):
+            self.stub.set_profile(body)
+            self._send_json(200, {"name": self.stub.name, "profile": self.stub.profile})
+            return
+
+        delay, status, headers, chunks = self.stub.respond(self.path, body)
+        streamed = len(chunks) > 1
+        # Streams spread the delay: the first half before the headers, the rest between events
+        first_wait = delay / 2 if streamed else delay
+        time.sleep(first_wait)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if streamed:
+            self.send_header("Connection", "close")
+        else:
+            self.send_header("Content-Length", str(len(chunks[0])))
+        self.end_headers()
+        gap = (delay - first_wait) / max(len(chunks) - 1, 1)
+        for i, chunk in enumerate(chunks):
+            if i and gap:
+                time.sleep(gap)
+            self.wfile.write(chunk)
+            self.wfile.flush()
+        if streamed:
+            self.close_connection = True
+
+
+def make_server(stub: StubProvider, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """HTTP server of one stub provider"""
+    handler = type(f"{stub.name.title()}Handler", (_Handler,), {"stub": stub})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def stub_endpoints(base_port: int = BASE_PORT, host: str = "127.0.0.1") -> Dict[str, str]:
+    """Gateway endpoint of every stub, as used in a providers config"""
+    endpoints = {}
+    for offset, (name, wire_format) in enumerate(STUBS.items()):
+        base = f"http://{host}:{base_port + offset}"
+        if wire_format == "gemini":
+            endpoints[name] = f"{base}/v1beta/models/{{model}}:generateContent"
+        else:
+            endpoints[name] = f"{base}/v1/chat/completions"
+    return endpoints
+
+
+def serve(stubs: Dict[str, StubProvider], base_port: int = BASE_PORT) -> List[ThreadingHTTPServer]:
+    """Start every stub on its port in a background thread"""
+    servers = []
+    for offset, stub in enumerate(stubs.values()):
+        server = make_server(stub, base_port + offset)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        logger.info(f"{stub.name} stub ({stub.wire_format}) listening on port {base_port + offset}")
+    return servers
+
+
+if __name__ == "__main__":
+    profiles = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    stubs = {
+        name: StubProvider(name, wire_format, profiles.get(name), seed=offset)
+        for offset, (name, wire_format) in enumerate(STUBS.items())
+    }
+    serve(stubs)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
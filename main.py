@@ -1,34 +1,85 @@
 from fastapi import FastAPI, Request, Response, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import MutableHeaders
 from typing import Dict, List, Optional, Any
 import uvicorn
 import os
 import json
 import time
 import logging
-from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 
 # Import custom modules
 from app.api.router import router as ai_router
 from app.api.general_router import router as general_router
 from app.api.admin_router import router as admin_router
+from app.api.openai_router import router as openai_router
 from app.core.config import settings
 from app.core.logging import setup_logging
-from app.core.auth import validate_api_key, add_api_key, generate_api_key
+from app.core.auth import validate_api_key, bootstrap_admin_key
+from app.core.lifecycle import lifecycle
+from app.core.tracing import start_server_timing, format_server_timing
+from app.core.compression import CompressionMiddleware, RequestBodyMiddleware
+from app.core.deadline import DeadlineMiddleware
+from app.core.profiling import RouteProfilingMiddleware, route_profiler
+from app.services.health_prober import health_prober
+from app.services.registry import registry
+from app.services.capture import traffic_recorder
+from app.services.usage_log import usage_log, LOGGED_PATHS
+from app.services.analytics import usage_rollups
+from app.services.cache_warmer import cache_warmer
+from app.cache.redis import cache
 
-# Load environment variables
-load_dotenv()
-
-# Setup logging
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# Shared resources (logging, Redis pool, provider clients, background tasks) are
+# set up here rather than when modules are imported, and released on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    
+    # Time the event loop steps of the tasks created from now on (requests, background jobs)
+    route_profiler.install()
+    
+    # Build the provider clients now, so a bad configuration fails the startup and not the first request
+    registry.load()
+    logger.info(f"Providers: {', '.join(registry.names()) or 'none'}")
+    
+    # Initialize default admin API key if not exists (once, whichever worker gets there first)
+    if os.getenv("ADMIN_API_KEY"):
+        logger.info("Admin API key loaded from environment")
+    else:
+        try:
+            api_key_response = bootstrap_admin_key()
+            if api_key_response:
+                logger.warning(f"No ADMIN_API_KEY found in environment. Generated new admin key: {api_key_response.key}")
+                logger.warning(f"Please set this key in your .env file as ADMIN_API_KEY={api_key_response.key}")
+        except Exception as e:
+            logger.error(f"Redis is not reachable at startup: {str(e)}")
+    
+    # Start probing providers with an open circuit
+    health_prober.start()
+    usage_log.add_writer(usage_rollups)
+    usage_log.start()
+    lifecycle.start()
+    try:
+        yield
+    finally:
+        lifecycle.stop()
+        await health_prober.stop()
+        await cache_warmer.stop()
+        await usage_log.stop()
+        usage_rollups.close()
+        traffic_recorder.close()
+        cache.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AI API Management System",
     description="A system to manage multiple AI API providers",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -40,33 +91,120 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Add a Server-Timing header with the per-stage breakdown of each request. This is
+# plain ASGI rather than @app.middleware("http"), which only relays body messages:
+# zero-copy file sends have to reach the server unchanged.
+class ServerTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start_time = time.perf_counter()
+        timings = start_server_timing()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", format_server_timing(timings, (time.perf_counter() - start_time) * 1000))
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+app.add_middleware(ServerTimingMiddleware)
+
+# Leave a usage record of every generation request once its response is sent
+# (streams included). Only appends to the in-memory buffer of the usage log.
+class UsageLogMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not usage_log.enabled or scope["path"] not in LOGGED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        start_time = time.perf_counter()
+        record = usage_log.begin(scope["path"])
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            usage_log.finish(record, status_code, (time.perf_counter() - start_time) * 1000)
+
+app.add_middleware(UsageLogMiddleware)
+
+# Give generation requests a deadline (X-Request-Timeout or the route's default)
+app.add_middleware(
+    DeadlineMiddleware,
+    defaults={
+        "/api/ai/generate": settings.REQUEST_DEADLINE_SECONDS,
+        "/api/ai/chat/completions": settings.REQUEST_DEADLINE_SECONDS,
+        "/v1/chat/completions": settings.REQUEST_DEADLINE_SECONDS,
+        "/api/ai/batch": settings.BATCH_DEADLINE_SECONDS,
+    },
+    maximum=settings.MAX_DEADLINE_SECONDS
+)
+
+# Compress large responses, inflate compressed requests and cap request body sizes
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+app.add_middleware(RequestBodyMiddleware, max_size=settings.MAX_REQUEST_BODY)
+
+# Count the wall, event loop and CPU time of requests per route (outermost, so all the middlewares count)
+app.add_middleware(RouteProfilingMiddleware, profiler=route_profiler, routes=app.routes)
+
 # Include routers
 app.include_router(ai_router, prefix="/api/ai", dependencies=[Depends(validate_api_key)])
 app.include_router(general_router, prefix="/api/general", dependencies=[Depends(validate_api_key)])
 app.include_router(admin_router, prefix="/api/admin")
+app.include_router(openai_router, prefix="/v1", dependencies=[Depends(validate_api_key)])
 
 # Root endpoint
 @app.get("/")
 async def root():
     return {"message": "Welcome to AI API Management System"}
 
-# Health check endpoint
+# Health check endpoint (liveness: the process is up)
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
-# Initialize default admin API key if not exists
-@app.on_event("startup")
-async def startup_event():
-    admin_key = os.getenv("ADMIN_API_KEY")
-    if not admin_key:
-        # Generate a default admin API key if not provided
-        api_key_response = generate_api_key(name="admin", role="admin")
-        logger.warning(f"No ADMIN_API_KEY found in environment. Generated new admin key: {api_key_response.key}")
-        logger.warning(f"Please set this key in your .env file as ADMIN_API_KEY={api_key_response.key}")
-    else:
-        logger.info("Admin API key loaded from environment")
+# Readiness endpoint: whether this worker should get traffic. Fails while the
+# worker starts, while it drains on SIGTERM and when Redis is unreachable.
+@app.get("/ready")
+async def readiness_check(response: Response):
+    try:
+        redis_ok = bool(cache.redis_client.ping())
+    except Exception:
+        redis_ok = False
+    ready = lifecycle.ready and redis_ok
+    if not ready:
+        response.status_code = 503
+    return {
+        "status": "ready" if ready else "not ready",
+        "draining": lifecycle.draining,
+        "services": {
+            "redis": "up" if redis_ok else "down"
+        }
+    }
 
 if __name__ == "__main__":
-    # Use 0.0.0.0 to make the server globally accessible
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # uvicorn picks uvloop and httptools when installed (uvicorn[standard])
+    uvicorn.run(
+        "main:app",
+        host=settings.SERVER_HOST,
+        port=settings.SERVER_PORT,
+        workers=1 if settings.RELOAD else settings.WORKERS,
+        reload=settings.RELOAD,
+        loop="auto",
+        http="auto",
+        timeout_graceful_shutdown=settings.GRACEFUL_SHUTDOWN_SECONDS
+    )
\ No newline at end of file
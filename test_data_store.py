@@ -0,0 +1,68 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.cache.redis import cache
+from app.services.data_store import DataStore, InvalidFilterError, RecordNotFoundError
+
+# Values whose JSON encodings do not sort like the strings themselves
+NAMES = ["ab", "ab ", "ab!", "ab\n", "abc", "ab\0", "ab\1", True]
+
+
+@pytest.fixture
+def store():
+    """A data store on an in-memory Redis holding one record per name"""
+    cache._redis_client = fakeredis.FakeRedis(decode_responses=True)
+    store = DataStore()
+    for name in NAMES:
+        store.create({"name": name})
+    yield store
+    cache._redis_client = None
+
+
+def _names(store, op, value):
+    records, _ = store.query([("name", op, value)], limit=100)
+    return sorted((record["name"] for record in records), key=repr)
+
+
+def test_string_range_filters(store):
+    strings = [name for name in NAMES if isinstance(name, str)]
+    for op, keep in (("gt", lambda s: s > "ab"), ("gte", lambda s: s >= "ab"),
+                     ("lt", lambda s: s < "ab!"), ("lte", lambda s: s <= "ab!"),
+                     ("eq", lambda s: s == "ab")):
+        value = "ab!" if op in ("lt", "lte") else "ab"
+        assert _names(store, op, value) == sorted(filter(keep, strings), key=repr), op
+
+
+def test_boolean_filters(store):
+    assert _names(store, "eq", True) == [True]
+    assert _names(store, "eq", False) == []
+    with pytest.raises(InvalidFilterError):
+        store.query([("name", "gt", False)])
+
+
+def test_updates_and_deletes_move_index_entries(store):
+    records, _ = store.query([("name", "eq", "ab\n")])
+    record = store.update(records[0]["id"], {"name": False})
+    assert _names(store, "eq", "ab\n") == []
+    assert _names(store, "eq", False) == [False]
+    store.delete(record["id"])
+    assert _names(store, "eq", False) == []
+
+
+def test_bulk_creates_are_indexed(store):
+    results = store.bulk(create=[{"name": "zz"}, {"id": "reserved"}])
+    assert [result["status_code"] for result in results["created"]] == [200, 400]
+    assert _names(store, "gt", "ab!") == ["abc", "zz"]
+
+
+def test_ids_that_are_not_record_ids_are_not_found(store):
+    for record_id in ("ids", "idx:name:text", "../ids", 42):
+        with pytest.raises(RecordNotFoundError):
+            store.get(record_id)
+        with pytest.raises(RecordNotFoundError):
+            store.update(record_id, {"name": "x"})
+        with pytest.raises(RecordNotFoundError):
+            store.delete(record_id)
+    results = store.bulk(update=[{"id": "ids", "data": {"name": "x"}}], delete=[{"id": "ids"}])
+    assert [result["status_code"] for result in results["updated"] + results["deleted"]] == [404, 404]
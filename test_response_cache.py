@@ -0,0 +1,44 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.cache.redis import cache
+from app.api.router import GenerateRequest, _generation_params
+from app.services.cache_warmer import WARM_PARAMS
+
+
+@pytest.fixture(autouse=True)
+def redis():
+    cache._redis_client = fakeredis.FakeRedis(decode_responses=True)
+    yield
+    cache._redis_client = None
+
+
+def _cache(request, content):
+    cache.cache_response(request.prompt, _generation_params(request), "gemini", {"content": content},
+                         model=request.model)
+
+
+def _cached(request):
+    cached = cache.get_cached_response(request.prompt, _generation_params(request))
+    return cached and cached["response"]["content"]
+
+
+def test_models_do_not_share_responses():
+    _cache(GenerateRequest(prompt="hello", model="model-x"), "from x")
+    assert _cached(GenerateRequest(prompt="hello", model="model-y")) is None
+    assert _cached(GenerateRequest(prompt="hello")) is None
+    _cache(GenerateRequest(prompt="hello", model="model-y"), "from y")
+    assert _cached(GenerateRequest(prompt="hello", model="model-x")) == "from x"
+    assert _cached(GenerateRequest(prompt="hello", model="model-y")) == "from y"
+
+
+def test_generation_settings_do_not_share_responses():
+    _cache(GenerateRequest(prompt="hello", temperature=0.0), "cold")
+    assert _cached(GenerateRequest(prompt="hello", temperature=1.0)) is None
+    assert _cached(GenerateRequest(prompt="hello", temperature=0.0, max_tokens=10)) is None
+    assert _cached(GenerateRequest(prompt="hello", temperature=0.0)) == "cold"
+
+
+def test_warmed_responses_answer_default_requests():
+    assert WARM_PARAMS == _generation_params(GenerateRequest(prompt="hello"))